@@ -0,0 +1,66 @@
+"""
+Import-time benchmark for the learn module.
+
+Run from the repository root:
+
+    python benchmarks/bench_import.py [--runs 5] [--budget 0.5]
+
+Each run imports learn in a fresh interpreter, the way Mind+ launches a
+script. The median import time is printed as JSON together with the heavy
+modules that the import pulled in; the exit status is 1 when the median
+exceeds the budget (seconds) or when TensorFlow, cv2 or requests were
+imported eagerly.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIBRARIES = os.path.join(HERE, os.pardir, "python", "libraries")
+HEAVY_MODULES = ("tensorflow", "keras", "cv2", "requests")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import learn
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_once() -> dict:
+    """Import learn in a fresh interpreter and return its timing."""
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(LIBRARIES))
+    output = subprocess.check_output([sys.executable, "-c", PROBE], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=0.5,
+                        help="maximum median import time in seconds")
+    args = parser.parse_args(argv)
+
+    samples = [measure_once() for _ in range(args.runs)]
+    seconds = [sample["seconds"] for sample in samples]
+    loaded = sorted({m for sample in samples for m in sample["loaded"]})
+    result = {
+        "import_learn": {
+            "n": len(seconds),
+            "median_s": round(statistics.median(seconds), 4),
+            "max_s": round(max(seconds), 4),
+            "budget_s": args.budget,
+            "heavy_modules_loaded": loaded,
+        }
+    }
+    print(json.dumps(result, indent=2))
+    return 0 if statistics.median(seconds) <= args.budget and not loaded else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
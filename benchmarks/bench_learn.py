@@ -0,0 +1,360 @@
+"""
+Benchmarks for the learn module.
+
+Run from the repository root:
+
+    python benchmarks/bench_learn.py [--iterations 200] [--only load upload]
+                                     [--output results.json] [--metrics]
+
+A small synthetic Keras model is built offline (nothing is downloaded), images
+are generated frames and uploads go to a local HTTP stub, so runs need no
+camera and no network. The results are printed as one JSON object, with
+latency percentiles in milliseconds per benchmark, so that runs can be diffed
+between versions. Messages printed by learn are suppressed.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "python", "libraries"))
+
+import learn  # noqa: E402
+import metrics  # noqa: E402
+
+# Slow operations (model loads, conversions) are repeated at most this many times
+HEAVY_ITERATIONS = 5
+
+
+def build_synthetic_model(num_classes: int = 8, input_size: int = 224):
+    """Build a small MobileNet-like classifier with random weights."""
+    from tensorflow import keras
+
+    inputs = keras.Input((input_size, input_size, 3))
+    x = keras.layers.Conv2D(16, 3, strides=2, padding="same", activation="relu")(inputs)
+    for filters in (32, 64, 128):
+        x = keras.layers.DepthwiseConv2D(3, strides=2, padding="same", activation="relu")(x)
+        x = keras.layers.Conv2D(filters, 1, activation="relu")(x)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    outputs = keras.layers.Dense(num_classes, activation="softmax")(x)
+    return keras.Model(inputs, outputs)
+
+
+def synthetic_frames(count: int, shape: tuple = (480, 640, 3), seed: int = 0) -> list:
+    """Generate reproducible BGR frames the size of a webcam capture."""
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(count)]
+
+
+def summarize(samples: list) -> dict:
+    """Latency statistics in milliseconds."""
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "n": int(len(ms)),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "min_ms": round(float(ms.min()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def write_frames(directory: str, count: int) -> list:
+    """Save synthetic frames as JPEG files and return their paths."""
+    paths = []
+    for i, frame in enumerate(synthetic_frames(count)):
+        path = os.path.join(directory, f"frame_{i:03d}.jpg")
+        learn.cv2.imwrite(path, frame)
+        paths.append(path)
+    return paths
+
+
+def time_calls(fn, iterations: int, warmup: int = 5) -> dict:
+    """Call fn warmup + iterations times and summarize the timed calls."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_inference(model, iterations: int) -> dict:
+    """Single-frame latency of Model.predict versus the traced InferenceModel."""
+    batch = np.random.default_rng(1).random((1, 224, 224, 3), dtype=np.float32) * 255
+    compiled = learn.InferenceModel(model)
+    return {
+        "predict_keras_b1": time_calls(lambda: model.predict(batch, verbose=0), iterations),
+        "predict_compiled_b1": time_calls(lambda: compiled.predict(batch), iterations),
+    }
+
+
+def legacy_preprocess(frame):
+    """The per-frame preprocessing used before ImagePreprocessor."""
+    image = learn.cv2.resize(frame, (224, 224))
+    image = learn.cv2.cvtColor(image, learn.cv2.COLOR_BGR2RGB)
+    img_array = learn.img_to_array(image)
+    img_array = np.expand_dims(img_array, axis=0)
+    return learn.preprocess_input(img_array)
+
+
+def allocated_per_call(fn, calls: int = 50) -> dict:
+    """Peak memory allocated while calling fn (traced by tracemalloc), after a warm-up call."""
+    fn()
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_alloc_kb": round(peak / 1024, 1)}
+
+
+def bench_preprocess(model, iterations: int) -> dict:
+    """Per-frame time and allocations of the legacy pipeline versus ImagePreprocessor."""
+    frames = synthetic_frames(8)
+    preprocessor = learn.ImagePreprocessor(model)
+    max_diff = max(float(np.abs(legacy_preprocess(f) - preprocessor(f)).max()) for f in frames)
+
+    def cycle(fn):
+        state = {"i": 0}
+
+        def call():
+            fn(frames[state["i"] % len(frames)])
+            state["i"] += 1
+        return call
+
+    results = {}
+    for name, fn in (("legacy", legacy_preprocess), ("preprocessor", preprocessor)):
+        results[name] = time_calls(cycle(fn), iterations)
+        results[name].update(allocated_per_call(cycle(fn)))
+    results["max_abs_diff"] = max_diff
+    return results
+
+
+def bench_load(model, iterations: int) -> dict:
+    """load_custom_model: cold (file parsed every time) and warm (in-memory registry)."""
+    heavy = min(iterations, HEAVY_ITERATIONS)
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    try:
+        h5_path = os.path.join(workdir, "synthetic.h5")
+        keras_path = os.path.join(workdir, "synthetic.keras")
+        model.save(h5_path)
+        model.save(keras_path)
+
+        def first_keras_load():
+            # .keras without a converted .h5 next to it: load plus conversion
+            for name in os.listdir(workdir):
+                if name.startswith("synthetic_auto_converted"):
+                    os.remove(os.path.join(workdir, name))
+            learn.load_custom_model(keras_path, use_cache=False)
+
+        learn.clear_model_cache()
+        learn.load_custom_model(h5_path)
+        return {
+            "load_h5_cold": time_calls(
+                lambda: learn.load_custom_model(h5_path, use_cache=False), heavy, warmup=1),
+            "load_keras_first": time_calls(first_keras_load, heavy, warmup=0),
+            "load_keras_converted": time_calls(
+                lambda: learn.load_custom_model(keras_path, use_cache=False), heavy, warmup=1),
+            "load_warm": time_calls(lambda: learn.load_custom_model(h5_path), iterations),
+        }
+    finally:
+        learn.clear_model_cache()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_predict_image(model, iterations: int) -> dict:
+    """predict_image_custom one file at a time versus predict_images_batch."""
+    workdir = tempfile.mkdtemp(prefix="bench_images_")
+    try:
+        paths = write_frames(workdir, 32)
+        state = {"i": 0}
+
+        def single():
+            # Without the memo, each call decodes and runs the model again
+            learn.clear_prediction_memo()
+            learn.predict_image_custom(model, paths[state["i"] % len(paths)])
+            state["i"] += 1
+
+        results = {"predict_image_custom": time_calls(single, iterations)}
+        for batch_size in (8, 32):
+            runs = max(1, iterations // len(paths))
+            stats = time_calls(lambda: learn.predict_images_batch(
+                model, workdir, batch_size=batch_size), runs, warmup=1)
+            stats["per_image_ms"] = round(stats["mean_ms"] / len(paths), 3)
+            results[f"predict_images_batch_b{batch_size}"] = stats
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_conversion(model, iterations: int) -> dict:
+    """convert_model_format between .keras, .h5 and .tflite."""
+    heavy = min(iterations, HEAVY_ITERATIONS)
+    workdir = tempfile.mkdtemp(prefix="bench_convert_")
+    try:
+        h5_path = os.path.join(workdir, "synthetic.h5")
+        keras_path = os.path.join(workdir, "synthetic.keras")
+        model.save(h5_path)
+        model.save(keras_path)
+        images = os.path.join(workdir, "images")
+        os.makedirs(images)
+        write_frames(images, 8)
+
+        cases = {
+            "keras_to_h5": (keras_path, "out.h5", "h5", {}),
+            "h5_to_keras": (h5_path, "out.keras", "keras", {}),
+            "h5_to_tflite": (h5_path, "out.tflite", "tflite", {}),
+            "h5_to_tflite_dynamic": (h5_path, "out_dyn.tflite", "tflite", {"quantization": "dynamic"}),
+            "h5_to_tflite_int8": (h5_path, "out_int8.tflite", "tflite",
+                                  {"quantization": "int8", "representative_dir": images,
+                                   "representative_samples": 8}),
+        }
+        results = {}
+        for name, (source, output, target, options) in cases.items():
+            output_path = os.path.join(workdir, output)
+            results[name] = time_calls(lambda: learn.convert_model_format(
+                source, output_path, target, **options), heavy, warmup=0)
+            results[name]["output_kb"] = round(os.path.getsize(output_path) / 1024, 1)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Accept any POST, read the body and answer with a small JSON document."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes: without this, delayed ACKs add ~40 ms per request
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        body = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def http_stub():
+    """Run a local HTTP server for the duration of the block and yield its URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/api/predict"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_upload(model, iterations: int) -> dict:
+    """send_prediction_data per upload mode and PredictionUploader throughput against a local stub."""
+    workdir = tempfile.mkdtemp(prefix="bench_upload_")
+    try:
+        image_path = write_frames(workdir, 1)[0]
+        image_kb = round(os.path.getsize(image_path) / 1024, 1)
+        results = {}
+        with http_stub() as url:
+            for mode in ("json", "multipart", "raw"):
+                stats = time_calls(lambda: learn.send_prediction_data(
+                    image_path, "bench", 0.5, url, upload_mode=mode), iterations)
+                stats["requests_per_s"] = round(1000.0 / stats["mean_ms"], 1)
+                stats["image_kb"] = image_kb
+                results[f"send_{mode}"] = stats
+
+            uploader = learn.PredictionUploader(url, max_queue=iterations)
+            try:
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    uploader.submit(image_path, "bench", 0.5, block=True)
+                uploader.flush()
+                elapsed = time.perf_counter() - start
+            finally:
+                uploader.close()
+            results["uploader_async"] = {
+                "n": iterations,
+                "sent": uploader.sent,
+                "total_s": round(elapsed, 3),
+                "requests_per_s": round(iterations / elapsed, 1),
+            }
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+BENCHMARKS = {
+    "inference": bench_inference,
+    "preprocess": bench_preprocess,
+    "predict_image": bench_predict_image,
+    "load": bench_load,
+    "conversion": bench_conversion,
+    "upload": bench_upload,
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS),
+                        help="run only these benchmarks")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--metrics", action="store_true",
+                        help="collect learn's stage metrics and include them in the results")
+    args = parser.parse_args(argv)
+
+    import tensorflow as tf
+
+    model = build_synthetic_model()
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "tensorflow": tf.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "iterations": args.iterations,
+        }
+    }
+    if args.metrics:
+        metrics.enable()
+    for name in args.only or BENCHMARKS:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = BENCHMARKS[name](model, args.iterations)
+    if args.metrics:
+        results["metrics"] = metrics.snapshot()
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Write-profile calibration for a robot connected over serial.
+
+Run from the repository root with the robot switched on:
+
+    python benchmarks/bench_serial.py --port /dev/ttyUSB0 [--repeats 3]
+                                      [--frames 24] [--output results.json]
+
+Every write profile of ardSerial.calibrateLink (one buffered write, 64- and
+20-byte chunks with decreasing pacing) sends a stationary gait of rest frames
+and waits for the acks, so the robot holds still. The detected link type, the
+timing of each profile and the fastest profile that got every ack are printed
+as one JSON object; copy it into ardSerial.linkProfiles to make it the default.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "python", "libraries"))
+
+import ardSerial  # noqa: E402
+from SerialCommunication import Communication  # noqa: E402
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", required=True, help="serial port of the robot")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=24,
+                        help="frames of the test gait (5 + 8 * frames bytes per command)")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    port = Communication(args.port, 115200, 1)
+    ardSerial.testPort(ardSerial.goodPorts, port, args.port)
+    if port not in ardSerial.goodPorts:
+        return 1
+    try:
+        calibration = ardSerial.calibrateLink(port, repeats=args.repeats, frames=args.frames,
+                                              apply=False, benchmark=True)
+    finally:
+        ardSerial.closeAllSerial(ardSerial.goodPorts)
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "port": args.port,
+            "repeats": args.repeats,
+            "frames": args.frames,
+        },
+        "calibration": calibration,
+    }
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return 0 if calibration["profile"] is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
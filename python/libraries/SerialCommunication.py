@@ -6,6 +6,8 @@
 # modified from https://blog.csdn.net/u013541325/article/details/113062191
 
 import binascii
+import threading
+from collections import deque
 import serial  # need to install pyserial first
 import serial.tools.list_ports
 
@@ -31,6 +33,12 @@ class Communication(object):
         Ret = False
         self.data = None
         self.b_c_text = None
+        # background reader: complete lines in a ring buffer, waiters woken on arrival
+        self._lines = deque(maxlen=1024)
+        self._partial = b''
+        self._line_cond = threading.Condition()
+        self._reader = None
+        self._reader_stop = threading.Event()
 
         try:
             # open the serial port and get the serial port object
@@ -77,6 +85,7 @@ class Communication(object):
         close serial port
         """
         global Ret
+        self.Stop_Reader()
         # print("self.main_engine.is_open：" + str(self.main_engine.is_open))  # check if the serial port is open
         # determine whether to open
         if self.main_engine.is_open:
@@ -136,6 +145,95 @@ class Communication(object):
         """
         self.main_engine.write(data)
 
+    # Background line reader
+    # A thread blocks in read() until bytes arrive, splits them into lines and
+    # appends them to a ring buffer (the oldest lines are dropped when it is full).
+    # Read_Buffered_Line wakes up as soon as a complete line is available,
+    # so waiting for a reply costs no polling and no sleep granularity.
+    # While the reader runs, do not call Read_Line/Read_Size directly.
+    def Start_Reader(self, max_lines=1024):
+        """
+        start the background line reader
+        :param max_lines: capacity of the line ring buffer
+        :return: True if the reader is running
+        """
+        if self.main_engine is None or not self.main_engine.is_open:
+            return False
+        with self._line_cond:
+            if self._reader is not None and self._reader.is_alive():
+                return True
+            if self._lines.maxlen != max_lines:
+                self._lines = deque(self._lines, maxlen=max_lines)
+            self._reader_stop.clear()
+            self._reader = threading.Thread(target=self._Read_Loop, name='serial-reader-' + str(self.port),
+                                            daemon=True)
+            self._reader.start()
+        return True
+
+    def Stop_Reader(self, timeout=2):
+        """
+        stop the background line reader; buffered lines are kept
+        :param timeout: seconds to wait for the thread
+        """
+        reader = self._reader
+        if reader is None:
+            return
+        self._reader_stop.set()
+        try:
+            self.main_engine.cancel_read()  # wake up a blocking read()
+        except Exception:
+            pass
+        if reader is not threading.current_thread():
+            reader.join(timeout)
+        self._reader = None
+
+    def Reader_Active(self):
+        """
+        whether the background line reader is running
+        """
+        return self._reader is not None and self._reader.is_alive()
+
+    def Read_Buffered_Line(self, timeout=None):
+        """
+        take the oldest buffered line, waiting for one if the buffer is empty
+        :param timeout: seconds to wait (None waits forever)
+        :return: the decoded line including its line ending, or None on timeout
+        """
+        with self._line_cond:
+            self._line_cond.wait_for(lambda: self._lines or not self.Reader_Active(),
+                                     None if timeout is None else max(0, timeout))
+            if self._lines:
+                return self._lines.popleft()
+            return None
+
+    def Drain_Buffer(self):
+        """
+        remove and return everything received so far, including an incomplete last line
+        """
+        with self._line_cond:
+            text = ''.join(self._lines) + self._partial.decode('ISO-8859-1')
+            self._lines.clear()
+            self._partial = b''
+        return text
+
+    def _Read_Loop(self):
+        engine = self.main_engine
+        while not self._reader_stop.is_set():
+            try:
+                data = engine.read(engine.in_waiting or 1)
+            except Exception:
+                break  # port closed or device unplugged
+            if not data:
+                continue
+            with self._line_cond:
+                chunks = (self._partial + data).split(b'\n')
+                self._partial = chunks.pop()
+                if chunks:
+                    self._lines.extend((line + b'\n').decode('ISO-8859-1') for line in chunks)
+                    self._line_cond.notify_all()
+        with self._line_cond:
+            self._line_cond.notify_all()
+
     # more examples
     # self.main_engine.write(bytes(listData))  # send list data listData = [0x01, 0x02, 0xFD] or listData = [1, 2, 253]
     # self.main_engine.write(chr(0x06).encode("utf-8"))  # send a data in hexadecimal
@@ -12,6 +12,11 @@ import threading
 import os
 import config
 import glob
+import queue
+import serial.tools.list_ports
+from collections import deque
+from concurrent.futures import Future
+import metrics
 
 FORMAT = '%(asctime)-15s %(name)s - %(levelname)s - %(message)s'
 '''
@@ -44,7 +49,7 @@ if not config.useMindPlus:
 
     def txt(key):
         global language
-        logger.debug(f"config.strLan is: {config.strLan}.")
+        logger.debug("config.strLan is: %s.", config.strLan)
         language = languageList[config.strLan]
         return language.get(key, textEN[key])
 
@@ -52,16 +57,154 @@ if not config.useMindPlus:
 
 
 def encode(in_str, encoding='utf-8'):
-    if isinstance(in_str, bytes):
+    if isinstance(in_str, (bytes, bytearray, memoryview)):
         return in_str
     else:
         return in_str.encode(encoding)
 
+class FrameEncoder:
+    """
+    Builds the bytes of command frames.
+
+    Binary frames (token + int8/uint8 payload + '~') are packed with struct.Struct
+    objects cached by (length, signed) into a reusable bytearray; binary() returns
+    a memoryview of it that is valid until the next call, so use one encoder per
+    thread (see getEncoder). Payloads exposing an int8 (or, for unsigned, uint8)
+    buffer, such as numpy arrays, are copied in without conversion.
+    """
+
+    def __init__(self, size=256):
+        self._structs = {}
+        self._buffer = bytearray(size)
+
+    def packer(self, length, signed=True):
+        key = (length, signed)
+        packer = self._structs.get(key)
+        if packer is None:
+            packer = self._structs[key] = struct.Struct(('%db' if signed else '%dB') % length)
+        return packer
+
+    def binary(self, token, values, signed=True):
+        """token + packed values + '~'; values are truncated to int like int() does"""
+        try:
+            view = memoryview(values)
+        except TypeError:
+            view = None
+        if view is not None and view.format != ('b' if signed else 'B'):
+            values = view.tolist()
+            view = None
+        length = len(values)
+        if len(self._buffer) < length + 2:
+            self._buffer = bytearray(2 * (length + 2))
+        buffer = self._buffer
+        buffer[0] = ord(token)
+        if view is not None:
+            buffer[1:length + 1] = view.cast('B')
+        else:
+            packer = self.packer(length, signed)
+            try:
+                packer.pack_into(buffer, 1, *values)
+            except struct.error:
+                packer.pack_into(buffer, 1, *map(int, values))    # floats or numeric strings
+        buffer[length + 1] = 126    # '~'
+        return memoryview(buffer)[:length + 2]
+
+    @staticmethod
+    def text(token, values):
+        """token + space separated rounded values + ' \\n' (token + '\\n' without values)"""
+        if len(values) == 0:
+            return (token + '\n').encode()
+        if hasattr(values, 'tolist'):
+            values = values.tolist()
+        return (token + ' '.join(map(str, map(round, values))) + ' \n').encode()
+
+
+_encoders = threading.local()
+
+
+def getEncoder():
+    """FrameEncoder of the calling thread"""
+    encoder = getattr(_encoders, 'encoder', None)
+    if encoder is None:
+        encoder = _encoders.encoder = FrameEncoder()
+    return encoder
+
+
 delayBetweenSlice = 0.001
 
+# Write profiles per link type:
+# chunk  - bytes per write (0: the whole command in one buffered write)
+# delay  - pause after each chunk (None: delayBetweenSlice)
+# flush  - wait until the driver has sent the bytes
+# settle - pause after a single-token command
+linkProfiles = {
+    # native USB CDC (ESP32-S2/S3, RP2040): no UART behind it, the USB stack does the flow control
+    'usb_cdc': {'chunk': 0, 'delay': 0, 'flush': True, 'settle': 0},
+    # USB-UART bridges (CH340, CP210x, FTDI) and CDC boards that may forward to a UART (Arduino 16U2):
+    # the NyBoard's ATmega328P has a 64-byte receive buffer, so keep the original slicing.
+    # Only calibrateLink switches a port to a faster profile, once that profile has passed on the port.
+    'ch340': {'chunk': 20, 'delay': None, 'flush': False, 'settle': 0},
+    'bluetooth': {'chunk': 20, 'delay': 0.001, 'flush': False, 'settle': 0},  # SPP/BLE bridges forward small packets
+    'default': {'chunk': 20, 'delay': None, 'flush': False, 'settle': 0.01},  # unknown link: the original slicing
+}
+nativeCdcVids = (0x303A, 0x2E8A)  # Espressif native USB, Raspberry Pi RP2040
+usbUartVids = (0x1A86, 0x10C4, 0x0403, 0x067B, 0x2341, 0x239A)  # WCH, Silicon Labs, FTDI, Prolific, Arduino, Adafruit
+portLinks = {}      # {SerialPort Object: write profile}
+
+
+def detectLink(port):
+    """Guess the link type of port ('usb_cdc', 'ch340', 'bluetooth' or 'default') from its name and USB ids."""
+    name = str(getattr(port, 'port', port))
+    info = None
+    try:
+        info = next((p for p in serial.tools.list_ports.comports() if p.device == name), None)
+    except Exception as e:
+        logger.debug("Cannot list the serial ports: %s", e)
+    text = name.lower()
+    if info is not None:
+        text += ' ' + str(info.description).lower() + ' ' + str(info.hwid).lower()
+    if any(key in text for key in ('bluetooth', 'bthenum', 'rfcomm', 'spp')):
+        return 'bluetooth'
+    vid = getattr(info, 'vid', None)
+    if vid in nativeCdcVids:
+        return 'usb_cdc'
+    if vid in usbUartVids or any(key in text for key in ('wchusbserial', 'ttyusb', 'ttyacm', 'usbmodem')):
+        return 'ch340'
+    return 'default'
+
+
+def getLinkProfile(port):
+    profile = portLinks.get(port)
+    if profile is None:
+        link = detectLink(port) if hasattr(port, 'port') else 'default'
+        logger.debug("Link of %s: %s", getattr(port, 'port', port), link)
+        profile = portLinks[port] = linkProfiles[link]
+    return profile
+
+
+def setLinkProfile(port, profile):
+    """Force the write profile of port: a key of linkProfiles or a profile dict."""
+    portLinks[port] = linkProfiles[profile] if isinstance(profile, str) else dict(profile)
+
+
+def writeToPort(port, data):
+    profile = getLinkProfile(port)
+    chunk = profile['chunk']
+    delay = delayBetweenSlice if profile['delay'] is None else profile['delay']
+    if not chunk:
+        port.Send_data(data)
+    else:
+        for start in range(0, len(data), chunk):
+            port.Send_data(data[start:start + chunk])
+            if delay:
+                time.sleep(delay)
+    if profile['flush']:
+        port.main_engine.flush()
+    return profile
+
 def serialWriteNumToByte(port, token, var=None):  # Only to be used for c m u b I K L o within Python
     # print("Num Token "); print(token);print(" var ");print(var);print("\n\n");
-    logger.debug(f'serialWriteNumToByte, token={token}, var={var}')
+    logger.debug('serialWriteNumToByte, token=%s, var=%s', token, var)
     in_str = ""
     if var is None:
         var = []
@@ -96,8 +239,7 @@ def serialWriteNumToByte(port, token, var=None):  # Only to be used for c m u b
                     var[i] //=2
             printH('rescaled:\n',var)
             
-        var = list(map(int, var))
-        in_str = token.encode() + struct.pack('b' * len(var), *var) + '~'.encode()
+        in_str = getEncoder().binary(token, var)
 
     else:
         if token.isupper():# == 'L' or token == 'I' or token == 'B' or token == 'C':
@@ -106,65 +248,101 @@ def serialWriteNumToByte(port, token, var=None):  # Only to be used for c m u b
 #            else:
 #                packType = 'b'
 #            port.Send_data(token.encode())
-            if len(var)>0:
+            message = var
+            if token == 'B':
                 message = list(map(int, var))
-                if token == 'B':
-                    for l in range(len(message)//2):
-                        message[l*2+1]*= 8  #change 1 to 8 to save time for tests
-                        # print(message[l*2],end=",")
-                        # print(message[l*2+1],end=",")
-                        logger.debug(f"{message[l*2]},{message[l*2+1]}")
-            if token == 'W' or token == 'C':
-                in_str = struct.pack('B' * len(message), *message)    # B - unsigned char, e.g. 'B'*3 means 'BBB'
-            else:
-                in_str = struct.pack('b' * len(message), *message)    # b - signed char, e.g. 'b'*3 means 'bbb'
-            in_str = token.encode() + in_str + '~'.encode()
+                for l in range(len(message)//2):
+                    message[l*2+1]*= 8  #change 1 to 8 to save time for tests
+                    # print(message[l*2],end=",")
+                    # print(message[l*2+1],end=",")
+                    logger.debug("%s,%s", message[l*2], message[l*2+1])
+            # W and C are unsigned char (B), the others signed char (b)
+            in_str = getEncoder().binary(token, message, signed=not (token == 'W' or token == 'C'))
 
         else:#if token == 'c' or token == 'm' or token == 'i' or token == 'b' or token == 'u' or token == 't':
-            message = ""
-            for element in var:
-                message +=  (str(round(element))+" ")
-            in_str = token.encode()+encode(message) +'\n'.encode()
-
-    slice = 0
-    while len(in_str) > slice:
-        if len(in_str) - slice >= 20:
-            port.Send_data(in_str[slice:slice+20])
-        else:
-            port.Send_data(in_str[slice:])
-        slice+=20
-        time.sleep(delayBetweenSlice)
-    logger.debug(f"!!!! {in_str}")
+            in_str = FrameEncoder.text(token, var)
+
+    with metrics.timer("serial_write"):
+        writeToPort(port, in_str)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("!!!! %s", bytes(in_str))
             #print(encode(in_str))
 #            port.Send_data(encode(message))
 
 
 def serialWriteByte(port, var=None):
-    logger.debug(f'serial_write_byte, var={var}')
+    logger.debug('serial_write_byte, var=%s', var)
     if var is None:
         var = []
     token = var[0][0]
     # print var
     if (token == 'c' or token == 'm' or token == 'i' or token == 'b' or token == 'u' or token == 't') and len(var) >= 2:
-        in_str = ""
-        for element in var:
-            in_str = in_str + element + " "
-        in_str += '\n'
+        in_str = ' '.join(var) + ' \n'
     elif token == 'L' or token == 'I':
         if len(var[0]) > 1:
             var.insert(1, var[0][1:])
         var[1:] = list(map(int, var[1:]))
-        in_str = token.encode() + struct.pack('b' * (len(var) - 1), *var[1:]) + '~'.encode()
+        in_str = getEncoder().binary(token, var[1:])
     elif token == 'w' or token == 'k':
         in_str = var[0] + '\n'
     else:
         in_str = token + '\n'
-    logger.debug(f"!!!!!!! {in_str}")
-    port.Send_data(encode(in_str))
-    time.sleep(0.01)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("!!!!!!! %s", bytes(encode(in_str)))
+    with metrics.timer("serial_write"):
+        profile = writeToPort(port, encode(in_str))
+        if profile['settle']:
+            time.sleep(profile['settle'])
+
+
+useReaderThread = True   # read responses with the port's background line reader instead of polling
+
+
+def startReader(port):
+    """Start the background line reader of port if enabled; returns True if it is running."""
+    if not useReaderThread or not hasattr(port, 'Start_Reader'):
+        return False
+    return port.Reader_Active() or port.Start_Reader()
+
+
+def readPreviousBuffer(port):
+    """Discard and return whatever the robot sent since the last response."""
+    if hasattr(port, 'Reader_Active') and port.Reader_Active():
+        return port.Drain_Buffer()
+    return port.main_engine.read_all().decode('ISO-8859-1')
+
+
+def isResponseToken(response, token):
+    responseTrim = response.split('\r')[0]
+    logger.debug("responseTrim is: %s", responseTrim)
+    return responseTrim.lower() == token.lower() or (token == 'p' and responseTrim == 'k')
+
+
+def responseTimeout(token, timeout=0):
+    """Seconds to wait for the echo of token: about 4 s for k/K, 5 s otherwise, or less if timeout is set."""
+    limit = 4 if token == 'k' or token == 'K' else 5
+    return min(limit, timeout) if timeout > 0 else limit
+
+
+def waitSerialMessage(port, token, timeout=0):
+    # Event-driven version of printSerialMessage: blocks on the reader's buffer and
+    # wakes up on each complete line. Same deadlines as the polling loop.
+    startTime = time.time()
+    deadline = startTime + responseTimeout(token, timeout)
+    allPrints = []
+    while True:
+        response = port.Read_Buffered_Line(deadline - time.time())
+        if response is None:
+            logger.debug("Elapsed time: %s seconds", round(time.time() - startTime, 3))
+            return -1
+        if isResponseToken(response, token):
+            return [response, ''.join(allPrints)]
+        allPrints.append(response)
 
 
 def printSerialMessage(port, token, timeout=0):
+    if port and hasattr(port, 'Reader_Active') and port.Reader_Active():
+        return waitSerialMessage(port, token, timeout)
     if token == 'k' or token == 'K':
         threshold = 4
     else:
@@ -179,12 +357,8 @@ def printSerialMessage(port, token, timeout=0):
         if port:
             response = port.main_engine.readline().decode('ISO-8859-1')
             if response != '':
-                # logger.debug(f"response is: {response}")
-                responseTrim = response.split('\r')[0]
-                logger.debug(f"responseTrim is: {responseTrim}")
-                if responseTrim.lower() == token.lower(): 
-                    return [response, allPrints]
-                elif token == 'p' and responseTrim == 'k':
+                # logger.debug("response is: %s", response)
+                if isResponseToken(response, token):
                     return [response, allPrints]
                 else:
                     # print(response, flush=True)
@@ -193,7 +367,7 @@ def printSerialMessage(port, token, timeout=0):
         if (now - startTime) > threshold:
             # print('Elapsed time: ', end='')
             # print(threshold, end=' seconds\n', flush=True)
-            logger.debug(f"Elapsed time: {threshold} seconds")
+            logger.debug("Elapsed time: %s seconds", threshold)
             threshold += 2
             if threshold > 5:
                 return -1
@@ -201,32 +375,228 @@ def printSerialMessage(port, token, timeout=0):
             return -1
 
 
+def writeTask(port, task):
+    if len(task) == 2:
+        #        print('a')
+        #        print(task[0])
+        serialWriteByte(port, [task[0]])
+    elif isinstance(task[1][0], int):
+        #        print('b')
+        serialWriteNumToByte(port, task[0], task[1])
+    else:
+        #        print('c') #which case
+        serialWriteByte(port, task[1])
+
+
+def waitBarrier(barrier):
+    if barrier is None:
+        return
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        logger.debug("Barrier broken, sending without waiting for the other ports")
+
+
+def sendTaskDirect(port, task, timeout=0):
+    # stop-and-wait on the calling thread: drain, write, wait for the echo token
+    previousBuffer = readPreviousBuffer(port)
+    if previousBuffer:
+        logger.debug("Previous buffer: %s", previousBuffer)
+    writeTask(port, task)
+    token = task[0][0]
+#    printH("token",token)
+    if token == 'I' or token =='L':
+        timeout = 1 # in case the UI gets stuck
+    with metrics.timer("serial_response_wait"):
+        lastMessage = printSerialMessage(port, token, timeout)
+    if lastMessage == -1:
+        metrics.count("serial_timeouts")
+    return lastMessage
+
+
+class CommandScheduler:
+    """
+    Per-port command queue keeping up to `window` commands in flight.
+
+    A writer thread sends the queued tasks as soon as a slot is free, a matcher
+    thread reads the port's line buffer and resolves the oldest command in flight
+    when its echo token arrives (FIFO; 'p' is acknowledged by 'k'). A slot stays
+    busy for task[-1] seconds after the ack, so window=1 keeps the timing of the
+    stop-and-wait loop. Results are [response, allPrints], or -1 on timeout.
+    Callbacks run on the matcher thread and should return quickly.
+    """
+
+    def __init__(self, port, window=1):
+        self.port = port
+        self.window = max(1, window)
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._inflight = deque()    # [token, future, deadline, sentTime, prints, delay]
+        self._holding = []          # release times of acknowledged slots still pausing
+        self._closed = False
+        startReader(port)
+        self._writer = threading.Thread(target=self._writeLoop, name='serial-writer', daemon=True)
+        self._matcher = threading.Thread(target=self._matchLoop, name='serial-matcher', daemon=True)
+        self._writer.start()
+        self._matcher.start()
+
+    def submit(self, task, timeout=0, callback=None, barrier=None):
+        """
+        queue a task without waiting for it
+        :param task: [token, var=[], time], as for sendTask
+        :param timeout: seconds to wait for the echo (0: default for the token)
+        :param callback: called with the result when the command completes
+        :param barrier: threading.Barrier to pass right before writing, to start several ports together
+        :return: concurrent.futures.Future resolved with the result
+        """
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(-1 if f.cancelled() or f.exception() else f.result()))
+        if self._closed:
+            future.set_result(-1)
+        else:
+            self._queue.put((task, timeout, future, barrier))
+        return future
+
+    def pending(self):
+        """number of commands queued or waiting for their ack"""
+        return self._queue.qsize() + len(self._inflight)
+
+    def close(self):
+        """stop the threads; commands not yet acknowledged resolve to -1"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._queue.put(None)
+        for t in (self._writer, self._matcher):
+            if t is not threading.current_thread():
+                t.join(2)
+        with self._cond:
+            leftovers = [entry[1] for entry in self._inflight]
+            self._inflight.clear()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftovers.append(item[2])
+                if item[3] is not None:
+                    item[3].abort()     # do not keep the other ports waiting
+        for future in leftovers:
+            if not future.done() and (future.running() or future.set_running_or_notify_cancel()):
+                future.set_result(-1)
+
+    def _waitForSlot(self):
+        # called with self._cond held
+        while not self._closed:
+            now = time.time()
+            self._holding = [t for t in self._holding if t > now]
+            if len(self._inflight) + len(self._holding) < self.window:
+                return True
+            self._cond.wait(min(self._holding) - now if self._holding else None)
+        return False
+
+    def _writeLoop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            task, timeout, future, barrier = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._cond:
+                if not self._waitForSlot():
+                    future.set_result(-1)
+                    continue
+                idle = not self._inflight
+            token = task[0][0]
+            try:
+                if idle:    # nothing in flight: whatever is buffered is stale
+                    previousBuffer = readPreviousBuffer(self.port)
+                    if previousBuffer:
+                        logger.debug("Previous buffer: %s", previousBuffer)
+                waitBarrier(barrier)
+                writeTask(self.port, task)
+            except Exception as e:
+                metrics.count("serial_errors")
+                if barrier is not None:
+                    barrier.abort()     # do not keep the other ports waiting
+                future.set_exception(e)
+                continue
+            if token == 'I' or token == 'L':
+                timeout = 1  # in case the UI gets stuck
+            now = time.time()
+            with self._cond:
+                self._inflight.append([token, future, now + responseTimeout(token, timeout), now, [], task[-1]])
+                self._cond.notify_all()
+
+    def _matchLoop(self):
+        while True:
+            with self._cond:
+                while not self._inflight and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                deadline = self._inflight[0][2]
+            # short waits, so that close() does not wait for the whole reply timeout
+            response = self.port.Read_Buffered_Line(min(deadline - time.time(), 0.2))
+            with self._cond:
+                if not self._inflight:
+                    continue
+                entry = self._inflight[0]
+                if response is None:
+                    if time.time() < entry[2] and self.port.Reader_Active():
+                        continue
+                    logger.debug("Elapsed time: %s seconds", round(time.time() - entry[3], 3))
+                    metrics.count("serial_timeouts")
+                    result = -1
+                elif isResponseToken(response, entry[0]):
+                    result = [response, ''.join(entry[4])]
+                else:
+                    entry[4].append(response)
+                    continue
+                self._inflight.popleft()
+                self._holding.append(time.time() + entry[5])
+                self._cond.notify_all()
+            metrics.observe("serial_response_wait", time.time() - entry[3])
+            entry[1].set_result(result)
+
+
+commandWindow = 1   # commands in flight per port; 1 keeps the robot's input buffer safe
+schedulers = {}     # {SerialPort Object: CommandScheduler}
+
+
+def getScheduler(port, window=None):
+    """Return the command scheduler of port, created on first use; None if the port has no line reader."""
+    with lock:
+        scheduler = schedulers.get(port)
+        if scheduler is None:
+            if not startReader(port):
+                return None
+            scheduler = schedulers[port] = CommandScheduler(port, commandWindow if window is None else window)
+        return scheduler
+
+
+def stopScheduler(port):
+    with lock:
+        scheduler = schedulers.pop(port, None)
+    if scheduler is not None:
+        scheduler.close()
+
+
 def sendTask(PortList, port, task, timeout=0):  # task Structure is [token, var=[], time]
-    logger.debug(f"{task}")
+    logger.debug("%s", task)
     global returnValue
     #    global sync
     #    print(task)
     if port:
         try:
-            previousBuffer = port.main_engine.read_all().decode('ISO-8859-1')
-            if previousBuffer:
-                logger.debug(f"Previous buffer: {previousBuffer}")
-                pass
-            if len(task) == 2:
-                #        print('a')
-                #        print(task[0])
-                serialWriteByte(port, [task[0]])
-            elif isinstance(task[1][0], int):
-                #        print('b')
-                serialWriteNumToByte(port, task[0], task[1])
+            scheduler = getScheduler(port)
+            if scheduler is not None:
+                lastMessage = scheduler.submit(task, timeout).result()
             else:
-                #        print('c') #which case
-                serialWriteByte(port, task[1])
-            token = task[0][0]
-#            printH("token",token)
-            if token == 'I' or token =='L':
-                timeout = 1 # in case the UI gets stuck
-            lastMessage = printSerialMessage(port, token, timeout)
+                lastMessage = sendTaskDirect(port, task, timeout)
             time.sleep(task[-1])
         #    with lock:
         #        sync += 1
@@ -235,8 +605,8 @@ def sendTask(PortList, port, task, timeout=0):  # task Structure is [token, var=
         #        printH('thread',portDictionary[port])
         except Exception as e:
             #        printH('Fail to send to port',PortList[port])
-            if port in PortList:
-                PortList.pop(port)
+            metrics.count("serial_errors")
+            removePort(PortList, port)
             lastMessage = -1
     else:
         lastMessage = -1
@@ -244,19 +614,80 @@ def sendTask(PortList, port, task, timeout=0):  # task Structure is [token, var=
     return lastMessage
 
 
+def removePort(PortList, port):
+    with lock:
+        PortList.pop(port, None)
+    stopScheduler(port)
+
+
+def startTaskDirect(port, task, timeout=0, barrier=None):
+    # for ports without a scheduler: stop-and-wait on a thread of its own
+    future = Future()
+
+    def run():
+        try:
+            waitBarrier(barrier)
+            future.set_result(sendTaskDirect(port, task, timeout))
+        except Exception as e:
+            if barrier is not None:
+                barrier.abort()
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+barrierTimeout = 5  # seconds a port waits for the others in a synchronized send
+
+
+def sendTaskAll(ports, task, timeout=0, synchronized=True, portList=None):
+    """
+    Send task to all ports and wait for every ack.
+
+    Each port's CommandScheduler thread writes the command; with synchronized=True
+    they first meet at a barrier, so all robots start the move together.
+    Returns {SerialPort Object: result}, in the order of ports. Ports that fail
+    get -1 and are removed from portList: by default ports itself when it is a
+    dict, otherwise goodPorts.
+    """
+    if portList is None:
+        portList = ports if isinstance(ports, dict) else goodPorts
+    ports = list(dict.fromkeys(ports))
+    if not ports:
+        return {}
+    barrier = None
+    if synchronized and len(ports) > 1:
+        barrier = threading.Barrier(len(ports), timeout=barrierTimeout)
+    futures = {}
+    for port in ports:
+        scheduler = getScheduler(port)
+        if scheduler is not None:
+            futures[port] = scheduler.submit(task, timeout, barrier=barrier)
+        else:
+            futures[port] = startTaskDirect(port, task, timeout, barrier)
+    results = {}
+    for port, future in futures.items():
+        try:
+            results[port] = future.result()
+        except Exception as e:
+            logger.debug("Fail to send to port %s: %s", getattr(port, 'port', port), e)
+            metrics.count("serial_errors")
+            removePort(portList, port)
+            results[port] = -1
+    time.sleep(task[-1])
+    return results
+
+
 def sendTaskParallel(ports, task, timeout=0):
-    global returnValue
-    #    global sync
-    #    sync = 0
-    threads = list()
-    for p in ports:
-        t = threading.Thread(target=sendTask, args=(goodPorts, p, task, timeout))
-        threads.append(t)
-        t.start()
-    for t in threads:
-        if t.is_alive():
-            t.join()
-    return returnValue
+    """
+    Send task to all ports together and return the result of the first port.
+
+    Only the first port's result is returned, in the order of ports, even if
+    another robot answers last or fails; use sendTaskAll (or sendAll) to get
+    {SerialPort Object: result} for every port.
+    """
+    results = sendTaskAll(ports, task, timeout)
+    return next(iter(results.values()), -1)
 
 
 def splitTaskForLargeAngles(task):
@@ -306,6 +737,52 @@ def send(port, task, timeout=0):
     return returnResult
 
 
+def sendAll(port, task, timeout=0):
+    """
+    Like send, but returns {SerialPort Object: result} with the result of every port.
+
+    The ports start each command together (see sendTaskAll).
+    """
+    with lock:
+        p = list(port)
+    portList = port if isinstance(port, dict) else goodPorts
+    results = {}
+    for task in splitTaskForLargeAngles(task):
+        results = sendTaskAll(p, task, timeout, portList=portList)
+    return results
+
+
+def sendAsync(port, task, timeout=0, callback=None):
+    """
+    Queue task on the ports without waiting for the robot.
+
+    Commands are pipelined by each port's CommandScheduler (see commandWindow);
+    the pause task[-1] is kept between consecutive commands.
+    Returns {SerialPort Object: Future} for the last piece of the task on each port.
+    """
+    if isinstance(port, dict):
+        p = list(port.keys())
+        portList = port
+    elif isinstance(port, list):
+        p = port
+        portList = goodPorts
+    else:
+        raise ValueError("port must be a dict or list")
+    futures = {}
+    for task in splitTaskForLargeAngles(task):
+        for serialObject in p:
+            scheduler = getScheduler(serialObject)
+            if scheduler is not None:
+                futures[serialObject] = scheduler.submit(task, timeout, callback)
+            else:   # no line reader: fall back to a blocking send
+                future = Future()
+                future.set_result(sendTask(portList, serialObject, task, timeout))
+                if callback is not None:
+                    callback(future.result())
+                futures[serialObject] = future
+    return futures
+
+
 def keepReadingInput(ports):
     while True and len(ports):
         time.sleep(0.001)
@@ -323,6 +800,8 @@ def keepReadingInput(ports):
 
 
 def closeSerialBehavior(port):
+    stopScheduler(port)
+    portLinks.pop(port, None)
     try:
         port.Close_Engine()
     except Exception as e:
@@ -344,6 +823,63 @@ def closeAllSerial(ports, clearPorts=True):
         ports.clear()
 
 
+def calibrateLink(port, candidates=None, repeats=3, frames=24, apply=True, benchmark=False):
+    """
+    Find the fastest write profile the board on port receives reliably.
+
+    Each candidate, from the fastest to the slowest, sends `repeats` times a
+    stationary gait of `frames` rest frames (the robot holds still) and must get
+    every ack back. The first candidate that passes is kept; with benchmark=True
+    all candidates are measured and the passing one with the lowest mean wins.
+    Returns {'link', 'profile', 'results': [{profile, ok, mean_ms, max_ms}, ...]};
+    'profile' is None if no candidate passed.
+    """
+    link = detectLink(port)
+    if candidates is None:
+        candidates = [
+            {'chunk': 0, 'delay': 0, 'flush': True, 'settle': 0},
+            {'chunk': 64, 'delay': 0, 'flush': True, 'settle': 0},
+            {'chunk': 20, 'delay': 0, 'flush': True, 'settle': 0},
+            {'chunk': 20, 'delay': 0.001, 'flush': False, 'settle': 0},
+            {'chunk': 20, 'delay': 0.005, 'flush': False, 'settle': 0},
+            {'chunk': 20, 'delay': 0.02, 'flush': False, 'settle': 0.01},
+        ]
+    legs = rest[4 + 8:4 + 16]
+    gait = [frames, 0, 0, 1] + legs * frames
+    previous = portLinks.get(port)
+    best = None
+    results = []
+    for candidate in candidates:
+        setLinkProfile(port, candidate)
+        times = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            result = sendTask({}, port, ['K', list(gait), 0], 2)
+            if result == -1:
+                break
+            times.append((time.perf_counter() - start) * 1000)
+        ok = len(times) == repeats
+        results.append({'profile': candidate, 'ok': ok,
+                        'mean_ms': round(sum(times) / len(times), 2) if times else None,
+                        'max_ms': round(max(times), 2) if times else None})
+        logger.info("Link profile %s: %s", candidate, 'ok' if ok else 'failed')
+        if ok and not benchmark:
+            break
+        if not ok:
+            time.sleep(1)   # let the board drop the broken frame
+    passed = [r for r in results if r['ok']]
+    if passed:
+        best = min(passed, key=lambda r: r['mean_ms'])['profile']
+    sendTask({}, port, ['d', 0], 1)
+    if best is not None and apply:
+        setLinkProfile(port, best)
+    elif previous is not None:
+        portLinks[port] = previous
+    else:
+        portLinks.pop(port, None)
+    return {'link': link, 'profile': best, 'results': results}
+
+
 balance = [
     1, 0, 0, 1,
     0, 0, 0, 0, 0, 0, 0, 0, 30, 30, 30, 30, 30, 30, 30, 30]
@@ -538,11 +1074,12 @@ def testPort(PortList, serialObject, p):
                 waitTime = 2
             result = sendTask(PortList, serialObject, ['?', 0], waitTime)
             if result != -1:
-                logger.debug(f"Adding in testPort: {p}")
+                logger.debug("Adding in testPort: %s", p)
                 PortList.update({serialObject: p})
                 goodPortCount += 1
                 getModelAndVersion(result)
             else:
+                stopScheduler(serialObject)
                 serialObject.Close_Engine()
                 print('* Port ' + p + ' is not connected to a Petoi device!')
     #    sync +=1
@@ -564,10 +1101,10 @@ def checkPortList(PortList, allPorts, needTesting=True):
             threads.append(t)
             t.start()
         else:
-            logger.debug(f"Adding in checkPortList: {p}")
+            logger.debug("Adding in checkPortList: %s", p)
             PortList.update({serialObject: p.split('/')[-1]})    # remove '/dev/' in the port name
             goodPortCount += 1
-            logger.info(f"Connected to serial port: {p}")
+            logger.info("Connected to serial port: %s", p)
     if needTesting is True:
         for t in threads:
             if t.is_alive():
@@ -579,14 +1116,14 @@ def keepCheckingPort(portList, cond1=None, check=True, updateFunc = lambda:None)
     # portStrList is the serial port string list
     global portStrList
     allPorts = Communication.Print_Used_Com()
-    logger.debug(f"allPorts is {allPorts}")
+    logger.debug("allPorts is %s", allPorts)
     if cond1 is None:
         cond1 = lambda: len(portList) > 0
 
     while cond1():
         time.sleep(0.5)
         currentPorts = Communication.Print_Used_Com()    # string list
-        # logger.debug(f"currentPorts is {currentPorts}")
+        # logger.debug("currentPorts is %s", currentPorts)
         
         if set(currentPorts) - set(allPorts):
             time.sleep(1) #usbmodem is slower in detection
@@ -597,7 +1134,7 @@ def keepCheckingPort(portList, cond1=None, check=True, updateFunc = lambda:None)
                 checkPortList(portList, newPort)
             else:
                 for p in newPort:
-                    logger.debug(f"Adding serial port: {p}")
+                    logger.debug("Adding serial port: %s", p)
                     portName = p.split('/')[-1]
                     portStrList.insert(0, portName)  # remove '/dev/' in the port name
                     tk.messagebox.showinfo(title=txt('Info'), message=txt('New port prompt') + portName)
@@ -610,13 +1147,13 @@ def keepCheckingPort(portList, cond1=None, check=True, updateFunc = lambda:None)
                 inv_dict = {v: k for k, v in portList.items()}
                 for p in closedPort:
                     if inv_dict.get(p.split('/')[-1], -1) != -1:
-                        logger.info(f"Removing {p.split('/')[-1]}")
+                        logger.info("Removing %s", p.split('/')[-1])
                         portList.pop(inv_dict[p.split('/')[-1]])
             else:
                 for p in reversed(closedPort):
                     portName = p.split('/')[-1]
                     if portName in portStrList:
-                        logger.info(f"Removing serial port:{portName}")
+                        logger.info("Removing serial port:%s", portName)
                         portStrList.remove(portName)
             updateFunc()
         allPorts = copy.deepcopy(currentPorts)
@@ -637,7 +1174,7 @@ def showSerialPorts(allPorts):
         
     allPorts = deleteDuplicatedUsbSerial(allPorts)
     for index in range(len(allPorts)):
-        logger.debug(f"port[{index}] is {allPorts[index]} ")
+        logger.debug("port[%s] is %s ", index, allPorts[index])
     print("\n*** Available serial ports: ***")
     print(*allPorts, sep = "\n")
     if platform.system() != "Windows":
@@ -666,10 +1203,10 @@ def connectPort(PortList, needTesting=True, needSendTask=True):
             print('Replug mode')
             replug(PortList, needSendTask)
     else:
-        logger.info(f"Connect to serial port list:")
+        logger.info("Connect to serial port list:")
         for p in PortList:
-            logger.debug(f"datatype of p : {type(p)}")
-            logger.info(f"{PortList[p]}")
+            logger.debug("datatype of p : %s", type(p))
+            logger.info("%s", PortList[p])
             portStrList.append(PortList[p])
                                 
 def replug(PortList, needSendTask=True):
@@ -732,7 +1269,7 @@ def replug(PortList, needSendTask=True):
                         PortList.update({serialObject: portName})
                         portStrList.insert(0, portName)  # remove '/dev/' in the port name
                         goodPortCount += 1
-                        logger.info(f"Connected to serial port: {p}")
+                        logger.info("Connected to serial port: %s", p)
                         tk.messagebox.showinfo(title=txt('Info'), message=txt('New port prompt') + portName)
                         if needSendTask is True:
                             time.sleep(2)
@@ -777,7 +1314,7 @@ def selectList(PortList,ls,win, needSendTask=True):
             PortList.update({serialObject: p.split('/')[-1]})
             portStrList.append(p.split('/')[-1])
             goodPortCount += 1
-            logger.info(f"Connected to serial port: {p}")
+            logger.info("Connected to serial port: %s", p)
             
             if needSendTask is True:
                 time.sleep(2)
@@ -1,28 +1,157 @@
 import os
+import sys
+import logging
 import platform
-import cv2
+import importlib
+import importlib.util
 import numpy as np
 import urllib.request
 import urllib.parse
-import requests
+import urllib.error
+import http.client
 import json
 import base64
 import datetime
+import threading
+import time
+import atexit
+import glob
+import hashlib
+import shutil
+import tempfile
+import queue
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-try:
-    from tensorflow.keras.models import load_model
-    from tensorflow.keras.preprocessing.image import img_to_array
-    from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
-    HAS_KERAS = True
-except ImportError:
-    try:
-        from keras.models import load_model
-        from keras.preprocessing.image import img_to_array
-        from keras.applications.mobilenet_v3 import preprocess_input
-        HAS_KERAS = True
-    except ImportError:
-        HAS_KERAS = False
+import metrics
+
+
+class _ConsoleHandler(logging.StreamHandler):
+    """StreamHandler bound to the current sys.stdout, like print()."""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+# All the messages of this module go through its logger. The default handler
+# writes bare messages to stdout at INFO, the same output as print() in the
+# Mind+ terminal; set_verbosity("quiet") keeps only warnings and errors.
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _handler = _ConsoleHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_VERBOSITY_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "quiet": logging.WARNING,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "silent": logging.CRITICAL + 1,
+}
+
+
+def set_verbosity(level="info") -> None:
+    """
+    Choose how much this module prints.
+
+    Parameters:
+    level (str or int): "info" (default: every message, as in Mind+), "quiet"
+        (only warnings and errors; also silences the Keras progress bar of
+        predict), "error", "silent", "debug", or a logging level.
+    """
+    if isinstance(level, str):
+        if level.lower() not in _VERBOSITY_LEVELS:
+            raise ValueError(
+                f"Livello non valido: {level} (usare uno tra {', '.join(_VERBOSITY_LEVELS)})")
+        level = _VERBOSITY_LEVELS[level.lower()]
+    logger.setLevel(level)
+
+
+def _predict_options() -> dict:
+    """Extra model.predict arguments: no Keras progress bar when not at INFO."""
+    return {} if logger.isEnabledFor(logging.INFO) else {"verbose": 0}
+
+
+class _LazyModule:
+    """Stand-in for a heavy module, imported on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# cv2, requests and TensorFlow take seconds and hundreds of MB to import:
+# resolve them when first needed, so that importing learn stays fast.
+cv2 = _LazyModule("cv2")
+requests = _LazyModule("requests")
+
+# Capability probe only: finding the package does not import it
+HAS_KERAS = (importlib.util.find_spec("tensorflow") is not None or
+             importlib.util.find_spec("keras") is not None)
+
+_keras = None
+_keras_lock = threading.Lock()
+
+
+def _keras_api():
+    """Import the Keras functions used by this module on first use."""
+    global _keras
+    with _keras_lock:
+        if _keras is None:
+            try:
+                from tensorflow.keras.models import load_model
+                from tensorflow.keras.preprocessing.image import img_to_array
+                from tensorflow.keras.applications.mobilenet_v3 import preprocess_input
+            except ImportError:
+                try:
+                    from keras.models import load_model
+                    from keras.preprocessing.image import img_to_array
+                    from keras.applications.mobilenet_v3 import preprocess_input
+                except ImportError:
+                    raise ImportError(
+                        "Keras non è installato. Installare con: pip install keras")
+            _keras = (load_model, img_to_array, preprocess_input)
+    return _keras
+
+
+def load_model(*args, **kwargs):
+    """Keras load_model, imported on first use."""
+    return _keras_api()[0](*args, **kwargs)
+
+
+def img_to_array(img, dtype='float32'):
+    """Keras img_to_array, imported on first use (plain numpy without Keras)."""
+    if not HAS_KERAS:
+        return np.asarray(img, dtype=dtype)
+    return _keras_api()[1](img, dtype=dtype)
+
+
+def preprocess_input(x, data_format=None):
+    """MobileNetV3 preprocess_input, imported on first use."""
+    if not HAS_KERAS:
+        # Senza Keras servono solo per i modelli TFLite: MobileNetV3 include la
+        # normalizzazione nel modello, quindi preprocess_input è l'identità.
+        return x
+    return _keras_api()[2](x, data_format=data_format)
 
 
 def compose_path(filename: str, file_ext: str = '.jpg') -> str:
@@ -65,28 +194,210 @@ def compose_path(filename: str, file_ext: str = '.jpg') -> str:
     return str(file_dir)
 
 
-def capture_webcam_image(camera_index: int = 0) -> str:
+class CameraSession:
     """
-    Capture an image from the webcam and save it temporarily.
+    Keep a webcam open between captures instead of opening it for every frame.
+
+    Sessions are registered per camera index while open, so capture_webcam_image,
+    webcam_predict_label and webcam_predict_confidence reuse the device
+    automatically. The device is released after idle_timeout seconds without
+    reads and reopened transparently on the next read.
 
     Parameters:
-    camera_index (int): Index of the camera to use (default: 0 for primary camera).
+    camera_index (int): Index of the camera to use (default: 0).
+    idle_timeout (float): Seconds of inactivity before the device is released (None or 0 to disable).
+    warmup_frames (int): Frames discarded after opening, to let auto-exposure settle.
+    """
+
+    def __init__(self, camera_index: int = 0, idle_timeout: float = 30.0, warmup_frames: int = 3):
+        if not isinstance(camera_index, int) or camera_index < 0:
+            raise ValueError("camera_index deve essere un intero non negativo.")
+        self.camera_index = camera_index
+        self.idle_timeout = idle_timeout
+        self.warmup_frames = warmup_frames
+        self._cap = None
+        self._lock = threading.RLock()
+        self._last_used = 0.0
+        self._closed = threading.Event()
+        self._watcher = None
+
+    @property
+    def is_open(self) -> bool:
+        """True while the underlying device is open."""
+        return self._cap is not None
+
+    def open(self):
+        """
+        Open the device (if needed) and register the session for its camera index.
+
+        Another session registered for the same index is closed first, so its
+        device is not left open.
+
+        Returns:
+        CameraSession: The session itself.
+        """
+        with _camera_sessions_lock:
+            previous = _camera_sessions.get(self.camera_index)
+        if previous is not None and previous is not self:
+            previous.close()
+        with self._lock:
+            if self._closed.is_set():
+                # A watcher from before close() may still be alive: it stops on its own event
+                self._closed = threading.Event()
+                self._watcher = None
+            if self._cap is None:
+                self._cap = self._open_device()
+            self._last_used = time.monotonic()
+            if self.idle_timeout and (self._watcher is None or not self._watcher.is_alive()):
+                self._watcher = threading.Thread(
+                    target=self._watch_idle, args=(self._closed,),
+                    name=f"camera-{self.camera_index}-idle", daemon=True)
+                self._watcher.start()
+        with _camera_sessions_lock:
+            _camera_sessions[self.camera_index] = self
+        return self
+
+    def read(self):
+        """
+        Read a frame from the device, reopening it if it was released for inactivity.
+
+        Returns:
+        numpy.ndarray: The captured BGR frame.
+        """
+        with self._lock:
+            if self._cap is None:
+                self._cap = self._open_device()
+            with metrics.timer("grab"):
+                ret, frame = self._cap.read()
+            self._last_used = time.monotonic()
+        if not ret:
+            raise RuntimeError("Impossibile catturare l'immagine dalla webcam")
+        return frame
+
+    def release(self):
+        """Release the device but keep the session registered; the next read reopens it."""
+        with self._lock:
+            if self._cap is not None:
+                self._cap.release()
+                self._cap = None
+
+    def close(self):
+        """Release the device and unregister the session."""
+        with self._lock:
+            self._closed.set()
+            self.release()
+        with _camera_sessions_lock:
+            if _camera_sessions.get(self.camera_index) is self:
+                del _camera_sessions[self.camera_index]
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _open_device(self):
+        with metrics.timer("camera_open"):
+            cap = cv2.VideoCapture(self.camera_index)
+            if not cap.isOpened():
+                cap.release()
+                raise RuntimeError(
+                    f"Impossibile accedere alla webcam con indice {self.camera_index}")
+            # I primi frame sono spesso sottoesposti: scartarli
+            for _ in range(self.warmup_frames):
+                cap.grab()
+        return cap
+
+    def _watch_idle(self, closed):
+        while True:
+            timeout = self.idle_timeout
+            # idle_timeout may be changed (or disabled) while the session is open
+            if not timeout or closed.wait(min(timeout, 1.0)):
+                return
+            with self._lock:
+                timeout = self.idle_timeout
+                if closed.is_set() or not timeout:
+                    return
+                if self._cap is not None and time.monotonic() - self._last_used > timeout:
+                    self._cap.release()
+                    self._cap = None
+
+
+_camera_sessions = {}
+_camera_sessions_lock = threading.Lock()
+
+
+def open_camera(camera_index: int = 0, idle_timeout: float = None) -> CameraSession:
+    """
+    Open (or reuse) a persistent camera session for the given index.
+
+    A session registered for camera_index is reused; opening a different
+    CameraSession for the same index closes the registered one first.
+
+    Parameters:
+    camera_index (int): Index of the camera to use (default: 0).
+    idle_timeout (float): Seconds of inactivity before the device is released (0 to disable).
+        Also applied to a session that is already open; None keeps its current
+        value, or 30 seconds for a new session (default: None).
 
     Returns:
-    str: Path to the captured image file.
+    CameraSession: The active session for camera_index.
     """
-    if not isinstance(camera_index, int) or camera_index < 0:
-        raise ValueError("camera_index deve essere un intero non negativo.")
+    session = get_camera_session(camera_index)
+    if session is None:
+        session = CameraSession(
+            camera_index, idle_timeout=30.0 if idle_timeout is None else idle_timeout)
+    elif idle_timeout is not None:
+        # The idle watcher reads idle_timeout at every tick; open() starts one if needed
+        session.idle_timeout = idle_timeout
+    return session.open()
+
+
+def get_camera_session(camera_index: int = 0):
+    """Return the active CameraSession for camera_index, or None."""
+    with _camera_sessions_lock:
+        return _camera_sessions.get(camera_index)
+
+
+def close_camera(camera_index: int = None) -> None:
+    """
+    Close the session for camera_index, or every active session if None.
+
+    Parameters:
+    camera_index (int): Index of the camera to close (default: None, all cameras).
+    """
+    with _camera_sessions_lock:
+        if camera_index is None:
+            sessions = list(_camera_sessions.values())
+        elif camera_index in _camera_sessions:
+            sessions = [_camera_sessions[camera_index]]
+        else:
+            sessions = []
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_camera)
+
+
+def _grab_frame(camera_index: int):
+    """Grab a single frame, through the active session if there is one."""
+    session = get_camera_session(camera_index)
+    if session is not None:
+        return session.read()
 
     # Initialize webcam
-    cap = cv2.VideoCapture(camera_index)
+    with metrics.timer("camera_open"):
+        cap = cv2.VideoCapture(camera_index)
 
     if not cap.isOpened():
         raise RuntimeError(
             f"Impossibile accedere alla webcam con indice {camera_index}")
 
     # Capture frame
-    ret, frame = cap.read()
+    with metrics.timer("grab"):
+        ret, frame = cap.read()
 
     if not ret:
         cap.release()
@@ -94,39 +405,126 @@ def capture_webcam_image(camera_index: int = 0) -> str:
 
     # Release the camera
     cap.release()
+    return frame
+
+
+def capture_webcam_image(camera_index: int = 0) -> str:
+    """
+    Capture an image from the webcam and save it temporarily.
+
+    If a CameraSession is open for camera_index (see open_camera), the frame is
+    read from it instead of opening the device again.
+
+    Parameters:
+    camera_index (int): Index of the camera to use (default: 0 for primary camera).
+
+    Returns:
+    str: Path to the captured image file.
+    """
+    if not isinstance(camera_index, int) or camera_index < 0:
+        raise ValueError("camera_index deve essere un intero non negativo.")
+
+    frame = _grab_frame(camera_index)
 
     # Save the captured image with unique timestamp
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[
         :-3]  # Include milliseconds
     temp_path = compose_path(f"webcam_capture_{timestamp}", ".jpg")
-    cv2.imwrite(temp_path, frame)
+    with metrics.timer("encode"):
+        cv2.imwrite(temp_path, frame)
 
-    print(f"Immagine catturata e salvata in: {temp_path}")
+    logger.info("Immagine catturata e salvata in: %s", temp_path)
     return temp_path
 
 
-def load_custom_model(model_path: str = "mobilenet_NOME_v1.keras"):
+def capture_webcam_frame(camera_index: int = 0) -> np.ndarray:
     """
-    Load a custom trained model from local file or URL with automatic .keras to .h5 conversion.
+    Capture a frame from the webcam and return it in memory, without saving it.
 
     Parameters:
-    model_path (str or keras.Model): Local filename, URL to the model file, or already loaded model.
+    camera_index (int): Index of the camera to use (default: 0 for primary camera).
 
     Returns:
-    model: The loaded Keras model.
+    numpy.ndarray: The captured BGR frame.
     """
-    if not HAS_KERAS:
-        raise ImportError(
-            "Keras non è installato. Installare con: pip install keras")
+    if not isinstance(camera_index, int) or camera_index < 0:
+        raise ValueError("camera_index deve essere un intero non negativo.")
+
+    return _grab_frame(camera_index)
+
+
+_frame_writer = None
+_frame_writer_lock = threading.Lock()
+
+
+def save_frame_async(frame: np.ndarray, filename: str = None):
+    """
+    Save a frame to the webcam_images folder in a background thread.
+
+    Parameters:
+    frame (numpy.ndarray): BGR frame to save.
+    filename (str): File name without extension (default: timestamped name).
+
+    Returns:
+    concurrent.futures.Future: Resolves to the path of the saved image.
+    """
+    global _frame_writer
+    if filename is None:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        filename = f"webcam_capture_{timestamp}"
+    path = compose_path(filename, ".jpg")
+
+    with _frame_writer_lock:
+        if _frame_writer is None:
+            _frame_writer = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="learn-imwrite")
+
+    def _write():
+        with metrics.timer("encode"):
+            written = cv2.imwrite(path, frame)
+        if not written:
+            raise RuntimeError(f"Impossibile salvare l'immagine: {path}")
+        return path
+
+    return _frame_writer.submit(_write)
+
+
+def load_custom_model(model_path: str = "mobilenet_NOME_v1.keras", compiled: bool = False,
+                      batch_sizes: tuple = (1,), use_cache: bool = True, sha256: str = None,
+                      progress=None):
+    """
+    Load a custom trained model from local file or URL with automatic .keras to .h5 conversion.
+
+    Loaded models are kept in a process-wide registry: loading the same file
+    again (same path, modification time, size and options) returns the model
+    already in memory. See invalidate_model and clear_model_cache.
+
+    Parameters:
+    model_path (str or keras.Model): Filename in ~/models, absolute path, URL to the model file,
+        or already loaded model.
+    compiled (bool): Return an InferenceModel with traced, warmed-up inference
+        functions instead of the plain Keras model (default: False).
+    batch_sizes (tuple): Batch sizes to trace when compiled is True (default: (1,)).
+    use_cache (bool): Reuse a model already loaded by this process (default: True).
+    sha256 (str): Expected SHA-256 of a model downloaded from a URL (optional).
+    progress (callable): Download progress callback, called as
+        progress(downloaded, total, bytes_per_second); see print_download_progress.
 
+    Returns:
+    model: The loaded Keras model (or its InferenceModel wrapper), or a
+        TFLiteModel for .tflite files.
+    """
     # Se è già un modello caricato, restituiscilo subito
     if hasattr(model_path, "predict") and hasattr(model_path, "save"):
-        print("✅ Modello già caricato, nessun caricamento necessario.")
+        logger.info("✅ Modello già caricato, nessun caricamento necessario.")
+        if compiled and not isinstance(model_path, InferenceModel):
+            return InferenceModel(model_path, batch_sizes)
         return model_path
 
     # Check if it's a URL
     if isinstance(model_path, str) and model_path.startswith(('http://', 'https://')):
-        final_model_path = _download_model_from_url(model_path)
+        final_model_path = _download_model_from_url(
+            model_path, sha256=sha256, progress=progress)
     else:
         # Local file - compose path
         final_model_path = _get_local_model_path(
@@ -136,33 +534,360 @@ def load_custom_model(model_path: str = "mobilenet_NOME_v1.keras"):
     if not os.path.exists(final_model_path):
         raise FileNotFoundError(f"Modello non trovato: {final_model_path}")
 
+    def load():
+        with metrics.timer("model_load"):
+            return _load_resolved_model(final_model_path, compiled, batch_sizes)
+
+    if not use_cache:
+        return load()
+    options = (bool(compiled), tuple(sorted(batch_sizes)) if compiled else ())
+    return _model_registry.get_or_load(final_model_path, options, load)
+
+
+def _load_resolved_model(final_model_path: str, compiled: bool, batch_sizes: tuple):
+    """Load an existing local model file, converting .keras to .h5 if needed."""
+    # TFLite models run on the interpreter alone, without Keras
+    if isinstance(final_model_path, str) and final_model_path.endswith('.tflite'):
+        model = TFLiteModel(final_model_path)
+        logger.info("✅ Modello TFLite caricato: %s", final_model_path)
+        return model
+
+    if not HAS_KERAS:
+        raise ImportError(
+            "Keras non è installato. Installare con: pip install keras")
+
     # Automatic .keras to .h5 conversion for better compatibility
     if isinstance(final_model_path, str) and final_model_path.endswith('.keras'):
-        h5_path = final_model_path.replace('.keras', '_auto_converted.h5')
-        # Converti solo se il .h5 non esiste o è più vecchio del .keras
-        if not os.path.exists(h5_path) or os.path.getmtime(h5_path) < os.path.getmtime(final_model_path):
-            h5_path = _auto_convert_keras_to_h5(final_model_path)
-        final_model_path = h5_path if h5_path else final_model_path
-        print(
-            f"🔄 Modello .keras convertito o già presente come .h5: {final_model_path}")
+        h5_path, model = _auto_convert_keras_to_h5(final_model_path, return_model=True)
+        if model is not None:
+            # Appena convertito: il modello è già in memoria, niente ricaricamento
+            logger.info("🔄 Modello .keras convertito in .h5: %s", h5_path)
+        elif h5_path:
+            logger.info("🔄 Modello .keras già presente come .h5: %s", h5_path)
+            try:
+                model = _load_model_file(h5_path)
+                _update_conversion_manifest(h5_path, verified=True)
+            except RuntimeError:
+                logger.warning("⚠️ Il modello .h5 convertito non si carica, uso il .keras originale")
+                _update_conversion_manifest(h5_path, success=False, verified=False)
+                model = _load_model_file(final_model_path)
+        else:
+            model = _load_model_file(final_model_path)
+    else:
+        model = _load_model_file(final_model_path)
+
+    if compiled:
+        return InferenceModel(model, batch_sizes)
+    return model
+
+
+class _PendingLoad:
+    """A load in progress, shared by every caller asking for the same model."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.model = None
+        self.error = None
+
+
+class _ModelRegistry:
+    """
+    Thread-safe LRU cache of loaded models.
+
+    Keys are (real path, mtime, size, options), so an updated file is loaded
+    again. Concurrent callers asking for the same key wait for a single load.
+    Eviction is bounded by entry count and by an estimate of the memory used
+    (the model file size).
+    """
+
+    def __init__(self, max_entries: int = 4, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (model, size_bytes)
+        self._pending = {}             # key -> _PendingLoad
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model_path: str, options: tuple) -> tuple:
+        stat = os.stat(model_path)
+        return (os.path.realpath(model_path), stat.st_mtime_ns, stat.st_size, options)
+
+    def get_or_load(self, model_path: str, options: tuple, loader):
+        key = self._key(model_path, options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                logger.info("♻️ Modello già in memoria: %s", model_path)
+                return entry[0]
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = _PendingLoad()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.model
+
+        try:
+            pending.model = loader()
+        except BaseException as e:
+            pending.error = e
+            raise
+        else:
+            with self._lock:
+                self._entries[key] = (pending.model, key[2])
+                self._evict()
+            return pending.model
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+
+    def _evict(self) -> None:
+        # Called with the lock held; always keeps the most recent entry
+        while len(self._entries) > 1 and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and
+                 sum(size for _, size in self._entries.values()) > self.max_bytes)):
+            self._entries.popitem(last=False)
+
+    def invalidate(self, model_path: str) -> int:
+        real_path = os.path.realpath(model_path)
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == real_path]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_model_registry = _ModelRegistry()
+
+
+def invalidate_model(model_path: str) -> int:
+    """
+    Drop a model from the in-process registry, so the next load reads it again.
 
+    Parameters:
+    model_path (str): Local filename, full path or URL, as passed to load_custom_model.
+
+    Returns:
+    int: Number of registry entries removed.
+    """
+    if model_path.startswith(('http://', 'https://')):
+        model_path = _cached_model_path(model_path)
+        if model_path is None:
+            return 0
+    else:
+        model_path = _get_local_model_path(model_path)
+    return _model_registry.invalidate(model_path)
+
+
+def clear_model_cache() -> None:
+    """Drop every model from the in-process registry."""
+    _model_registry.clear()
+
+
+def set_model_cache_limits(max_entries: int = 4, max_bytes: int = None) -> None:
+    """
+    Bound the in-process model registry.
+
+    Parameters:
+    max_entries (int): Maximum number of models kept in memory (None for no limit).
+    max_bytes (int): Maximum total size of the cached model files (None for no limit).
+    """
+    with _model_registry._lock:
+        _model_registry.max_entries = max_entries
+        _model_registry.max_bytes = max_bytes
+        _model_registry._evict()
+
+
+def _load_model_file(final_model_path: str):
+    """Load a Keras model file, retrying with compile=True if compile=False fails."""
     # Load the model with enhanced error handling
     try:
         model = load_model(final_model_path, compile=False)
-        print(f"✅ Modello caricato (compile=False): {final_model_path}")
+        logger.info("✅ Modello caricato (compile=False): %s", final_model_path)
         return model
     except Exception as e:
-        print(f"⚠️ Errore caricamento con compile=False: {e}")
+        logger.warning("⚠️ Errore caricamento con compile=False: %s", e)
         try:
             model = load_model(final_model_path)
-            print(f"✅ Modello caricato (standard): {final_model_path}")
+            logger.info("✅ Modello caricato (standard): %s", final_model_path)
             return model
         except Exception as e2:
-            print(f"⚠️ Errore caricamento standard: {e2}")
+            logger.warning("⚠️ Errore caricamento standard: %s", e2)
             raise RuntimeError(
                 f"Impossibile caricare il modello: {final_model_path}. Vedere dettagli sopra.")
 
 
+class InferenceModel:
+    """
+    Keras model wrapper that runs inference through traced, fixed-shape functions.
+
+    Model.predict builds a data adapter and callbacks on every call, which costs
+    milliseconds per frame. InferenceModel traces one tf.function per batch size
+    at construction, warms them up once, and exposes the same predict()
+    interface, so every predict_* helper uses it transparently. Other attributes
+    (save, layers, input_shape, ...) are forwarded to the wrapped model.
+
+    Parameters:
+    model: The loaded Keras model.
+    batch_sizes (tuple): Batch sizes to trace; 1 is always included.
+    warmup (bool): Run each traced function once immediately (default: True).
+    """
+
+    def __init__(self, model, batch_sizes: tuple = (1,), warmup: bool = True):
+        import tensorflow as tf
+
+        self.model = model
+        self._tf = tf
+        self._sample_shape = tuple(
+            d if d is not None else 224 for d in model.input_shape[1:3]) + tuple(model.input_shape[3:])
+        self.batch_sizes = sorted({1} | {int(b) for b in batch_sizes})
+
+        @tf.function
+        def infer(x):
+            return model(x, training=False)
+
+        self._functions = {
+            b: infer.get_concrete_function(
+                tf.TensorSpec((b,) + self._sample_shape, tf.float32))
+            for b in self.batch_sizes
+        }
+        if warmup:
+            self.warmup()
+
+    def warmup(self) -> None:
+        """Run every traced function once so the first real frame pays no setup cost."""
+        for b, fn in self._functions.items():
+            fn(self._tf.zeros((b,) + self._sample_shape, self._tf.float32))
+
+    def predict(self, x, batch_size: int = None, verbose=0) -> np.ndarray:
+        """
+        Run inference on a batch, splitting it over the traced batch sizes.
+
+        Parameters:
+        x (numpy.ndarray): Input batch of shape (n,) + input shape.
+        batch_size, verbose: Accepted for compatibility with Model.predict; ignored.
+
+        Returns:
+        numpy.ndarray: Model outputs of shape (n, classes).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        outputs = []
+        start = 0
+        while start < len(x):
+            remaining = len(x) - start
+            b = max(size for size in self.batch_sizes if size <= remaining)
+            outputs.append(self._functions[b](self._tf.constant(x[start:start + b])).numpy())
+            start += b
+        return np.concatenate(outputs) if outputs else np.zeros((0,) + tuple(self.model.output_shape[1:]), np.float32)
+
+    def __call__(self, x, training: bool = False):
+        return self.predict(x)
+
+    def __getattr__(self, name):
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+def _tflite_interpreter_class():
+    """Return the TFLite Interpreter class, preferring the standalone tflite_runtime."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        import tensorflow as tf
+        return tf.lite.Interpreter
+    except ImportError:
+        raise ImportError(
+            "Né tflite_runtime né TensorFlow sono installati. Installare con: pip install tflite-runtime")
+
+
+class TFLiteModel:
+    """
+    TFLite inference backend with the same predict() interface as a Keras model.
+
+    Quantized (int8/uint8) inputs and outputs are quantized and dequantized
+    transparently, so predict_image_custom and the other predict_* helpers can
+    drive it like any other model. Only the TFLite interpreter is needed: with
+    tflite_runtime installed, TensorFlow is never imported.
+
+    Parameters:
+    model_path (str): Path to the .tflite file.
+    num_threads (int): Interpreter threads (default: interpreter default).
+    """
+
+    def __init__(self, model_path: str, num_threads: int = None):
+        Interpreter = _tflite_interpreter_class()
+        self.model_path = model_path
+        self._interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch = int(self._input['shape'][0])
+        self._lock = threading.Lock()
+        self.input_shape = (None,) + tuple(int(d) for d in self._input['shape'][1:])
+        self.output_shape = (None,) + tuple(int(d) for d in self._output['shape'][1:])
+
+    def predict(self, x, batch_size: int = None, verbose=0) -> np.ndarray:
+        """
+        Run inference on a batch.
+
+        Parameters:
+        x (numpy.ndarray): Float input batch of shape (n,) + input shape.
+        batch_size, verbose: Accepted for compatibility with Model.predict; ignored.
+
+        Returns:
+        numpy.ndarray: Dequantized model outputs of shape (n, classes).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        with self._lock:
+            if len(x) != self._batch:
+                self._interpreter.resize_tensor_input(
+                    self._input['index'], [len(x)] + list(self.input_shape[1:]))
+                self._interpreter.allocate_tensors()
+                self._batch = len(x)
+            self._interpreter.set_tensor(
+                self._input['index'], self._quantize(x, self._input))
+            self._interpreter.invoke()
+            output = self._interpreter.get_tensor(self._output['index'])
+        return self._dequantize(output, self._output)
+
+    def save(self, path: str) -> None:
+        """Copy the .tflite file to path."""
+        shutil.copyfile(self.model_path, path)
+
+    def __call__(self, x, training: bool = False):
+        return self.predict(x)
+
+    @staticmethod
+    def _quantize(x: np.ndarray, details: dict) -> np.ndarray:
+        dtype = details['dtype']
+        if not np.issubdtype(dtype, np.integer):
+            return x.astype(dtype, copy=False)
+        scale, zero_point = details['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(dtype)
+
+    @staticmethod
+    def _dequantize(y: np.ndarray, details: dict) -> np.ndarray:
+        if not np.issubdtype(details['dtype'], np.integer):
+            return y.astype(np.float32, copy=False)
+        scale, zero_point = details['quantization']
+        return (y.astype(np.float32) - zero_point) * scale
+
+
 def _get_tf_version() -> str:
     """Get TensorFlow version for debugging."""
     try:
@@ -186,6 +911,8 @@ def _detect_model_format(model_path: str) -> str:
         return "HDF5 (.h5)"
     elif model_path.endswith('.pb'):
         return "Protocol Buffer (.pb)"
+    elif model_path.endswith('.tflite'):
+        return "TensorFlow Lite (.tflite)"
     else:
         return f"Formato sconosciuto ({os.path.splitext(model_path)[1]})"
 
@@ -200,8 +927,6 @@ def verify_model_compatibility(model_path: str) -> dict:
     Returns:
     dict: Diagnostic information about the model.
     """
-    import tensorflow as tf
-
     info = {
         "path": model_path,
         "exists": os.path.exists(model_path),
@@ -221,7 +946,10 @@ def verify_model_compatibility(model_path: str) -> dict:
 
             # Try loading with different methods
             try:
-                model = load_model(model_path, compile=False)
+                if model_path.endswith('.tflite'):
+                    model = TFLiteModel(model_path)
+                else:
+                    model = load_model(model_path, compile=False)
                 info["loadable"] = True
                 info["input_shape"] = str(model.input_shape) if hasattr(
                     model, 'input_shape') else "N/A"
@@ -248,36 +976,112 @@ def verify_model_compatibility(model_path: str) -> dict:
     return info
 
 
-def _auto_convert_keras_to_h5(keras_path: str) -> str:
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_conversion_manifest(h5_path: str, manifest: dict) -> None:
+    tmp_path = h5_path + '.manifest.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, h5_path + '.manifest.json')
+
+
+def _new_conversion_manifest(keras_path: str, success: bool) -> dict:
+    stat = os.stat(keras_path)
+    return {
+        "source": os.path.abspath(keras_path),
+        "source_sha256": _file_sha256(keras_path),
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "tensorflow_version": _get_tf_version(),
+        "success": success,
+        "verified": None,
+    }
+
+
+def _update_conversion_manifest(h5_path: str, **fields) -> None:
+    """Record the outcome of using a converted .h5 (e.g. verified=True) in its manifest."""
+    manifest = _read_json(h5_path + '.manifest.json')
+    if manifest and any(manifest.get(k) != v for k, v in fields.items()):
+        manifest.update(fields)
+        _write_conversion_manifest(h5_path, manifest)
+
+
+def _conversion_is_current(keras_path: str, h5_path: str) -> bool:
+    """
+    Check the conversion manifest: True if h5_path is a good conversion of keras_path.
+
+    The source is compared by size and mtime first; only if those changed is
+    it hashed, so touching or copying the .keras does not force a reconversion.
+    """
+    if not os.path.exists(h5_path):
+        return False
+    manifest = _read_json(h5_path + '.manifest.json')
+    if not manifest:
+        # Conversione precedente al manifest: fidarsi del .h5 se più recente
+        if os.path.getmtime(h5_path) > os.path.getmtime(keras_path):
+            manifest = _new_conversion_manifest(keras_path, success=True)
+            _write_conversion_manifest(h5_path, manifest)
+            return True
+        return False
+    if not manifest.get("success") or manifest.get("tensorflow_version") != _get_tf_version():
+        return False
+
+    stat = os.stat(keras_path)
+    if stat.st_size == manifest.get("source_size") and stat.st_mtime_ns == manifest.get("source_mtime_ns"):
+        return True
+    if stat.st_size == manifest.get("source_size") and _file_sha256(keras_path) == manifest.get("source_sha256"):
+        manifest["source_mtime_ns"] = stat.st_mtime_ns
+        _write_conversion_manifest(h5_path, manifest)
+        return True
+    return False
+
+
+def _auto_convert_keras_to_h5(keras_path: str, return_model: bool = False):
     """
     Automatically convert .keras file to .h5 format with caching.
 
+    A manifest next to the .h5 (<name>.h5.manifest.json) records the source
+    hash, size and mtime, the TensorFlow version and the outcome, so later
+    runs reuse the .h5 without reloading anything. The .h5 is not reloaded to
+    verify it: the next load of the .h5 is the verification (see
+    _load_resolved_model), and a failure there marks the manifest so the
+    model is converted again.
+
     Parameters:
     keras_path (str): Path to the .keras file.
+    return_model (bool): Also return the model loaded for the conversion, so the
+        caller does not have to load it again (default: False).
 
     Returns:
     str: Path to the converted .h5 file, or None if conversion failed.
+        With return_model=True, a tuple (h5_path, model); model is None when an
+        existing conversion was reused or the conversion failed.
     """
     if not keras_path.endswith('.keras'):
-        return None
+        return (None, None) if return_model else None
+
+    def result(path, model=None):
+        return (path, model) if return_model else path
 
     # Generate .h5 path
     h5_path = keras_path.replace('.keras', '_auto_converted.h5')
 
     # Check if already converted and cached
+    if _conversion_is_current(keras_path, h5_path):
+        logger.info("📁 Usando modello .h5 già convertito: %s", h5_path)
+        return result(h5_path)
     if os.path.exists(h5_path):
-        # Check if .h5 file is newer than .keras file
-        keras_mtime = os.path.getmtime(keras_path)
-        h5_mtime = os.path.getmtime(h5_path)
-        if h5_mtime > keras_mtime:
-            print(f"📁 Usando modello .h5 già convertito: {h5_path}")
-            return h5_path
-        else:
-            print(f"🔄 Modello .keras più recente, riconversione necessaria")
+        logger.info("🔄 Conversione .h5 non aggiornata o non valida, riconversione necessaria")
 
     # Attempt automatic conversion
     try:
-        print(f"🔄 Conversione automatica {keras_path} → {h5_path}")
+        logger.info("🔄 Conversione automatica %s → %s", keras_path, h5_path)
 
         # Try to load the .keras model with different methods
         model = None
@@ -289,44 +1093,82 @@ def _auto_convert_keras_to_h5(keras_path: str) -> str:
         for i, method in enumerate(load_methods):
             try:
                 model = method()
-                print(
-                    f"✅ Modello .keras caricato per conversione (metodo {i+1})")
+                logger.info("✅ Modello .keras caricato per conversione (metodo %s)", i+1)
                 break
             except Exception as e:
-                print(f"⚠️ Metodo {i+1} fallito: {e}")
+                logger.warning("⚠️ Metodo %s fallito: %s", i+1, e)
                 continue
 
         if model is None:
-            print(f"❌ Impossibile caricare .keras per conversione")
-            return None
+            logger.error("❌ Impossibile caricare .keras per conversione")
+            return result(None)
 
         # Save as .h5
         model.save(h5_path, save_format='h5')
-        print(f"✅ Conversione automatica completata: {h5_path}")
-
-        # Verify the converted model
-        try:
-            test_model = load_model(h5_path, compile=False)
-            print(f"✅ Verifica conversione automatica riuscita")
-            return h5_path
-        except Exception as e:
-            print(f"⚠️ Problemi con il modello convertito: {e}")
-            # Return the path anyway, it might still work
-            return h5_path
+        _write_conversion_manifest(
+            h5_path, _new_conversion_manifest(keras_path, success=True))
+        logger.info("✅ Conversione automatica completata: %s", h5_path)
+        return result(h5_path, model)
 
     except Exception as e:
-        print(f"⚠️ Conversione automatica fallita: {e}")
-        return None
+        logger.warning("⚠️ Conversione automatica fallita: %s", e)
+        return result(None)
+
 
+def _representative_dataset(image_dir: str, samples: int, model=None):
+    """Yield preprocessed captures from image_dir for full-int8 calibration."""
+    paths = _collect_image_paths(image_dir)[:samples]
+    if not paths:
+        raise ValueError(f"Nessuna immagine trovata per la calibrazione in: {image_dir}")
+
+    def generator():
+        preprocessor = ImagePreprocessor(model)
+        for image_path in paths:
+            batch = np.empty((1,) + preprocessor.input_shape, np.float32)
+            if _load_and_preprocess(image_path, preprocessor, batch[0]):
+                yield [batch]
+    return generator
+
+
+def _convert_to_tflite(model, output_path: str, quantization: str = None,
+                       representative_dir: str = None, representative_samples: int = 100) -> None:
+    """Convert a loaded Keras model to a .tflite file, optionally quantized."""
+    import tensorflow as tf
 
-def convert_model_format(input_path: str, output_path: str = None, target_format: str = "h5") -> str:
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantization == "int8":
+        if not representative_dir:
+            raise ValueError(
+                "La quantizzazione int8 richiede representative_dir (cartella di immagini).")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = _representative_dataset(
+            representative_dir, representative_samples, model)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    elif quantization is not None:
+        raise ValueError(f"Quantizzazione non supportata: {quantization}")
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def convert_model_format(input_path: str, output_path: str = None, target_format: str = "h5",
+                         quantization: str = None, representative_dir: str = None,
+                         representative_samples: int = 100) -> str:
     """
     Convert model between different formats to solve compatibility issues.
 
     Parameters:
     input_path (str): Path to input model.
     output_path (str): Path for output model (optional).
-    target_format (str): Target format ('h5', 'keras', 'saved_model').
+    target_format (str): Target format ('h5', 'keras', 'saved_model', 'tflite').
+    quantization (str): For 'tflite' only: None, 'dynamic' (dynamic-range) or
+        'int8' (full integer, needs representative_dir).
+    representative_dir (str): Folder of captures used to calibrate int8 quantization.
+    representative_samples (int): Maximum number of captures used for calibration.
 
     Returns:
     str: Path to converted model.
@@ -343,11 +1185,14 @@ def convert_model_format(input_path: str, output_path: str = None, target_format
             output_path = f"{base_name}_converted.keras"
         elif target_format == "saved_model":
             output_path = f"{base_name}_converted_savedmodel"
+        elif target_format == "tflite":
+            suffix = f"_{quantization}" if quantization else ""
+            output_path = f"{base_name}_converted{suffix}.tflite"
         else:
             raise ValueError(f"Formato non supportato: {target_format}")
 
     try:
-        print(f"🔄 Conversione modello da {input_path} a {output_path}")
+        logger.info("🔄 Conversione modello da %s a %s", input_path, output_path)
 
         # Load the model with best method available
         model = None
@@ -359,10 +1204,10 @@ def convert_model_format(input_path: str, output_path: str = None, target_format
         for i, method in enumerate(load_methods):
             try:
                 model = method()
-                print(f"✅ Modello caricato con metodo {i+1}")
+                logger.info("✅ Modello caricato con metodo %s", i+1)
                 break
             except Exception as e:
-                print(f"⚠️ Metodo {i+1} fallito: {e}")
+                logger.warning("⚠️ Metodo %s fallito: %s", i+1, e)
                 continue
 
         if model is None:
@@ -376,29 +1221,45 @@ def convert_model_format(input_path: str, output_path: str = None, target_format
             model.save(output_path, save_format='keras')
         elif target_format == "saved_model":
             model.save(output_path, save_format='tf')
+        elif target_format == "tflite":
+            _convert_to_tflite(model, output_path, quantization,
+                               representative_dir, representative_samples)
         else:
             raise ValueError(
                 f"Formato di output non supportato: {target_format}")
 
-        print(f"✅ Modello convertito salvato: {output_path}")
+        logger.info("✅ Modello convertito salvato: %s", output_path)
 
         # Verify the converted model loads correctly
         try:
-            test_model = load_model(output_path, compile=False)
-            print(f"✅ Verifica conversione riuscita")
+            if target_format == "tflite":
+                test_model = TFLiteModel(output_path)
+            else:
+                test_model = load_model(output_path, compile=False)
+            logger.info("✅ Verifica conversione riuscita")
             return output_path
         except Exception as e:
-            print(f"⚠️ Problemi con il modello convertito: {e}")
+            logger.warning("⚠️ Problemi con il modello convertito: %s", e)
             return output_path
 
     except Exception as e:
         error_msg = f"❌ Errore durante la conversione: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         raise RuntimeError(error_msg)
 
 
 def _get_local_model_path(model_name: str) -> str:
-    """Get the full path for a local model file."""
+    """
+    Get the full path for a local model file.
+
+    Absolute paths (including ~/...) are used as they are; any other name is
+    resolved inside ~/models, even if a file with the same name exists in the
+    current directory.
+    """
+    model_path = os.path.expanduser(model_name)
+    if os.path.isabs(model_path):
+        return model_path
+
     if platform.system() == "Windows":
         sep = '\\'
         home_dir = os.getenv('HOMEDRIVE')
@@ -422,31 +1283,351 @@ def _get_local_model_path(model_name: str) -> str:
     return model_dir + sep + model_name
 
 
-def _download_model_from_url(url: str) -> str:
-    """Download a model from URL and cache it locally."""
+# Download cache layout in ~/models/cache:
+#   index.json          URL -> {sha256, file, size, etag, last_modified, checked_at, last_access}
+#   <sha256><ext>       downloaded models, named by content hash
+_MODEL_CACHE_INDEX = "index.json"
+_MODEL_CACHE_MAX_BYTES = 2 * 1024 ** 3
+_MODEL_REVALIDATE_AFTER = 3600
+_MODEL_EXTENSIONS = ('.h5', '.keras', '.tflite')
+# Access times are written back only when older than this, so cache hits rarely rewrite index.json
+_MODEL_ACCESS_RESOLUTION = 600
+_model_cache_lock = threading.Lock()     # guards index.json
+_model_download_locks = {}               # url -> Lock held while that URL is downloaded
+
+
+def _load_cache_index(cache_dir: str) -> dict:
     try:
-        # Parse URL to get filename
-        parsed_url = urllib.parse.urlparse(url)
-        filename = os.path.basename(parsed_url.path)
+        with open(os.path.join(cache_dir, _MODEL_CACHE_INDEX), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache_index(cache_dir: str, index: dict) -> None:
+    # Write to a temporary file and rename, so the index is never half-written
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, os.path.join(cache_dir, _MODEL_CACHE_INDEX))
+
+
+def _model_extension(url: str, head: bytes) -> str:
+    """Pick the file extension from the URL, or from the file signature."""
+    ext = os.path.splitext(urllib.parse.urlparse(url).path)[1].lower()
+    if ext in _MODEL_EXTENSIONS:
+        return ext
+    if head.startswith(b'\x89HDF'):
+        return '.h5'
+    if head.startswith(b'PK'):
+        return '.keras'
+    if head[4:8] == b'TFL3':
+        return '.tflite'
+    return '.h5'
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _discard_partial(part_path: str) -> None:
+    for path in (part_path, part_path + '.json'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _response_total(response, offset: int):
+    """Total size of the file being downloaded, from Content-Range or Content-Length."""
+    content_range = response.headers.get('Content-Range')
+    if content_range and '/' in content_range and not content_range.endswith('/*'):
+        return int(content_range.rsplit('/', 1)[1])
+    length = response.headers.get('Content-Length')
+    return offset + int(length) if length is not None else None
+
+
+def print_download_progress(downloaded: int, total: int, bytes_per_second: float) -> None:
+    """Ready-made progress callback for load_custom_model: prints percentage and speed."""
+    # A progress bar rewrites one console line, so it is printed directly (unless quiet)
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    speed = bytes_per_second / (1024 * 1024)
+    if total:
+        print(f"\r⬇️ {downloaded * 100 // total}% ({downloaded // 1024} / {total // 1024} KB, {speed:.1f} MB/s)",
+              end='' if downloaded < total else '\n', flush=True)
+    else:
+        print(f"\r⬇️ {downloaded // 1024} KB ({speed:.1f} MB/s)", end='', flush=True)
 
-        # If no filename in URL, generate one
-        if not filename or not filename.endswith('.keras'):
-            filename = "downloaded_model.keras"
 
-        # Get cache directory
-        cache_dir = _get_model_cache_dir()
-        cached_model_path = os.path.join(cache_dir, filename)
+def _fetch_model(url: str, cache_dir: str, headers: dict, progress=None,
+                 retries: int = 5, backoff: float = 1.0, timeout: float = 30):
+    """
+    Stream url into a .part file in cache_dir, resuming it with HTTP Range requests.
+
+    The .part file is named after the URL and kept across failures (and across
+    runs), so a dropped connection resumes from the last byte received instead
+    of starting over. Failed attempts are retried with exponential backoff; the
+    retry budget is reset whenever an attempt made progress.
+
+    Parameters:
+    progress (callable): Called as progress(downloaded, total, bytes_per_second);
+        total is None when the server does not send a size.
+
+    Returns:
+    tuple: (part_path, sha256, size, response_headers), or None on 304 Not Modified.
+    """
+    part_path = os.path.join(
+        cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest()[:32] + '.part')
+    attempt = 0
+    while True:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers)
+        if offset:
+            # Resume: ask for the rest of the same version of the file
+            request_headers.pop('If-None-Match', None)
+            request_headers.pop('If-Modified-Since', None)
+            request_headers['Range'] = f'bytes={offset}-'
+            validators = _read_json(part_path + '.json')
+            validator = validators.get('etag') or validators.get('last_modified')
+            if validator:
+                request_headers['If-Range'] = validator
+
+        downloaded = offset
+        try:
+            response = urllib.request.urlopen(
+                urllib.request.Request(url, headers=request_headers), timeout=timeout)
+            with response:
+                if offset and response.status == 206:
+                    mode = 'ab'
+                else:
+                    # Full response: the server ignored the range or the file changed
+                    offset = 0
+                    mode = 'wb'
+                    with open(part_path + '.json', 'w') as f:
+                        json.dump({"etag": response.headers.get('ETag'),
+                                   "last_modified": response.headers.get('Last-Modified')}, f)
+                total = _response_total(response, offset)
+                response_headers = response.headers
+
+                downloaded = offset
+                started = time.monotonic()
+                with open(part_path, mode) as f:
+                    while True:
+                        chunk = response.read(256 * 1024)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        if progress is not None:
+                            elapsed = max(time.monotonic() - started, 1e-6)
+                            progress(downloaded, total, (downloaded - offset) / elapsed)
+
+            if total is not None and downloaded != total:
+                raise IOError(f"Download incompleto: {downloaded} di {total} byte")
+            break
+
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            if e.code == 416 and offset:
+                # The partial file does not match the server's: start over
+                _discard_partial(part_path)
+                error = e
+            elif e.code < 500 or attempt >= retries:
+                raise
+            else:
+                error = e
+        except (OSError, http.client.HTTPException) as e:
+            if attempt >= retries:
+                raise
+            error = e
+
+        attempt = 1 if downloaded > offset else attempt + 1
+        delay = min(backoff * 2 ** (attempt - 1), 30)
+        logger.warning("⚠️ Download interrotto (%s), nuovo tentativo %s/%s tra %.0fs",
+                       error, attempt, retries, delay)
+        time.sleep(delay)
+
+    digest = hashlib.sha256()
+    with open(part_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    size = os.path.getsize(part_path)
+    os.remove(part_path + '.json')
+    return part_path, digest.hexdigest(), size, response_headers
+
+
+def _model_cache_companions(filename: str) -> list:
+    """Files stored next to a cached model: its .h5 conversion and the conversion manifest."""
+    stem, ext = os.path.splitext(filename)
+    if ext != '.keras':
+        return []
+    converted = stem + '_auto_converted.h5'
+    return [converted, converted + '.manifest.json']
+
+
+def _remove_cached_model(cache_dir: str, filename: str) -> None:
+    """Delete a cached model file and its companions."""
+    for name in [filename] + _model_cache_companions(filename):
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+
+
+def _evict_model_cache(cache_dir: str, index: dict, max_bytes: int) -> None:
+    """Delete unreferenced models, then least recently used ones until the cache fits in max_bytes."""
+    owned = set()
+    for entry in index.values():
+        owned.add(entry['file'])
+        owned.update(_model_cache_companions(entry['file']))
+    for name in os.listdir(cache_dir):
+        if name not in owned and name.endswith(_MODEL_EXTENSIONS + ('.manifest.json',)):
+            _remove_cached_model(cache_dir, name)
+            logger.info("🧹 Rimosso dalla cache (non più usato): %s", name)
+
+    # Several URLs may share one file: a file is as recent as its most recent URL
+    files = {}
+    for entry in index.values():
+        last = files.get(entry['file'], (0, 0))[0]
+        size = entry.get('size', 0)
+        for name in _model_cache_companions(entry['file']):
+            path = os.path.join(cache_dir, name)
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        files[entry['file']] = (max(last, entry.get('last_access', 0)), size)
+    total = sum(size for _, size in files.values())
+    for filename, (_, size) in sorted(files.items(), key=lambda item: item[1][0]):
+        if total <= max_bytes or len(files) <= 1:
+            break
+        for url in [u for u, e in index.items() if e['file'] == filename]:
+            del index[url]
+        _remove_cached_model(cache_dir, filename)
+        del files[filename]
+        total -= size
+        logger.info("🧹 Rimosso dalla cache: %s", filename)
+
+
+def _cached_model_path(url: str):
+    """Return the cached file for url without any network access, or None."""
+    cache_dir = _get_model_cache_dir()
+    entry = _load_cache_index(cache_dir).get(url)
+    if entry is None:
+        return None
+    path = os.path.join(cache_dir, entry['file'])
+    return path if os.path.exists(path) else None
+
+
+def _download_model_from_url(url: str, sha256: str = None,
+                             revalidate_after: float = _MODEL_REVALIDATE_AFTER,
+                             max_cache_bytes: int = _MODEL_CACHE_MAX_BYTES,
+                             progress=None) -> str:
+    """
+    Download a model from URL and cache it locally.
 
-        # Check if already cached
-        if os.path.exists(cached_model_path):
-            print(f"Modello trovato in cache: {cached_model_path}")
-            return cached_model_path
+    Files are stored by content hash and only renamed into place when complete;
+    an interrupted download is resumed from where it stopped. A cached copy is revalidated with the server
+    (ETag / Last-Modified) once it is older than revalidate_after seconds, and
+    used as-is when the server cannot be reached.
 
-        # Download the model
-        print(f"Downloading model from: {url}")
-        urllib.request.urlretrieve(url, cached_model_path)
-        print(f"Modello scaricato e salvato in: {cached_model_path}")
+    Parameters:
+    url (str): URL of the model file.
+    sha256 (str): Expected SHA-256 of the file (optional); pinned files are never revalidated.
+    revalidate_after (float): Seconds before a cached copy is checked again with the server.
+    max_cache_bytes (int): Size limit of ~/models/cache; least recently used models are removed.
+    progress (callable): Download progress callback, see print_download_progress.
 
+    Returns:
+    str: Path to the cached model file.
+    """
+    try:
+        cache_dir = _get_model_cache_dir()
+        sha256 = sha256.lower() if sha256 else None
+
+        # One download per URL at a time; _model_cache_lock only guards index.json,
+        # so a slow download does not block lookups of other models
+        with _model_cache_lock:
+            url_lock = _model_download_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            with _model_cache_lock:
+                index = _load_cache_index(cache_dir)
+                entry = index.get(url)
+                if entry is not None and (
+                        not os.path.exists(os.path.join(cache_dir, entry['file'])) or
+                        (sha256 and entry['sha256'] != sha256)):
+                    entry = None
+
+                now = time.time()
+                headers = {'User-Agent': 'MAST-Learn-CV-Module/2.0.0'}
+                if entry is not None:
+                    cached_model_path = os.path.join(cache_dir, entry['file'])
+                    if sha256 or now - entry.get('checked_at', 0) < revalidate_after:
+                        # The access time only matters for eviction: rewrite the index rarely
+                        if now - entry.get('last_access', 0) >= _MODEL_ACCESS_RESOLUTION:
+                            entry['last_access'] = now
+                            _save_cache_index(cache_dir, index)
+                        logger.info("Modello trovato in cache: %s", cached_model_path)
+                        return cached_model_path
+                    if entry.get('etag'):
+                        headers['If-None-Match'] = entry['etag']
+                    if entry.get('last_modified'):
+                        headers['If-Modified-Since'] = entry['last_modified']
+
+            # Download the model (or revalidate the cached copy)
+            logger.info("Downloading model from: %s", url)
+            try:
+                fetched = _fetch_model(url, cache_dir, headers, progress)
+            except (OSError, http.client.HTTPException) as e:
+                if entry is None:
+                    raise
+                logger.warning("⚠️ Impossibile verificare il modello online (%s), uso la copia in cache", e)
+                fetched = None
+
+            if fetched is None:
+                with _model_cache_lock:
+                    index = _load_cache_index(cache_dir)
+                    entry = index.get(url, entry)
+                    entry['checked_at'] = entry['last_access'] = now
+                    index[url] = entry
+                    _save_cache_index(cache_dir, index)
+                logger.info("Modello trovato in cache: %s", cached_model_path)
+                return cached_model_path
+
+            tmp_path, digest, size, response_headers = fetched
+            if sha256 and digest != sha256:
+                os.remove(tmp_path)
+                raise ValueError(
+                    f"Checksum non valido: atteso {sha256}, ottenuto {digest}")
+
+            with open(tmp_path, 'rb') as f:
+                filename = digest + _model_extension(url, f.read(8))
+            cached_model_path = os.path.join(cache_dir, filename)
+
+            with _model_cache_lock:
+                os.replace(tmp_path, cached_model_path)
+                index = _load_cache_index(cache_dir)
+                old_file = index.get(url, {}).get('file')
+                index[url] = {
+                    "sha256": digest,
+                    "file": filename,
+                    "size": size,
+                    "etag": response_headers.get('ETag'),
+                    "last_modified": response_headers.get('Last-Modified'),
+                    "checked_at": now,
+                    "last_access": now,
+                }
+                # The previous version of this URL is garbage unless another URL shares it
+                if old_file and old_file != filename and all(
+                        e['file'] != old_file for e in index.values()):
+                    _remove_cached_model(cache_dir, old_file)
+                    logger.info("🧹 Rimossa la versione precedente: %s", old_file)
+                _evict_model_cache(cache_dir, index, max_cache_bytes)
+                _save_cache_index(cache_dir, index)
+
+        logger.info("Modello scaricato e salvato in: %s", cached_model_path)
         return cached_model_path
 
     except Exception as e:
@@ -478,61 +1659,626 @@ def _get_model_cache_dir() -> str:
     return cache_dir
 
 
-def predict_image_custom(model, image_path: str, class_names: list = None):
-    """
-    Make prediction on an image using a custom trained model.
+_DEFAULT_CLASS_NAMES = [
+    "aqualy", "calcolatrice_casio", "bicchiere", "iphone13", "mouse_wireless",
+    "pennarello_giotto", "persona", "webcam_box"
+]
 
-    Parameters:
-    model: The trained Keras model.
-    image_path (str): Path to the image file.
-    class_names (list): List of class names. If None, uses default classes.
 
-    Returns:
-    tuple: (predicted_class, confidence_score)
-    """
-    if not HAS_KERAS:
-        raise ImportError(
-            "Keras non è installato. Installare con: pip install keras")
+_DEFAULT_INPUT_SIZE = (224, 224)
 
-    # Use provided class names or default ones
-    if class_names is None or len(class_names) == 0:
-        class_names = [
-            "aqualy", "calcolatrice_casio", "bicchiere", "iphone13", "mouse_wireless",
-            "pennarello_giotto", "persona", "webcam_box"
-        ]
+# Input normalizations: value = pixel * scale + offset, applied to RGB pixels 0-255
+_NORMALIZATIONS = {
+    None: (1.0, 0.0),           # MobileNetV3: normalization is inside the model
+    "tf": (1.0 / 127.5, -1.0),  # [-1, 1], MobileNet v1/v2 and Inception style
+    "unit": (1.0 / 255.0, 0.0),  # [0, 1]
+}
 
-    CLASS_NAMES = class_names
 
-    IMG_SIZE = (224, 224)
+def _model_input_size(model) -> tuple:
+    """(height, width) from model.input_shape, or 224x224 if it is not known."""
+    try:
+        shape = model.input_shape
+    except Exception:
+        return _DEFAULT_INPUT_SIZE
+    if isinstance(shape, list):
+        shape = shape[0]
+    if not shape or len(shape) != 4 or not shape[1] or not shape[2]:
+        return _DEFAULT_INPUT_SIZE
+    if shape[3] not in (None, 3):
+        raise ValueError(f"Il modello si aspetta {shape[3]} canali, ma le immagini hanno 3 canali (RGB).")
+    return int(shape[1]), int(shape[2])
+
+
+class ImagePreprocessor:
+    """
+    Turn BGR frames into model input batches without per-frame allocations.
 
-    # Check if image exists
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Immagine non trovata: {image_path}")
+    Equivalent to cv2.resize → cvtColor(BGR2RGB) → img_to_array →
+    expand_dims → preprocess_input, with the same float32 values, but the
+    resized image and the input batch are preallocated buffers (one set per
+    thread), the channel swap is done on the 8-bit image, and the float
+    conversion and normalization are a single pass into the batch.
 
-    # Load and preprocess the image
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"Impossibile caricare l'immagine: {image_path}")
+    Parameters:
+    model: Model whose input_shape gives the input size (optional).
+    size (tuple): (height, width) of the model input; overrides the model (default: 224x224).
+    normalization (str): None (MobileNetV3, values 0-255), "tf" ([-1, 1]) or "unit" ([0, 1]).
+    """
 
-    # Resize and preprocess
-    image = cv2.resize(image, IMG_SIZE)
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convert BGR to RGB
-    img_array = img_to_array(image)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)
+    def __init__(self, model=None, size: tuple = None, normalization: str = None):
+        if normalization not in _NORMALIZATIONS:
+            raise ValueError(
+                f"normalization non supportata: {normalization} (usare None, 'tf' o 'unit')")
+        self.height, self.width = size if size is not None else _model_input_size(model)
+        self.normalization = normalization
+        self._scale, self._offset = _NORMALIZATIONS[normalization]
+        self._local = threading.local()
+
+    @property
+    def input_shape(self) -> tuple:
+        """Shape of one preprocessed image, (height, width, 3)."""
+        return self.height, self.width, 3
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Preprocess one BGR frame into a (1, height, width, 3) float32 batch.
+
+        The result is a per-thread buffer overwritten by the next call: pass it
+        to the model right away, or copy it to keep it.
+        """
+        batch = getattr(self._local, 'batch', None)
+        if batch is None:
+            batch = self._local.batch = np.empty((1,) + self.input_shape, np.float32)
+        self.into(frame, batch[0])
+        return batch
+
+    def into(self, frame: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """
+        Preprocess one BGR frame into out, a float32 array of shape (height, width, 3).
+
+        Use it to fill a slot of a larger batch, e.g. batch[i].
+        """
+        with metrics.timer("preprocess"):
+            return self._into(frame, out)
+
+    def _into(self, frame: np.ndarray, out: np.ndarray) -> np.ndarray:
+        local = self._local
+        if getattr(local, 'resized', None) is None:
+            local.resized = np.empty(self.input_shape, np.uint8)
+            local.rgb = np.empty(self.input_shape, np.uint8)
+
+        image = frame
+        if frame.shape[:2] != (self.height, self.width):
+            image = cv2.resize(frame, (self.width, self.height), dst=local.resized)
+        # Swap channels on the 8-bit image (a quarter of the bytes of the float one)
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=local.rgb)
+
+        # Float conversion and normalization in one pass, straight into out
+        if self._scale == 1.0 and self._offset == 0.0:
+            np.copyto(out, rgb, casting='unsafe')
+        else:
+            np.multiply(rgb, np.float32(self._scale), out=out, casting='unsafe')
+            if self._offset:
+                out += np.float32(self._offset)
+        return out
+
+
+_preprocessors = weakref.WeakKeyDictionary()
+_preprocessors_lock = threading.Lock()
+
+
+def get_preprocessor(model) -> ImagePreprocessor:
+    """
+    Return the ImagePreprocessor for a model, created on first use.
+
+    Parameters:
+    model: The loaded model.
+
+    Returns:
+    ImagePreprocessor: Sized from model.input_shape and shared by all predict_* helpers.
+    """
+    with _preprocessors_lock:
+        try:
+            preprocessor = _preprocessors.get(model)
+        except TypeError:
+            # Not weak-referenceable: build one each time
+            return ImagePreprocessor(model)
+        if preprocessor is None:
+            preprocessor = _preprocessors[model] = ImagePreprocessor(model)
+        return preprocessor
+
+
+class PredictionResult:
+    """
+    Outcome of a single inference on one image.
+
+    Attributes:
+    label (str): Predicted class name.
+    confidence (float): Probability of the predicted class.
+    index (int): Index of the predicted class.
+    probabilities (numpy.ndarray): Full probability vector, one entry per class.
+    class_names (list): Class names matching the probability vector.
+    """
+
+    def __init__(self, probabilities, class_names: list):
+        self.probabilities = np.asarray(probabilities, dtype=np.float32).ravel()
+        self.class_names = list(class_names)
+        self.index = int(np.argmax(self.probabilities))
+        self.label = self.class_names[self.index]
+        self.confidence = float(self.probabilities[self.index])
+
+    def top_k(self, k: int = 3) -> list:
+        """
+        Return the k most likely classes.
+
+        Parameters:
+        k (int): Number of classes to return (default: 3).
+
+        Returns:
+        list: [(label, confidence), ...] sorted by decreasing confidence.
+        """
+        order = np.argsort(self.probabilities)[::-1][:k]
+        return [(self.class_names[i], float(self.probabilities[i])) for i in order]
+
+    def as_tuple(self) -> tuple:
+        """Return (label, confidence), the format of predict_image_custom."""
+        return self.label, self.confidence
+
+    def to_dict(self, k: int = 3) -> dict:
+        """Return a JSON-serializable summary with the top k classes."""
+        return {
+            "label": self.label,
+            "confidence": self.confidence,
+            "top_k": [{"label": l, "confidence": c} for l, c in self.top_k(k)]
+        }
+
+    def __repr__(self):
+        return f"PredictionResult(label={self.label!r}, confidence={self.confidence:.4f})"
+
+
+# Memo of the last probability vectors, so that asking for the label and then
+# the confidence of the same image runs the model only once.
+_PREDICTION_MEMO_SIZE = 8
+_prediction_memo = OrderedDict()
+_prediction_memo_lock = threading.Lock()
+
+
+def _memo_get(model, key, ref=None):
+    with _prediction_memo_lock:
+        entry = _prediction_memo.get(key)
+        if entry is None or entry[0] is not model or (ref is not None and entry[1] is not ref):
+            return None
+        _prediction_memo.move_to_end(key)
+        return entry[2]
+
+
+def _memo_put(model, key, probabilities, ref=None):
+    with _prediction_memo_lock:
+        # ref keeps in-memory frames alive, so their id() cannot be reused
+        _prediction_memo[key] = (model, ref, probabilities)
+        _prediction_memo.move_to_end(key)
+        while len(_prediction_memo) > _PREDICTION_MEMO_SIZE:
+            _prediction_memo.popitem(last=False)
+
+
+def clear_prediction_memo() -> None:
+    """Forget all memoized predictions."""
+    with _prediction_memo_lock:
+        _prediction_memo.clear()
+
+
+def _check_inference_backend(model) -> None:
+    """Keras is required for prediction unless the model is a TFLiteModel."""
+    if not HAS_KERAS and not isinstance(model, TFLiteModel):
+        raise ImportError(
+            "Keras non è installato. Installare con: pip install keras")
+
+
+def _predict_probabilities(model, frame: np.ndarray) -> np.ndarray:
+    """Run the model on a single BGR frame and return its probability vector."""
+    img_array = get_preprocessor(model)(frame)
 
     # Make prediction
-    predictions = model.predict(img_array)
+    with metrics.timer("predict"):
+        predictions = model.predict(img_array, **_predict_options())
+    metrics.count("predictions")
+    return np.asarray(predictions[0])
+
+
+def _report_prediction(result: PredictionResult) -> None:
+    logger.info("Classe predetta: %s", result.label)
+    logger.info("Confidence score: %.4f", result.confidence)
+
+
+class FrameChangeGate:
+    """
+    Reuse the last prediction while the camera keeps seeing the same scene.
+
+    Each frame is reduced to a small grayscale thumbnail and compared with the
+    thumbnail of the last frame that went through the model. When the mean
+    absolute difference is below threshold, the previous probabilities are
+    returned without running inference (a hit); otherwise the model runs and
+    the frame becomes the new reference (a miss). Predictions older than
+    max_age seconds are always refreshed, so slow changes such as lighting
+    drift are eventually picked up.
+
+    Parameters:
+    threshold (float): Mean absolute difference, in gray levels 0-255, below which the scene is unchanged (default: 4.0).
+    max_age (float): Seconds after which inference runs anyway (default: 10.0, None for no limit).
+    size (int): Side of the thumbnail in pixels (default: 16).
+    """
+
+    def __init__(self, threshold: float = 4.0, max_age: float = 10.0, size: int = 16):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._reference = None
+
+    @property
+    def stats(self) -> dict:
+        """Hit/miss counters; a hit is an inference skipped."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+    def reset(self) -> None:
+        """Forget the reference frame and the counters."""
+        with self._lock:
+            self._reference = None
+            self.hits = 0
+            self.misses = 0
+
+    def difference(self, frame: np.ndarray) -> float:
+        """Mean absolute difference between frame and the reference (inf if there is none)."""
+        with self._lock:
+            reference = self._reference
+        if reference is None:
+            return float('inf')
+        return float(np.abs(self._thumbnail(frame) - reference[1]).mean())
+
+    def predict(self, model, frame: np.ndarray) -> np.ndarray:
+        """
+        Probability vector for frame: the previous one if the scene is unchanged, else a new inference.
+
+        Parameters:
+        model: The loaded model.
+        frame (numpy.ndarray): BGR frame.
+
+        Returns:
+        numpy.ndarray: Probability vector, one entry per class.
+        """
+        thumbnail = self._thumbnail(frame)
+        with self._lock:
+            reference = self._reference
+            if (reference is not None and reference[0] is model and
+                    (self.max_age is None or time.monotonic() - reference[3] <= self.max_age) and
+                    np.abs(thumbnail - reference[1]).mean() < self.threshold):
+                self.hits += 1
+                metrics.count("gate_hits")
+                return reference[2]
+            self.misses += 1
+            metrics.count("gate_misses")
+        probabilities = _predict_probabilities(model, frame)
+        with self._lock:
+            self._reference = (model, thumbnail, probabilities, time.monotonic())
+        return probabilities
+
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        small = cv2.resize(frame, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.float32)
+
+
+_frame_gates = {}
+_frame_gates_lock = threading.Lock()
+
+
+def get_frame_gate(camera_index: int = 0) -> FrameChangeGate:
+    """
+    Return the FrameChangeGate used with gate=True for camera_index.
+
+    Parameters:
+    camera_index (int): Index of the camera (default: 0).
+
+    Returns:
+    FrameChangeGate: Shared gate with default settings; read its stats for hit/miss counters.
+    """
+    with _frame_gates_lock:
+        gate = _frame_gates.get(camera_index)
+        if gate is None:
+            gate = _frame_gates[camera_index] = FrameChangeGate()
+        return gate
+
+
+def _resolve_gate(gate, camera_index: int = 0):
+    if gate is None or gate is False:
+        return None
+    if gate is True:
+        return get_frame_gate(camera_index)
+    if not isinstance(gate, FrameChangeGate):
+        raise ValueError("gate deve essere True, False/None o un FrameChangeGate.")
+    return gate
+
+
+class TemporalSmoother:
+    """
+    Combine the probability vectors of consecutive frames into a steadier prediction.
+
+    With method="ema" the smoothed vector is an exponential moving average
+    (alpha is the weight of the newest frame); with method="vote" it is the
+    share of the last window frames won by each class. leader_score is the
+    cumulative confidence of the current leader, i.e. the sum of its
+    probabilities over the frames in the window, used to stop sampling early.
+
+    Parameters:
+    window (int): Number of recent frames kept (default: 5).
+    method (str): "ema" or "vote" (default: "ema").
+    alpha (float): EMA weight of the newest frame, 0-1 (default: 0.5).
+    """
+
+    def __init__(self, window: int = 5, method: str = "ema", alpha: float = 0.5):
+        if method not in ("ema", "vote"):
+            raise ValueError(f"method non supportato: {method} (usare 'ema' o 'vote')")
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha deve essere compreso tra 0 (escluso) e 1.")
+        self.method = method
+        self.alpha = alpha
+        self._history = deque(maxlen=max(1, window))
+        self._ema = None
+
+    def __len__(self):
+        return len(self._history)
+
+    def reset(self) -> None:
+        """Forget all frames."""
+        self._history.clear()
+        self._ema = None
+
+    def update(self, probabilities) -> np.ndarray:
+        """
+        Add the probability vector of a new frame.
+
+        Returns:
+        numpy.ndarray: The smoothed probability vector.
+        """
+        probabilities = np.asarray(probabilities, dtype=np.float32).ravel()
+        self._history.append(probabilities)
+        if self._ema is None or self._ema.shape != probabilities.shape:
+            self._ema = probabilities.copy()
+        else:
+            self._ema = self.alpha * probabilities + (1 - self.alpha) * self._ema
+        return self.probabilities
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        """Smoothed probability vector (EMA or vote shares)."""
+        if self._ema is None:
+            raise ValueError("Nessun frame aggiunto")
+        if self.method == "ema":
+            return self._ema
+        votes = np.bincount([int(np.argmax(p)) for p in self._history],
+                            minlength=len(self._ema))
+        return votes.astype(np.float32) / len(self._history)
+
+    @property
+    def leader_score(self) -> float:
+        """Sum of the leader's probabilities over the frames in the window."""
+        leader = int(np.argmax(self.probabilities))
+        return float(sum(p[leader] for p in self._history))
+
+
+def predict_frame_result(model, frame: np.ndarray, class_names: list = None, use_memo: bool = True,
+                         gate: FrameChangeGate = None) -> PredictionResult:
+    """
+    Run the model once on an in-memory BGR frame and return the full result.
+
+    Frames are memoized by identity: predicting again on the same array object
+    reuses the previous inference, so do not modify a frame in place after
+    predicting on it.
+
+    Parameters:
+    model: The trained Keras model.
+    frame (numpy.ndarray): BGR image, e.g. from capture_webcam_frame or cv2.imread.
+    class_names (list): List of class names. If None, uses default classes.
+    use_memo (bool): Reuse a previous inference on the same frame (default: True).
+    gate (FrameChangeGate): Reuse the previous prediction if the scene has not changed (optional).
+
+    Returns:
+    PredictionResult: Label, confidence, probabilities and top-k.
+    """
+    _check_inference_backend(model)
 
-    # Get predicted class and confidence
-    predicted_class_idx = np.argmax(predictions)
-    predicted_class = CLASS_NAMES[predicted_class_idx]
-    confidence_score = float(predictions[0][predicted_class_idx])
+    # Use provided class names or default ones
+    if class_names is None or len(class_names) == 0:
+        class_names = _DEFAULT_CLASS_NAMES
+
+    if not isinstance(frame, np.ndarray) or frame.ndim != 3:
+        raise ValueError("frame deve essere un'immagine numpy (altezza, larghezza, 3).")
+
+    key = ("frame", id(frame))
+    probabilities = _memo_get(model, key, frame) if use_memo else None
+    if probabilities is None:
+        if gate is not None:
+            probabilities = gate.predict(model, frame)
+        else:
+            probabilities = _predict_probabilities(model, frame)
+        _memo_put(model, key, probabilities, frame)
 
-    print(f"Classe predetta: {predicted_class}")
-    print(f"Confidence score: {confidence_score:.4f}")
+    result = PredictionResult(probabilities, class_names)
+    _report_prediction(result)
+    return result
 
-    return predicted_class, confidence_score
+
+def predict_image_result(model, image_path: str, class_names: list = None, use_memo: bool = True) -> PredictionResult:
+    """
+    Run the model once on an image file and return the full result.
+
+    Results are memoized by path, modification time and size, so the label-only
+    and confidence-only helpers called on the same file share one inference.
+
+    Parameters:
+    model: The trained Keras model.
+    image_path (str): Path to the image file.
+    class_names (list): List of class names. If None, uses default classes.
+    use_memo (bool): Reuse a previous inference on the same file (default: True).
+
+    Returns:
+    PredictionResult: Label, confidence, probabilities and top-k.
+    """
+    _check_inference_backend(model)
+
+    # Use provided class names or default ones
+    if class_names is None or len(class_names) == 0:
+        class_names = _DEFAULT_CLASS_NAMES
+
+    # Check if image exists
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"Immagine non trovata: {image_path}")
+
+    stat = os.stat(image_path)
+    key = ("path", os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+    probabilities = _memo_get(model, key) if use_memo else None
+    if probabilities is None:
+        # Load the image
+        with metrics.timer("decode"):
+            image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"Impossibile caricare l'immagine: {image_path}")
+        probabilities = _predict_probabilities(model, image)
+        _memo_put(model, key, probabilities)
+
+    result = PredictionResult(probabilities, class_names)
+    _report_prediction(result)
+    return result
+
+
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def _collect_image_paths(images) -> list:
+    """Expand a directory, a glob pattern, a single path or a list of paths into image paths."""
+    if isinstance(images, (str, Path)):
+        images = os.path.expanduser(str(images))
+        if os.path.isdir(images):
+            return sorted(
+                os.path.join(images, name) for name in os.listdir(images)
+                if name.lower().endswith(_IMAGE_EXTENSIONS))
+        if glob.has_magic(images):
+            return sorted(glob.glob(images))
+        return [images]
+    return [str(image) for image in images]
+
+
+def _load_and_preprocess(image_path: str, preprocessor: ImagePreprocessor, out: np.ndarray) -> bool:
+    """Decode one image and preprocess it into out (a batch slot); False if it cannot be read."""
+    with metrics.timer("decode"):
+        image = cv2.imread(image_path)
+    if image is None:
+        return False
+    preprocessor.into(image, out)
+    return True
+
+
+def predict_images_batch(model, images, class_names: list = None, batch_size: int = 32, workers: int = None) -> list:
+    """
+    Classify many images, decoding them in parallel and running the model in batches.
+
+    Parameters:
+    model: The trained Keras model.
+    images (str or list): A directory (e.g. the webcam_images folder), a glob
+        pattern such as "~/webcam_images/*.jpg", or a list of image paths.
+    class_names (list): List of class names. If None, uses default classes.
+    batch_size (int): Number of images per model call (default: 32).
+    workers (int): Threads used to decode and preprocess (default: CPU count, max 8).
+
+    Returns:
+    list: [(image_path, PredictionResult), ...] in input order; the result is
+        None for images that could not be read.
+    """
+    _check_inference_backend(model)
+
+    # Use provided class names or default ones
+    if class_names is None or len(class_names) == 0:
+        class_names = _DEFAULT_CLASS_NAMES
+
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise ValueError("batch_size deve essere un intero positivo.")
+
+    paths = _collect_image_paths(images)
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+
+    preprocessor = get_preprocessor(model)
+    chunks = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    # Two batch buffers: workers fill one while the model reads the other
+    buffers = [np.empty((min(batch_size, len(paths)),) + preprocessor.input_shape, np.float32)
+               for _ in range(min(2, len(chunks)))]
+
+    def submit(pool, i):
+        return [pool.submit(_load_and_preprocess, p, preprocessor, buffers[i % 2][j])
+                for j, p in enumerate(chunks[i])]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="learn-decode") as pool:
+        # Decode the next batch while the model runs on the current one
+        pending = submit(pool, 0) if chunks else []
+        for i, chunk in enumerate(chunks):
+            loaded = [future.result() for future in pending]
+            if i + 1 < len(chunks):
+                pending = submit(pool, i + 1)
+
+            batch = buffers[i % 2][:len(chunk)]
+            if not all(loaded):
+                batch = batch[np.array(loaded, dtype=bool)]
+            with metrics.timer("predict_batch"):
+                probabilities = iter(model.predict(
+                    batch, batch_size=len(batch), **_predict_options())) if len(batch) else iter(())
+            metrics.count("predictions", len(batch))
+            for image_path, ok in zip(chunk, loaded):
+                if not ok:
+                    logger.warning("⚠️ Impossibile caricare l'immagine: %s", image_path)
+                    results.append((image_path, None))
+                else:
+                    results.append(
+                        (image_path, PredictionResult(next(probabilities), class_names)))
+
+    logger.info("✅ %s immagini classificate (batch da %s)", len(results), batch_size)
+    return results
+
+
+def predict_frame_custom(model, frame: np.ndarray, class_names: list = None):
+    """
+    Make prediction on an in-memory BGR frame using a custom trained model.
+
+    Parameters:
+    model: The trained Keras model.
+    frame (numpy.ndarray): BGR image, e.g. from capture_webcam_frame or cv2.imread.
+    class_names (list): List of class names. If None, uses default classes.
+
+    Returns:
+    tuple: (predicted_class, confidence_score)
+    """
+    return predict_frame_result(model, frame, class_names).as_tuple()
+
+
+def predict_image_custom(model, image_path: str, class_names: list = None):
+    """
+    Make prediction on an image using a custom trained model.
+
+    Parameters:
+    model: The trained Keras model.
+    image_path (str): Path to the image file.
+    class_names (list): List of class names. If None, uses default classes.
+
+    Returns:
+    tuple: (predicted_class, confidence_score)
+    """
+    return predict_image_result(model, image_path, class_names).as_tuple()
 
 
 def predict_image_label(model, image_path: str, class_names: list = None) -> str:
@@ -567,7 +2313,28 @@ def predict_image_confidence(model, image_path: str, class_names: list = None) -
     return confidence_score
 
 
-def webcam_predict_label(model, camera_index: int = 0, class_names: list = None) -> str:
+def webcam_predict_frame(model, camera_index: int = 0, class_names: list = None, gate=None):
+    """
+    Capture a frame from the webcam and predict on it in memory.
+
+    Parameters:
+    model: The loaded Keras model object.
+    camera_index (int): Index of the camera to use.
+    class_names (list): List of class names. If None, uses default classes.
+    gate (bool or FrameChangeGate): Skip inference while the scene is unchanged;
+        True uses the shared gate of camera_index (default: None, always predict).
+
+    Returns:
+    tuple: (frame, predicted_class, confidence_score)
+    """
+    frame = capture_webcam_frame(camera_index)
+    result = predict_frame_result(
+        model, frame, class_names, gate=_resolve_gate(gate, camera_index))
+    return frame, result.label, result.confidence
+
+
+def webcam_predict_label(model, camera_index: int = 0, class_names: list = None, save_image: bool = True,
+                         gate=None) -> str:
     """
     Capture image from webcam and get only the predicted label.
 
@@ -575,19 +2342,22 @@ def webcam_predict_label(model, camera_index: int = 0, class_names: list = None)
     model: The loaded Keras model object.
     camera_index (int): Index of the camera to use.
     class_names (list): List of class names. If None, uses default classes.
+    save_image (bool): Also save the frame to webcam_images, in the background (default: True).
+    gate (bool or FrameChangeGate): Skip inference while the scene is unchanged (default: None).
 
     Returns:
     str: The predicted label.
     """
-    # Capture image from webcam
-    image_path = capture_webcam_image(camera_index)
-
-    # Make prediction using the model object
-    predicted_class = predict_image_label(model, image_path, class_names)
+    # Capture and predict in memory; saving to disk is off the critical path
+    frame, predicted_class, _ = webcam_predict_frame(
+        model, camera_index, class_names, gate)
+    if save_image:
+        save_frame_async(frame)
     return predicted_class
 
 
-def webcam_predict_confidence(model, camera_index: int = 0, class_names: list = None) -> float:
+def webcam_predict_confidence(model, camera_index: int = 0, class_names: list = None, save_image: bool = True,
+                              gate=None) -> float:
     """
     Capture image from webcam and get only the confidence score.
 
@@ -595,18 +2365,94 @@ def webcam_predict_confidence(model, camera_index: int = 0, class_names: list =
     model: The loaded Keras model object.
     camera_index (int): Index of the camera to use.
     class_names (list): List of class names. If None, uses default classes.
+    save_image (bool): Also save the frame to webcam_images, in the background (default: True).
+    gate (bool or FrameChangeGate): Skip inference while the scene is unchanged (default: None).
 
     Returns:
     float: The confidence score.
     """
-    # Capture image from webcam
-    image_path = capture_webcam_image(camera_index)
-
-    # Make prediction using the model object
-    confidence_score = predict_image_confidence(model, image_path, class_names)
+    # Capture and predict in memory; saving to disk is off the critical path
+    frame, _, confidence_score = webcam_predict_frame(
+        model, camera_index, class_names, gate)
+    if save_image:
+        save_frame_async(frame)
     return confidence_score
 
 
+def webcam_predict_stable(model, camera_index: int = 0, class_names: list = None, max_frames: int = 5,
+                          min_frames: int = 2, threshold: float = 1.6, method: str = "ema",
+                          alpha: float = 0.5, save_image: bool = False) -> PredictionResult:
+    """
+    Predict on consecutive webcam frames until the label is stable.
+
+    Frames are read from the persistent camera session (one is opened with
+    open_camera if none is active, and released after its idle timeout) and smoothed with a TemporalSmoother. Sampling
+    stops as soon as the leader's cumulative confidence reaches threshold, so
+    a clear scene costs min_frames inferences and an ambiguous one at most
+    max_frames.
+
+    Parameters:
+    model: The loaded Keras model object.
+    camera_index (int): Index of the camera to use.
+    class_names (list): List of class names. If None, uses default classes.
+    max_frames (int): Maximum frames to classify (default: 5).
+    min_frames (int): Frames always classified before stopping (default: 2).
+    threshold (float): Cumulative confidence of the leader needed to stop early (default: 1.6,
+        e.g. two frames at 0.8).
+    method (str): "ema" (moving average of probabilities) or "vote" (majority of frames).
+    alpha (float): EMA weight of the newest frame (default: 0.5).
+    save_image (bool): Save the last frame to webcam_images, in the background (default: False).
+
+    Returns:
+    PredictionResult: Smoothed label, confidence and probabilities.
+    """
+    _check_inference_backend(model)
+
+    # Use provided class names or default ones
+    if class_names is None or len(class_names) == 0:
+        class_names = _DEFAULT_CLASS_NAMES
+
+    if not isinstance(max_frames, int) or max_frames < 1:
+        raise ValueError("max_frames deve essere un intero positivo.")
+    min_frames = max(1, min(min_frames, max_frames))
+
+    smoother = TemporalSmoother(window=max_frames, method=method, alpha=alpha)
+    # Keep the device open between calls; the idle watcher releases it later
+    session = open_camera(camera_index)
+    for _ in range(max_frames):
+        frame = session.read()
+        smoother.update(_predict_probabilities(model, frame))
+        if len(smoother) >= min_frames and smoother.leader_score >= threshold:
+            break
+
+    if save_image:
+        save_frame_async(frame)
+
+    result = PredictionResult(smoother.probabilities, class_names)
+    _report_prediction(result)
+    logger.info("Frame analizzati: %s", len(smoother))
+    return result
+
+
+def webcam_predict_stable_label(model, camera_index: int = 0, class_names: list = None,
+                                max_frames: int = 5, threshold: float = 1.6) -> str:
+    """
+    Capture a few webcam frames and return the stable predicted label.
+
+    Parameters:
+    model: The loaded Keras model object.
+    camera_index (int): Index of the camera to use.
+    class_names (list): List of class names. If None, uses default classes.
+    max_frames (int): Maximum frames to classify (default: 5).
+    threshold (float): Cumulative confidence of the leader needed to stop early (default: 1.6).
+
+    Returns:
+    str: The predicted label.
+    """
+    return webcam_predict_stable(model, camera_index, class_names,
+                                 max_frames=max_frames, threshold=threshold).label
+
+
 def predict_label_from_image(model, image_path: str, class_names: list = None) -> str:
     """
     Get predicted label from an existing image.
@@ -641,6 +2487,38 @@ def predict_confidence_from_image(model, image_path: str, class_names: list = No
     return confidence_score
 
 
+def predict_label_from_frame(model, frame: np.ndarray, class_names: list = None) -> str:
+    """
+    Get predicted label from an in-memory BGR frame.
+
+    Parameters:
+    model: The loaded Keras model object.
+    frame (numpy.ndarray): BGR image, e.g. from capture_webcam_frame.
+    class_names (list): List of class names. If None, uses default classes.
+
+    Returns:
+    str: The predicted label.
+    """
+    predicted_class, _ = predict_frame_custom(model, frame, class_names)
+    return predicted_class
+
+
+def predict_confidence_from_frame(model, frame: np.ndarray, class_names: list = None) -> float:
+    """
+    Get predicted confidence from an in-memory BGR frame.
+
+    Parameters:
+    model: The loaded Keras model object.
+    frame (numpy.ndarray): BGR image, e.g. from capture_webcam_frame.
+    class_names (list): List of class names. If None, uses default classes.
+
+    Returns:
+    float: The confidence score.
+    """
+    _, confidence_score = predict_frame_custom(model, frame, class_names)
+    return confidence_score
+
+
 # --- RIMOSSE FUNZIONI LEGACY ---
 
 # Elimina queste funzioni legacy:
@@ -651,85 +2529,505 @@ def predict_confidence_from_image(model, image_path: str, class_names: list = No
 # --- FINE RIMOZIONE ---
 
 
-def send_prediction_data(image_path: str, label: str, confidence: float, api_url: str, additional_data: dict = None) -> dict:
+_API_HEADERS = {
+    'Content-Type': 'application/json',
+    'User-Agent': 'MAST-Learn-CV-Module/2.0.0'
+}
+_session = None
+_session_lock = threading.Lock()
+
+
+def _new_http_session(pool_size: int = 4):
+    """Create a requests.Session with a connection pool of pool_size."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _http_session():
+    """Shared session for send_prediction_data, so connections are kept alive."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _new_http_session()
+        return _session
+
+
+def _encode_image(image, max_side: int = None, jpeg_quality: int = None) -> bytes:
+    """
+    JPEG bytes for a path, frame or bytes, optionally downscaled and re-encoded.
+
+    Files are passed through unchanged unless max_side or jpeg_quality is set.
+    """
+    if isinstance(image, (bytes, bytearray)) and max_side is None and jpeg_quality is None:
+        return bytes(image)
+    if not isinstance(image, np.ndarray) and max_side is None and jpeg_quality is None:
+        with open(image, 'rb') as image_file:
+            return image_file.read()
+
+    if isinstance(image, np.ndarray):
+        frame = image
+    elif isinstance(image, (bytes, bytearray)):
+        with metrics.timer("decode"):
+            frame = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        if not os.path.exists(image):
+            raise FileNotFoundError(image)
+        with metrics.timer("decode"):
+            frame = cv2.imread(image)
+    if frame is None:
+        raise ValueError("Impossibile decodificare l'immagine da inviare")
+
+    if max_side is not None and max(frame.shape[:2]) > max_side:
+        scale = max_side / max(frame.shape[:2])
+        frame = cv2.resize(frame, (max(1, round(frame.shape[1] * scale)), max(1, round(frame.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+    with metrics.timer("encode"):
+        ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY,
+                                                   90 if jpeg_quality is None else int(jpeg_quality)])
+    if not ok:
+        raise ValueError("Impossibile codificare l'immagine in JPEG")
+    return encoded.tobytes()
+
+
+def _image_body(image, max_side: int = None, jpeg_quality: int = None):
+    """Request body for an image: an open file (streamed by requests) or JPEG bytes."""
+    if isinstance(image, (str, Path)) and max_side is None and jpeg_quality is None:
+        return open(image, 'rb')
+    return _encode_image(image, max_side, jpeg_quality)
+
+
+def _prediction_metadata(label: str, confidence: float, additional_data: dict = None) -> dict:
+    metadata = {
+        "label": label,
+        "confidence": confidence,
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+    if additional_data and isinstance(additional_data, dict):
+        metadata.update(additional_data)
+    return metadata
+
+
+def _build_prediction_payload(image_path, label: str, confidence: float, additional_data: dict = None,
+                              max_side: int = None, jpeg_quality: int = None) -> dict:
+    """Build the JSON payload of send_prediction_data."""
+    # Read and encode image as base64
+    image_data = base64.b64encode(
+        _encode_image(image_path, max_side, jpeg_quality)).decode('utf-8')
+
+    # Create JSON payload (image only as base64, no image_path)
+    payload = {
+        "image": image_data,
+        "label": label,
+        "confidence": confidence,
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+
+    # Add additional data if provided
+    if additional_data and isinstance(additional_data, dict):
+        payload.update(additional_data)
+    return payload
+
+
+_UPLOAD_MODES = ("json", "multipart", "raw")
+
+
+def send_prediction_data(image_path: str, label: str, confidence: float, api_url: str, additional_data: dict = None,
+                         upload_mode: str = "json", max_side: int = None, jpeg_quality: int = None) -> dict:
     """
     Send prediction data via REST API.
 
+    Upload modes:
+    - "json" (default): the image is base64-encoded inside a JSON body.
+    - "multipart": multipart/form-data with an "image" file part and the
+      label, confidence, timestamp and additional data as form fields.
+    - "raw": the JPEG bytes are the request body (streamed from the file when
+      it is sent unchanged); metadata goes in the X-Prediction-Metadata header
+      as JSON.
+    Both binary modes avoid the +33% of base64 and the extra copies of the JSON body.
+
     Parameters:
-    image_path (str): Path to the image file.
+    image_path (str or numpy.ndarray or bytes): Path to the image file, an in-memory BGR frame or JPEG bytes.
     label (str): Predicted label.
     confidence (float): Confidence score (0.0-1.0).
     api_url (str): URL of the REST API endpoint.
     additional_data (dict): Optional additional data to include in JSON.
+    upload_mode (str): "json", "multipart" or "raw" (default: "json").
+    max_side (int): Downscale the image so its longest side is at most max_side pixels (optional).
+    jpeg_quality (int): Re-encode the image as JPEG with this quality, 1-100 (optional).
 
     Returns:
     dict: API response or error information.
     """
-    try:
-        # Read and encode image as base64
-        with open(image_path, 'rb') as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
-
-        # Create JSON payload (image only as base64, no image_path)
-        payload = {
-            "image": image_data,
-            "label": label,
-            "confidence": confidence,
-            "timestamp": datetime.datetime.now().isoformat()
-        }
-
-        # Add additional data if provided
-        if additional_data and isinstance(additional_data, dict):
-            payload.update(additional_data)
-
-        # Stampa la struttura del JSON che verrà inviato (senza stampare l'immagine base64)
-        payload_preview = payload.copy()
-        if "image" in payload_preview:
-            payload_preview["image"] = f"<base64 string, length={len(payload['image'])}>"
-        print("Struttura JSON inviata all'API:")
-        print(json.dumps(payload_preview, indent=2))
-
-        # Send POST request
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'MAST-Learn-CV-Module/2.0.0'
-        }
+    if upload_mode not in _UPLOAD_MODES:
+        raise ValueError(
+            f"upload_mode non supportato: {upload_mode} (usare uno tra {', '.join(_UPLOAD_MODES)})")
 
-        response = requests.post(
-            api_url, json=payload, headers=headers, timeout=30)
+    body = None
+    try:
+        if upload_mode == "json":
+            payload = _build_prediction_payload(
+                image_path, label, confidence, additional_data, max_side, jpeg_quality)
+
+            # Stampa la struttura del JSON che verrà inviato (senza stampare l'immagine base64)
+            if logger.isEnabledFor(logging.INFO):
+                payload_preview = payload.copy()
+                if "image" in payload_preview:
+                    payload_preview["image"] = f"<base64 string, length={len(payload['image'])}>"
+                logger.info("Struttura JSON inviata all'API:")
+                logger.info("%s", json.dumps(payload_preview, indent=2))
+            request = {"json": payload, "headers": _API_HEADERS}
+        else:
+            metadata = _prediction_metadata(label, confidence, additional_data)
+            body = _image_body(image_path, max_side, jpeg_quality)
+            headers = {'User-Agent': _API_HEADERS['User-Agent']}
+            if upload_mode == "multipart":
+                fields = {key: value if isinstance(value, str) else json.dumps(value)
+                          for key, value in metadata.items()}
+                request = {"files": {"image": ("image.jpg", body, "image/jpeg")},
+                           "data": fields, "headers": headers}
+            else:
+                headers['Content-Type'] = 'image/jpeg'
+                headers['X-Prediction-Metadata'] = json.dumps(metadata)
+                request = {"data": body, "headers": headers}
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Invio %s all'API: %s", upload_mode, json.dumps(metadata))
+
+        # Send POST request (persistent session: the connection is reused)
+        with metrics.timer("http_send"):
+            response = _http_session().post(api_url, timeout=30, **request)
 
         # Check response
         if response.status_code == 200:
-            print(f"✅ Data sent successfully to {api_url}")
+            logger.info("✅ Data sent successfully to %s", api_url)
             try:
                 return response.json()
             except:
                 return {"status": "success", "message": "Data sent successfully", "response_text": response.text}
         else:
             error_msg = f"❌ API Error {response.status_code}: {response.text}"
-            print(error_msg)
+            logger.error(error_msg)
             return {"status": "error", "code": response.status_code, "message": response.text}
 
     except requests.exceptions.Timeout:
         error_msg = "❌ Request timeout - API took too long to respond"
-        print(error_msg)
+        logger.error(error_msg)
         return {"status": "error", "message": "Request timeout"}
 
     except requests.exceptions.ConnectionError:
         error_msg = f"❌ Connection error - Cannot reach {api_url}"
-        print(error_msg)
+        logger.error(error_msg)
         return {"status": "error", "message": "Connection error"}
 
     except FileNotFoundError:
         error_msg = f"❌ Image file not found: {image_path}"
-        print(error_msg)
+        logger.error(error_msg)
         return {"status": "error", "message": f"Image file not found: {image_path}"}
 
     except Exception as e:
         error_msg = f"❌ Unexpected error: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         return {"status": "error", "message": str(e)}
 
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+class PredictionUploader:
+    """
+    Send prediction data to a REST API from a background thread.
+
+    submit() returns immediately, so a slow endpoint does not stall the
+    capture → predict loop. Payloads go through a bounded queue to a sender
+    thread that reuses pooled connections and retries failures with
+    exponential backoff. With spool_dir, every payload is also written to disk
+    until it is delivered, so results survive restarts: spooled payloads are
+    sent again when an uploader is created on the same folder.
+
+    Parameters:
+    api_url (str): URL of the REST API endpoint.
+    max_queue (int): Maximum payloads waiting to be sent; submit drops beyond it (default: 100).
+    retries (int): Retries after a failed request (default: 3).
+    backoff (float): First retry delay in seconds, doubled at each retry (default: 0.5).
+    timeout (float): Request timeout in seconds (default: 30).
+    spool_dir (str): Folder used to persist undelivered payloads (default: None, memory only).
+    batch_size (int): Payloads per request; above 1 a JSON list is posted, for
+        endpoints that accept batches (default: 1).
+    batch_wait (float): Seconds to wait for a batch to fill up (default: 0.2).
+    """
+
+    def __init__(self, api_url: str, max_queue: int = 100, retries: int = 3, backoff: float = 0.5,
+                 timeout: float = 30, spool_dir: str = None, batch_size: int = 1, batch_wait: float = 0.2):
+        self.api_url = api_url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.spool_dir = os.path.expanduser(spool_dir) if spool_dir else None
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_response = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._session = _new_http_session()
+        self._closed = False
+        self._stop = threading.Event()
+
+        pending = []
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            pending = sorted(
+                os.path.join(self.spool_dir, name) for name in os.listdir(self.spool_dir)
+                if name.endswith('.json'))
+
+        self._thread = threading.Thread(
+            target=self._run, name="learn-uploader", daemon=True)
+        self._thread.start()
+
+        # Payloads left over by a previous run; what does not fit in the queue
+        # stays on disk for the next uploader
+        recovered = 0
+        for spool_path in pending:
+            try:
+                with open(spool_path, 'r') as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                continue
+            try:
+                self._queue.put_nowait((spool_path, payload))
+            except queue.Full:
+                break
+            recovered += 1
+        if pending:
+            logger.info("📤 %s invii in sospeso recuperati da %s", recovered, self.spool_dir)
+        if recovered < len(pending):
+            logger.warning("⚠️ Coda piena: %s invii restano in %s", len(pending) - recovered, self.spool_dir)
+
+    def submit(self, image_path: str, label: str, confidence: float,
+               additional_data: dict = None, block: bool = False) -> bool:
+        """
+        Queue prediction data for sending; same parameters as send_prediction_data.
+
+        Parameters:
+        block (bool): Wait for room in the queue instead of dropping the payload.
+
+        Returns:
+        bool: True if queued, False if the queue was full (the payload stays in the spool, if any).
+        """
+        if self._closed:
+            raise RuntimeError("PredictionUploader già chiuso")
+        payload = _build_prediction_payload(
+            image_path, label, confidence, additional_data)
+        spool_path = self._spool(payload)
+        try:
+            self._queue.put((spool_path, payload), block=block)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("⚠️ Coda di invio piena, dati non inviati: %s", label)
+            return False
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until every queued payload has been sent (or has failed).
+
+        Returns:
+        bool: True if the queue was drained before timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None) -> bool:
+        """
+        Flush, stop the sender thread and close the connections.
+
+        Payloads still queued after timeout are dropped (with spool_dir they
+        stay on disk and are sent by the next uploader on the same folder).
+
+        Returns:
+        bool: True if everything was sent before timeout.
+        """
+        if self._closed:
+            return True
+        self._closed = True
+        drained = self.flush(timeout)
+        self._stop.set()
+        try:
+            self._queue.put_nowait(None)  # wake the sender if it is idle
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._session.close()
+        return drained
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _spool(self, payload: dict):
+        if not self.spool_dir:
+            return None
+        name = f"{time.time_ns()}_{threading.get_ident()}.json"
+        tmp_path = os.path.join(self.spool_dir, name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(payload, f)
+        spool_path = os.path.join(self.spool_dir, name)
+        os.replace(tmp_path, spool_path)
+        return spool_path
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is None or self._stop.is_set():
+                self._queue.task_done()
+                if item is not None:
+                    self._discard(1)
+                self._discard_pending()
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Stop after sending what we have
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._send(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stopping:
+                self._discard_pending()
+                return
+
+    def _discard(self, count: int) -> None:
+        self.dropped += count
+        if self.spool_dir:
+            logger.warning("⚠️ Chiusura: %s invii restano in %s", count, self.spool_dir)
+        else:
+            logger.warning("⚠️ Chiusura: %s invii scartati", count)
+
+    def _discard_pending(self) -> None:
+        count = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            if item is not None:
+                count += 1
+        if count:
+            self._discard(count)
+
+    def _send(self, batch: list) -> None:
+        body = batch[0][1] if self.batch_size == 1 else [payload for _, payload in batch]
+        for attempt in range(self.retries + 1):
+            if attempt:
+                if self._stop.wait(self.backoff * 2 ** (attempt - 1)):
+                    self._discard(len(batch))  # closing: stop retrying
+                    return
+                metrics.count("http_retries")
+            try:
+                with metrics.timer("http_send"):
+                    response = self._session.post(
+                        self.api_url, json=body, headers=_API_HEADERS, timeout=self.timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                error = str(e)
+                continue
+            if response.status_code < 300:
+                self.sent += len(batch)
+                self.last_response = response
+                for spool_path, _ in batch:
+                    if spool_path and os.path.exists(spool_path):
+                        os.remove(spool_path)
+                return
+            error = f"API Error {response.status_code}: {response.text}"
+            if response.status_code < 500 and response.status_code != 429:
+                # Client error: retrying would not help, drop the payloads
+                self.failed += len(batch)
+                logger.error("❌ %s", error)
+                for spool_path, _ in batch:
+                    if spool_path and os.path.exists(spool_path):
+                        os.remove(spool_path)
+                return
+        self.failed += len(batch)
+        logger.error("❌ Invio fallito dopo %s tentativi: %s", self.retries + 1, error)
+
+
+_uploaders = {}
+_uploaders_lock = threading.Lock()
+
+
+def send_prediction_data_async(image_path: str, label: str, confidence: float, api_url: str,
+                               additional_data: dict = None) -> bool:
+    """
+    Queue prediction data for sending in the background and return immediately.
+
+    Uses one PredictionUploader per api_url with default settings; call
+    flush_prediction_uploads to wait for delivery.
+
+    Parameters:
+    image_path (str): Path to the image file.
+    label (str): Predicted label.
+    confidence (float): Confidence score (0.0-1.0).
+    api_url (str): URL of the REST API endpoint.
+    additional_data (dict): Optional additional data to include in JSON.
+
+    Returns:
+    bool: True if the data was queued.
+    """
+    with _uploaders_lock:
+        uploader = _uploaders.get(api_url)
+        if uploader is None:
+            uploader = _uploaders[api_url] = PredictionUploader(api_url)
+    return uploader.submit(image_path, label, confidence, additional_data)
+
+
+def flush_prediction_uploads(timeout: float = None) -> bool:
+    """Wait until the data queued with send_prediction_data_async has been sent."""
+    with _uploaders_lock:
+        uploaders = list(_uploaders.values())
+    return all([uploader.flush(timeout) for uploader in uploaders])
+
+
+def close_prediction_uploads(timeout: float = 10) -> None:
+    """Flush and stop the uploaders used by send_prediction_data_async."""
+    with _uploaders_lock:
+        uploaders = list(_uploaders.values())
+        _uploaders.clear()
+    for uploader in uploaders:
+        uploader.close(timeout)
+
+
+atexit.register(close_prediction_uploads)
+
 
 def webcam_predict_and_send(model, camera_index: int = 0, class_names: list = None, api_url: str = "", additional_data: dict = None) -> dict:
     """
@@ -749,9 +3047,9 @@ def webcam_predict_and_send(model, camera_index: int = 0, class_names: list = No
         # Capture image from webcam
         image_path = capture_webcam_image(camera_index)
 
-        # Make predictions
-        label = predict_image_label(model, image_path, class_names)
-        confidence = predict_image_confidence(model, image_path, class_names)
+        # Make prediction (a single inference for label and confidence)
+        prediction = predict_image_result(model, image_path, class_names)
+        label, confidence = prediction.label, prediction.confidence
 
         # Send to API if URL provided
         api_response = None
@@ -764,13 +3062,14 @@ def webcam_predict_and_send(model, camera_index: int = 0, class_names: list = No
             "image_path": image_path,
             "label": label,
             "confidence": confidence,
+            "top_k": prediction.top_k(),
             "api_sent": bool(api_url),
             "api_response": api_response
         }
 
-        print(f"Prediction: {label} (confidence: {confidence:.2f})")
+        logger.info("Prediction: %s (confidence: %.2f)", label, confidence)
         if api_url:
-            print(f"API Status: {api_response.get('status', 'unknown')}")
+            logger.info("API Status: %s", api_response.get('status', 'unknown'))
 
         return result
 
@@ -783,10 +3082,369 @@ def webcam_predict_and_send(model, camera_index: int = 0, class_names: list = No
             "api_sent": False,
             "api_response": None
         }
-        print(f"❌ Workflow error: {str(e)}")
+        logger.error("❌ Workflow error: %s", e)
         return error_result
 
 
+class PredictionStream:
+    """
+    Continuous capture → predict → send pipeline on background threads.
+
+    A grab thread reads frames from the source, an inference thread classifies
+    them and an upload stage (optional) sends them through a PredictionUploader.
+    The stages are connected by bounded queues, so a slow model or a slow
+    server never blocks the camera. With drop_stale, the grab thread keeps only
+    the newest frame: when inference falls behind, older frames are discarded
+    (frames_dropped) instead of piling up and adding latency.
+
+    Results are dicts with frame_index, timestamp, frame, prediction
+    (PredictionResult), label, confidence and latency. They are yielded by
+    iterating over the stream, or passed to on_result from the inference thread.
+
+    Parameters:
+    model: The trained Keras model.
+    source: Camera index (int), path to a video file (str) or any iterable of BGR frames.
+    class_names (list): List of class names. If None, uses default classes.
+    api_url (str): URL of the REST API endpoint; empty to skip uploading (default: "").
+    additional_data (dict): Optional additional data to include in each upload.
+    on_result (callable): Called with each result instead of queueing it for iteration (optional).
+    drop_stale (bool): Keep only the newest frame when inference is busy (default: True).
+    max_fps (float): Maximum frames grabbed per second (default: None, as fast as the source).
+    max_results (int): Stop after this many predictions (default: None, until the source ends).
+    queue_size (int): Capacity of the result and upload queues (default: 8).
+    gate (FrameChangeGate): Reuse the previous prediction while the scene is unchanged (optional).
+    uploader_options (dict): Extra PredictionUploader arguments, e.g. retries or spool_dir (optional).
+        The uploader is created by start() and closed by stop().
+    """
+
+    def __init__(self, model, source=0, class_names: list = None, api_url: str = "",
+                 additional_data: dict = None, on_result=None, drop_stale: bool = True,
+                 max_fps: float = None, max_results: int = None, queue_size: int = 8,
+                 gate: FrameChangeGate = None, uploader_options: dict = None):
+        _check_inference_backend(model)
+        if isinstance(source, int) and source < 0:
+            raise ValueError("camera_index deve essere un intero non negativo.")
+        if not isinstance(source, (int, str, Path)) and not hasattr(source, '__iter__'):
+            raise ValueError("source deve essere un indice di webcam, un file video o una sequenza di frame.")
+
+        # Use provided class names or default ones
+        if class_names is None or len(class_names) == 0:
+            class_names = _DEFAULT_CLASS_NAMES
+
+        self.model = model
+        self.source = source
+        self.class_names = list(class_names)
+        self.additional_data = additional_data
+        self.on_result = on_result
+        self.drop_stale = drop_stale
+        self.max_fps = max_fps
+        self.max_results = max_results
+        self.gate = gate
+        self.api_url = api_url
+        self.uploader_options = dict(uploader_options or {})
+        self.uploader_options.setdefault('max_queue', queue_size)
+        self.uploader = None
+        self.frames_grabbed = 0
+        self.frames_dropped = 0
+        self.predicted = 0
+        self.results_dropped = 0
+        self.uploads_dropped = 0
+        self.error = None
+        self._frames = queue.Queue(maxsize=1 if drop_stale else queue_size)
+        self._results = queue.Queue(maxsize=queue_size)
+        self._uploads = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        self._uploads_closed = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self) -> bool:
+        """True while the stream is producing results."""
+        return bool(self._threads) and not self._done.is_set()
+
+    @property
+    def stats(self) -> dict:
+        """Counters of the pipeline stages."""
+        stats = {
+            "frames_grabbed": self.frames_grabbed,
+            "frames_dropped": self.frames_dropped,
+            "predicted": self.predicted,
+            "results_dropped": self.results_dropped,
+            "uploads_dropped": self.uploads_dropped,
+        }
+        if self.uploader is not None:
+            stats.update(uploads_sent=self.uploader.sent, uploads_failed=self.uploader.failed)
+        return stats
+
+    def start(self):
+        """
+        Start the background threads (called automatically when iterating).
+
+        Returns:
+        PredictionStream: The stream itself.
+        """
+        if self._threads:
+            return self
+        if self.api_url and self.uploader is None:
+            self.uploader = PredictionUploader(self.api_url, **self.uploader_options)
+        stages = [(self._grab, "learn-stream-grab"), (self._infer, "learn-stream-infer")]
+        if self.uploader is not None:
+            stages.append((self._upload, "learn-stream-upload"))
+        self._threads = [threading.Thread(target=target, name=name, daemon=True)
+                         for target, name in stages]
+        for thread in self._threads:
+            thread.start()
+        logger.info("▶️ Stream di predizioni avviato (sorgente: %s)",
+                    self.source if isinstance(self.source, (int, str, Path)) else 'frame')
+        return self
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until the source ends or max_results is reached.
+
+        Returns:
+        bool: True if the stream finished before timeout.
+        """
+        return self._done.wait(timeout)
+
+    def stop(self, timeout: float = 10) -> None:
+        """Stop the threads, release the source and flush pending uploads (within timeout seconds)."""
+        self._stop.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        # Grab, inference, then upload: the upload thread ends once it has handed
+        # every result to the uploader, and only then is the uploader closed
+        for thread in self._threads:
+            thread.join(remaining())
+        if self.uploader is not None:
+            self._uploads_closed.set()
+            self.uploader.close(remaining())
+        if self._threads:
+            self._threads = []
+            logger.info("⏹️ Stream terminato: %s predizioni, %s frame scartati",
+                        self.predicted, self.frames_dropped)
+
+    def __iter__(self):
+        self.start()
+        while True:
+            try:
+                result = self._results.get(timeout=0.1)
+            except queue.Empty:
+                if self._done.is_set() and self._results.empty():
+                    break
+                continue
+            yield result
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def _frames_from_source(self):
+        source = self.source
+        if isinstance(source, int):
+            session = get_camera_session(source)
+            owned = session is None
+            if owned:
+                session = CameraSession(source, idle_timeout=None).open()
+            try:
+                while True:
+                    yield session.read()
+            finally:
+                if owned:
+                    session.close()
+        elif isinstance(source, (str, Path)):
+            if not os.path.exists(source):
+                raise FileNotFoundError(f"Video non trovato: {source}")
+            cap = cv2.VideoCapture(str(source))
+            if not cap.isOpened():
+                cap.release()
+                raise RuntimeError(f"Impossibile aprire il video: {source}")
+            try:
+                while True:
+                    with metrics.timer("grab"):
+                        ret, frame = cap.read()
+                    if not ret:
+                        return
+                    yield frame
+            finally:
+                cap.release()
+        else:
+            yield from source
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Blocking put that gives up when the stream is stopped."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _grab(self):
+        frames = self._frames_from_source()
+        interval = 1.0 / self.max_fps if self.max_fps else 0
+        next_grab = time.monotonic()
+        try:
+            for frame in frames:
+                if self._stop.is_set():
+                    break
+                item = (self.frames_grabbed, time.time(), frame)
+                self.frames_grabbed += 1
+                if not self.drop_stale:
+                    self._put(self._frames, item)
+                else:
+                    # Replace the waiting frame, if any: inference always gets the newest one
+                    while True:
+                        try:
+                            self._frames.put_nowait(item)
+                            break
+                        except queue.Full:
+                            try:
+                                self._frames.get_nowait()
+                                self.frames_dropped += 1
+                                metrics.count("stream_frames_dropped")
+                            except queue.Empty:
+                                pass
+                if interval:
+                    next_grab += interval
+                    delay = next_grab - time.monotonic()
+                    if delay > 0:
+                        self._stop.wait(delay)
+                    else:
+                        next_grab = time.monotonic()
+        except Exception as e:
+            self.error = e
+            logger.error("❌ Errore nella cattura dei frame: %s", e)
+        finally:
+            frames.close()
+            self._put(self._frames, None)
+
+    def _infer(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    item = self._frames.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                frame_index, timestamp, frame = item
+                start = time.perf_counter()
+                if self.gate is not None:
+                    probabilities = self.gate.predict(self.model, frame)
+                else:
+                    probabilities = _predict_probabilities(self.model, frame)
+                prediction = PredictionResult(probabilities, self.class_names)
+                result = {
+                    "frame_index": frame_index,
+                    "timestamp": timestamp,
+                    "frame": frame,
+                    "prediction": prediction,
+                    "label": prediction.label,
+                    "confidence": prediction.confidence,
+                    "latency": time.perf_counter() - start
+                }
+                self.predicted += 1
+
+                if self.uploader is not None:
+                    try:
+                        self._uploads.put_nowait(result)
+                    except queue.Full:
+                        self.uploads_dropped += 1
+
+                if self.on_result is not None:
+                    self.on_result(result)
+                else:
+                    # Nobody is reading: drop the oldest result rather than stall inference
+                    while True:
+                        try:
+                            self._results.put_nowait(result)
+                            break
+                        except queue.Full:
+                            try:
+                                self._results.get_nowait()
+                                self.results_dropped += 1
+                            except queue.Empty:
+                                pass
+
+                if self.max_results is not None and self.predicted >= self.max_results:
+                    break
+        except Exception as e:
+            self.error = e
+            logger.error("❌ Errore durante la predizione: %s", e)
+        finally:
+            self._done.set()
+            # Stop grabbing; the upload stage still drains what it has
+            self._stop.set()
+            if self.uploader is not None:
+                # Never block here: the upload thread may already be gone, and it
+                # also stops on its own once _done is set and the queue is empty
+                try:
+                    self._uploads.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def _upload(self):
+        while True:
+            try:
+                result = self._uploads.get(timeout=0.1)
+            except queue.Empty:
+                if self._done.is_set():
+                    return
+                continue
+            if result is None:
+                return
+            if self._uploads_closed.is_set():
+                # stop() timed out: the uploader is closed, drop what is left
+                self.uploads_dropped += 1
+                continue
+            try:
+                self.uploader.submit(result["frame"], result["label"], result["confidence"],
+                                     self.additional_data, block=True)
+            except Exception as e:
+                if self._uploads_closed.is_set():
+                    self.uploads_dropped += 1
+                else:
+                    logger.error("❌ Errore durante l'invio: %s", e)
+
+
+def stream_predictions(model, source=0, class_names: list = None, api_url: str = "",
+                       additional_data: dict = None, max_results: int = None,
+                       max_fps: float = None, drop_stale: bool = True):
+    """
+    Classify frames continuously and yield one result per prediction.
+
+    Generator version of PredictionStream: capture, inference and upload run
+    on separate threads, and the stream is stopped when the loop ends.
+
+    Parameters:
+    model: The trained Keras model.
+    source: Camera index (int), path to a video file (str) or any iterable of BGR frames (default: 0).
+    class_names (list): List of class names. If None, uses default classes.
+    api_url (str): URL of the REST API endpoint; empty to skip uploading (default: "").
+    additional_data (dict): Optional additional data to include in each upload.
+    max_results (int): Stop after this many predictions (default: None, until the source ends).
+    max_fps (float): Maximum frames grabbed per second (default: None).
+    drop_stale (bool): Skip frames that arrive while the model is busy (default: True).
+
+    Returns:
+    generator: dicts with frame_index, timestamp, frame, prediction, label, confidence and latency.
+    """
+    with PredictionStream(model, source, class_names, api_url=api_url, additional_data=additional_data,
+                          drop_stale=drop_stale, max_fps=max_fps, max_results=max_results) as stream:
+        yield from stream
+
+
 if __name__ == "__main__":
     # Test: cattura immagine da webcam, predizione da file esistente, invio dati a API
     try:
@@ -0,0 +1,233 @@
+"""
+Lightweight latency and throughput metrics for learn and ardSerial.
+
+Stages (camera_open, grab, encode, decode, preprocess, predict, http_send,
+serial_write, serial_response_wait) are timed into histograms and events are
+counted. Metrics are disabled by default: timer() then returns a shared no-op
+context manager and count() returns immediately, so the instrumentation
+costs a flag check.
+
+Usage:
+    import metrics
+    metrics.enable()
+    ...  # run the workload
+    print(metrics.snapshot())
+    metrics.export_jsonl("metrics.jsonl")
+"""
+import bisect
+import datetime
+import json
+import threading
+import time
+
+# Histogram bucket upper bounds, in milliseconds
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+              1000, 2500, 5000, 10000)
+
+_enabled = False
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+class Histogram:
+    """
+    Latency distribution of one stage, with fixed buckets in milliseconds.
+
+    Attributes:
+    count (int): Number of observations.
+    total_ms (float): Sum of the observations.
+    min_ms (float): Fastest observation.
+    max_ms (float): Slowest observation.
+    buckets (list): Observations per bucket of BUCKETS_MS, plus one for larger values.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = float('inf')
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, ms: float) -> None:
+        """Add one observation, in milliseconds."""
+        self.count += 1
+        self.total_ms += ms
+        if ms < self.min_ms:
+            self.min_ms = ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Approximate percentile: the upper bound of the bucket holding it.
+
+        Parameters:
+        q (float): Percentile, 0-100.
+
+        Returns:
+        float: Milliseconds (capped to the slowest observation).
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS_MS + (self.max_ms,), self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        """JSON-serializable summary."""
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "min_ms": round(self.min_ms, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "buckets": {(f"<={bound}" if i < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]}"): n
+                        for i, (bound, n) in enumerate(zip(BUCKETS_MS + (None,), self.buckets)) if n},
+        }
+
+
+def enable() -> None:
+    """Start collecting metrics."""
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """Stop collecting metrics; what was collected is kept until reset()."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    """True while metrics are being collected."""
+    return _enabled
+
+
+def observe(stage: str, seconds: float) -> None:
+    """
+    Record a duration for stage.
+
+    Parameters:
+    stage (str): Stage name, e.g. "predict".
+    seconds (float): Duration in seconds.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds * 1000.0)
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Increment a counter.
+
+    Parameters:
+    name (str): Counter name, e.g. "http_retries".
+    value (int): Amount to add (default: 1).
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.stage, time.perf_counter() - self.start)
+        if exc_type is not None:
+            count(self.stage + ".errors")
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(stage: str):
+    """
+    Context manager timing a block into the histogram of stage.
+
+    Exceptions are counted as "<stage>.errors" and propagated. When metrics are
+    disabled a shared no-op object is returned.
+
+    Parameters:
+    stage (str): Stage name, e.g. "grab".
+    """
+    return _Timer(stage) if _enabled else _NULL_TIMER
+
+
+def snapshot(reset_after: bool = False) -> dict:
+    """
+    Current counters and stage histograms.
+
+    Parameters:
+    reset_after (bool): Clear the metrics after taking the snapshot (default: False).
+
+    Returns:
+    dict: {"timestamp", "enabled", "counters": {...}, "stages": {stage: summary}}.
+    """
+    with _lock:
+        data = {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "enabled": _enabled,
+            "counters": dict(_counters),
+            "stages": {stage: h.to_dict() for stage, h in sorted(_histograms.items())},
+        }
+        if reset_after:
+            _counters.clear()
+            _histograms.clear()
+    return data
+
+
+def export_jsonl(path: str, reset_after: bool = False) -> dict:
+    """
+    Append a snapshot as one JSON line to path.
+
+    Parameters:
+    path (str): JSON Lines file; created if missing.
+    reset_after (bool): Clear the metrics after exporting (default: False).
+
+    Returns:
+    dict: The exported snapshot.
+    """
+    data = snapshot(reset_after)
+    with open(path, 'a') as f:
+        f.write(json.dumps(data) + '\n')
+    return data
+
+
+def reset() -> None:
+    """Clear all counters and histograms."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
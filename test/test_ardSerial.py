@@ -0,0 +1,487 @@
+"""Tests for ardSerial. Serial tests talk to a fake robot on a pseudo-terminal."""
+import copy
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import ardSerial
+from SerialCommunication import Communication
+
+REST = ardSerial.rest
+
+
+class RecordingPort:
+    """Stands in for a Communication object and keeps the bytes written to it."""
+
+    def __init__(self):
+        self.written = []
+        ardSerial.setLinkProfile(self, {'chunk': 0, 'delay': 0, 'flush': False, 'settle': 0})
+
+    def Send_data(self, data):
+        self.written.append(bytes(data))
+
+    def frame(self):
+        data = b''.join(self.written)
+        self.written.clear()
+        return data
+
+
+@pytest.fixture
+def port():
+    recorder = RecordingPort()
+    yield recorder
+    ardSerial.portLinks.pop(recorder, None)
+
+
+# Frames produced by serialWriteNumToByte before FrameEncoder was introduced
+NUM_TO_BYTE_GOLDEN = [
+    ('K', [2, 0, 0, 1] + list(range(-60, 60, 8))[:16],
+     b'K\x02\x00\x00\x01\xc4\xcc\xd4\xdc\xe4\xec\xf4\xfc\x04\x0c\x14\x1c$,4~'),
+    ('K', [1, 0, 0, 1] + REST[4:],
+     b'K\x01\x00\x00\x01\xe2\xb0\xd3\x00\xfd\xfd\x03\x03FFFF\xc9\xc9\xc9\xc9~'),
+    ('K', [-2, 0, 0, 1, 0, 1, 0] + [10] * 20 + [126] * 16 + [1, 2, 3, 4],
+     b'K\xfe\x00\x00\x02\x00\x01\x00' + b'\x05' * 16 + b'\n' * 4 + b'?' * 16 + b'\x01\x02\x03\x04~'),
+    ('K', [3, 0, 0, 1] + [130, -127, 0, 5, 6, 7, 8, 9] * 3,
+     b'K\x03\x00\x00\x02' + b'A\xc0\x00\x02\x03\x03\x04\x04' * 3 + b'~'),
+    ('L', REST[4:], b'L\xe2\xb0\xd3\x00\xfd\xfd\x03\x03FFFF\xc9\xc9\xc9\xc9~'),
+    ('L', [1.7, -2.9] + [0] * 14, b'L\x01\xfe' + b'\x00' * 14 + b'~'),
+    ('I', [8, 50, 9, -30], b'I\x082\t\xe2~'),
+    ('B', [14, 4, 16, 8, 18, 2], b'B\x0e \x10@\x12\x10~'),
+    ('W', [200, 1, 255], b'W\xc8\x01\xff~'),
+    ('C', [0, 255, 128, 1, 3], b'C\x00\xff\x80\x01\x03~'),
+    ('c', [0, -9], b'c0 -9 \n'),
+    ('m', [0, 10, 8, -20.5, 2.5], b'm0 10 8 -20 2 \n'),
+    ('i', [], b'i\n'),
+    ('i', [8, 130], b'i8 130 \n'),
+    ('b', [10, 2], b'b10 2 \n'),
+    ('u', [1], b'u1 \n'),
+    ('t', [3.6], b't4 \n'),
+]
+
+# Frames produced by serialWriteByte before FrameEncoder was introduced
+WRITE_BYTE_GOLDEN = [
+    (['c', '1', '2'], b'c 1 2 \n'),
+    (['m', '0', '45'], b'm 0 45 \n'),
+    (['i', '8', '-20'], b'i 8 -20 \n'),
+    (['b', '1', '2'], b'b 1 2 \n'),
+    (['u', 'x'], b'u x \n'),
+    (['t', '3', '4'], b't 3 4 \n'),
+    (['L'] + [str(a) for a in REST[4:]], b'L\xe2\xb0\xd3\x00\xfd\xfd\x03\x03FFFF\xc9\xc9\xc9\xc9~'),
+    (['I', '8', '50', '9', '-30'], b'I\x082\t\xe2~'),
+    (['I8', '50'], b'I\x082~'),
+    (['kbalance'], b'kbalance\n'),
+    (['ksit'], b'ksit\n'),
+    (['w'], b'w\n'),
+    (['wabc'], b'wabc\n'),
+    (['d'], b'd\n'),
+    (['?'], b'?\n'),
+    (['g'], b'g\n'),
+    (['c'], b'c\n'),
+    (['p'], b'p\n'),
+]
+
+
+@pytest.mark.parametrize("token, var, expected", NUM_TO_BYTE_GOLDEN)
+def test_serialWriteNumToByte_golden(port, token, var, expected):
+    ardSerial.serialWriteNumToByte(port, token, copy.copy(var))
+    assert port.frame() == expected
+
+
+@pytest.mark.parametrize("var, expected", WRITE_BYTE_GOLDEN)
+def test_serialWriteByte_golden(port, var, expected):
+    ardSerial.serialWriteByte(port, copy.copy(var))
+    assert port.frame() == expected
+
+
+def test_K_rescales_large_angles_in_place(port):
+    var = [1, 0, 0, 1] + [130] * 16
+    ardSerial.serialWriteNumToByte(port, 'K', var)
+    assert var[3] == 2
+    assert var[4:] == [65] * 16
+
+
+def test_encoder_numpy_int8_matches_list():
+    encoder = ardSerial.FrameEncoder()
+    angles = np.array(REST[4:], dtype=np.int8)
+    assert bytes(encoder.binary('L', angles)) == bytes(encoder.binary('L', REST[4:]))
+
+
+def test_encoder_numpy_int8_is_not_converted(monkeypatch):
+    """int8 buffers are copied as they are, without going through struct."""
+    encoder = ardSerial.FrameEncoder()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("struct used for an int8 buffer")
+
+    monkeypatch.setattr(encoder, 'packer', fail)
+    angles = np.arange(-100, 100, dtype=np.int8)
+    assert bytes(encoder.binary('K', angles)) == b'K' + angles.tobytes() + b'~'
+
+
+def test_encoder_unsigned_and_mismatched_buffers():
+    encoder = ardSerial.FrameEncoder()
+    assert bytes(encoder.binary('W', np.array([200, 1], np.uint8), signed=False)) == b'W\xc8\x01~'
+    # int64 arrays are packed value by value
+    assert bytes(encoder.binary('I', np.array([8, -50], np.int64))) == b'I\x08\xce~'
+    with pytest.raises(struct.error):
+        encoder.binary('L', [200])
+
+
+def test_encoder_grows_its_buffer():
+    encoder = ardSerial.FrameEncoder(size=4)
+    values = list(range(-100, 100)) * 2
+    assert bytes(encoder.binary('K', values)) == b'K' + struct.pack('400b', *values) + b'~'
+
+
+class FakeRobot:
+    """
+    Robot on the master side of a pty.
+
+    Binary commands (upper-case token) end with '~', text commands with '\\n'.
+    reply(command) returns the lines sent back for each command; by default the
+    token is echoed, like the firmware does.
+    """
+
+    def __init__(self, reply=None, delay=0.0):
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave)
+        self.reply = reply or (lambda command: [command[:1].decode()])
+        self.delay = delay
+        self.commands = []
+        self.arrivals = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        buffer = b''
+        while True:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while buffer:
+                end = buffer.find(b'~' if buffer[:1].isupper() else b'\n')
+                if end < 0:
+                    break
+                command, buffer = buffer[:end + 1], buffer[end + 1:]
+                self.commands.append(command)
+                self.arrivals.append(time.perf_counter())
+                if self.delay:
+                    time.sleep(self.delay)
+                self.send(''.join(line + '\r\n' for line in self.reply(command)))
+
+    def send(self, text):
+        if text:
+            os.write(self.master, text.encode() if isinstance(text, str) else text)
+
+    def close(self):
+        # Hang up the slave side first: the pending read on the master fails and
+        # the thread exits before the master fd number can be reused by another pty
+        os.close(self.slave)
+        self.thread.join(2)
+        os.close(self.master)
+
+
+@pytest.fixture
+def robot():
+    if not hasattr(os, 'openpty'):
+        pytest.skip("needs a pseudo-terminal")
+    robots = []
+    ports = []
+
+    def connect(reply=None, delay=0.0):
+        fake = FakeRobot(reply, delay)
+        serialObject = Communication(fake.name, 115200, 1)
+        ardSerial.setLinkProfile(serialObject, 'ch340')
+        robots.append(fake)
+        ports.append(serialObject)
+        return fake, serialObject
+
+    yield connect
+    for serialObject in ports:
+        ardSerial.stopScheduler(serialObject)
+        ardSerial.portLinks.pop(serialObject, None)
+        ardSerial.goodPorts.pop(serialObject, None)
+        serialObject.Close_Engine()
+    for fake in robots:
+        fake.close()
+
+
+def test_reader_matches_token_after_chatter(robot):
+    fake, port = robot(reply=lambda command: ['IMU ready', 'battery 7.9V', command[:1].decode()])
+    assert port.Start_Reader()
+    port.Send_data(b'g\n')
+    response = ardSerial.printSerialMessage(port, 'g')
+    assert response == ['g\r\n', 'IMU ready\r\nbattery 7.9V\r\n']
+
+
+def test_reader_p_is_acknowledged_by_k(robot):
+    fake, port = robot(reply=lambda command: ['k'])
+    port.Start_Reader()
+    port.Send_data(b'p\n')
+    assert ardSerial.printSerialMessage(port, 'p')[0] == 'k\r\n'
+
+
+def test_reader_timeout_without_reply(robot):
+    fake, port = robot(reply=lambda command: [])
+    port.Start_Reader()
+    port.Send_data(b'z\n')
+    start = time.monotonic()
+    assert ardSerial.printSerialMessage(port, 'z', 0.3) == -1
+    assert 0.25 < time.monotonic() - start < 1
+
+
+def test_reader_lines_arrive_in_pieces(robot):
+    fake, port = robot(reply=lambda command: [])
+    port.Start_Reader()
+    fake.send('chat')
+    fake.send('ter\r\nm')
+    time.sleep(0.05)
+    fake.send('\r\n')
+    assert port.Read_Buffered_Line(1) == 'chatter\r\n'
+    assert port.Read_Buffered_Line(1) == 'm\r\n'
+    assert port.Read_Buffered_Line(0.05) is None
+
+
+def test_drain_buffer(robot):
+    fake, port = robot(reply=lambda command: [])
+    port.Start_Reader()
+    fake.send('old line\r\nanother\r\npartial')
+    time.sleep(0.2)
+    assert port.Drain_Buffer() == 'old line\r\nanother\r\npartial'
+    assert port.Drain_Buffer() == ''
+    assert ardSerial.readPreviousBuffer(port) == ''
+
+
+def test_send_uses_the_reader(robot):
+    fake, port = robot(reply=lambda command: ['noise', command[:1].decode()])
+    ports = {port: fake.name}
+    fake.send('boot message\r\n')
+    time.sleep(0.1)
+    assert ardSerial.send(ports, ['kbalance', 0]) == ['k\r\n', 'noise\r\n']
+    assert port.Reader_Active()
+    assert fake.commands[-1] == b'kbalance\n'
+
+
+def test_stop_reader_on_close(robot):
+    fake, port = robot()
+    port.Start_Reader()
+    assert port.Reader_Active()
+    port.Close_Engine()
+    assert not port.Reader_Active()
+    start = time.monotonic()
+    assert port.Read_Buffered_Line(5) is None
+    assert time.monotonic() - start < 0.5
+
+
+def text_reply(command):
+    """Echo the command as a chatter line, then the token."""
+    return [command.decode().strip(), command[:1].decode()]
+
+
+def test_scheduler_matches_replies_in_fifo_order(robot):
+    fake, port = robot(reply=text_reply, delay=0.01)
+    scheduler = ardSerial.CommandScheduler(port, window=3)
+    try:
+        futures = [scheduler.submit(['m', [0, i], 0]) for i in range(6)]
+        results = [future.result(5) for future in futures]
+    finally:
+        scheduler.close()
+    assert [r[0] for r in results] == ['m\r\n'] * 6
+    assert [r[1] for r in results] == ['m0 %d\r\n' % i for i in range(6)]
+
+
+def test_scheduler_respects_the_window(robot):
+    fake, port = robot(reply=lambda command: [])
+    scheduler = ardSerial.CommandScheduler(port, window=2)
+    try:
+        futures = [scheduler.submit(['m', [0, i], 0]) for i in range(4)]
+        time.sleep(0.3)
+        assert len(fake.commands) == 2
+        fake.send('m\r\n')
+        assert futures[0].result(2)[0] == 'm\r\n'
+        time.sleep(0.2)
+        assert len(fake.commands) == 3
+        assert not futures[1].done()
+        fake.send('m\r\nm\r\n')
+        assert futures[2].result(2) != -1
+        time.sleep(0.2)
+        assert len(fake.commands) == 4
+        fake.send('m\r\n')
+        assert all(future.result(2) != -1 for future in futures)
+    finally:
+        scheduler.close()
+
+
+def test_scheduler_keeps_the_pause_after_the_ack(robot):
+    fake, port = robot()
+    scheduler = ardSerial.CommandScheduler(port, window=1)
+    try:
+        first = scheduler.submit(['kbalance', 0.3])
+        second = scheduler.submit(['ksit', 0])
+        first.result(2)
+        acked = time.perf_counter()
+        second.result(2)
+    finally:
+        scheduler.close()
+    assert fake.arrivals[1] - acked >= 0.25
+
+
+def test_scheduler_timeout_then_recovers(robot):
+    fake, port = robot(reply=lambda command: [] if command.startswith(b'z') else [command[:1].decode()])
+    results = []
+    scheduler = ardSerial.CommandScheduler(port)
+    try:
+        start = time.monotonic()
+        lost = scheduler.submit(['z', 0], timeout=0.3, callback=results.append)
+        assert lost.result(2) == -1
+        assert time.monotonic() - start < 1
+        assert scheduler.submit(['g', 0]).result(2) == ['g\r\n', '']
+    finally:
+        scheduler.close()
+    assert results == [-1]
+
+
+def test_scheduler_write_error(robot):
+    fake, port = robot()
+    ports = {port: fake.name}
+    scheduler = ardSerial.getScheduler(port)
+    port.main_engine.close()
+    with pytest.raises(Exception):
+        scheduler.submit(['g', 0]).result(2)
+    assert ardSerial.sendTask(ports, port, ['g', 0]) == -1
+    assert port not in ports
+
+
+def test_scheduler_close_resolves_pending(robot):
+    fake, port = robot(reply=lambda command: [])
+    scheduler = ardSerial.CommandScheduler(port)
+    futures = [scheduler.submit(['m', [0, i], 0]) for i in range(3)]
+    time.sleep(0.1)
+    scheduler.close()
+    assert [future.result(2) for future in futures] == [-1, -1, -1]
+    assert scheduler.submit(['g', 0]).result(1) == -1
+
+
+def test_send_async(robot):
+    fake, port = robot()
+    ports = {port: fake.name}
+    futures = [ardSerial.sendAsync(ports, ['m', [0, i], 0])[port] for i in range(5)]
+    assert [future.result(2)[0] for future in futures] == ['m\r\n'] * 5
+    assert fake.commands == [b'm0 %d \n' % i for i in range(5)]
+
+
+def test_send_async_rejects_a_single_port(robot):
+    fake, port = robot()
+    with pytest.raises(ValueError):
+        ardSerial.sendAsync(port, ['g', 0])
+
+
+def tagged_reply(tag):
+    return lambda command: [tag, command[:1].decode()]
+
+
+def connect_robots(robot, count, **kwargs):
+    ports = []
+    for i in range(count):
+        fake, port = robot(reply=tagged_reply('r%d' % i), **kwargs)
+        ardSerial.goodPorts[port] = fake.name
+        ports.append((fake, port))
+    return ports
+
+
+def test_send_task_all_returns_every_port(robot):
+    robots = connect_robots(robot, 4)
+    ports = [port for _, port in robots]
+    results = ardSerial.sendTaskAll(ports, ['ksit', 0])
+    assert list(results) == ports
+    assert [results[port] for port in ports] == [['k\r\n', 'r%d\r\n' % i] for i in range(4)]
+
+
+def test_send_task_all_starts_ports_together(robot):
+    robots = connect_robots(robot, 4)
+    ardSerial.sendTaskAll([port for _, port in robots], ['ksit', 0])
+    arrivals = [fake.arrivals[0] for fake, _ in robots]
+    assert max(arrivals) - min(arrivals) < 0.05
+
+
+def test_send_task_all_failed_port_releases_the_barrier(robot):
+    robots = connect_robots(robot, 3)
+    ports = [port for _, port in robots]
+    broken = ports[1]
+    ardSerial.getScheduler(broken)
+    broken.main_engine.close()
+    start = time.monotonic()
+    results = ardSerial.sendTaskAll(ports, ['ksit', 0])
+    assert time.monotonic() - start < ardSerial.barrierTimeout / 2
+    assert results[broken] == -1
+    assert results[ports[0]][1] == 'r0\r\n'
+    assert results[ports[2]][1] == 'r2\r\n'
+    assert broken not in ardSerial.goodPorts
+
+
+def test_send_task_all_removes_failed_ports_from_the_given_dict(robot):
+    robots = connect_robots(robot, 2)
+    ports = [port for _, port in robots]
+    team = {port: ardSerial.goodPorts[port] for port in ports}
+    broken = ports[1]
+    ardSerial.getScheduler(broken)
+    broken.main_engine.close()
+    results = ardSerial.sendAll(team, ['ksit', 0])
+    assert results[broken] == -1
+    assert list(team) == [ports[0]]
+    assert broken in ardSerial.goodPorts
+
+
+def test_send_task_all_silent_port_times_out(robot):
+    robots = connect_robots(robot, 2)
+    fake, silent = robot(reply=lambda command: [])
+    ports = [port for _, port in robots] + [silent]
+    results = ardSerial.sendTaskAll(ports, ['m', [0, 10], 0], timeout=0.3)
+    assert results[silent] == -1
+    assert results[ports[0]][0] == 'm\r\n'
+    assert results[ports[1]][0] == 'm\r\n'
+    assert fake.commands == [b'm0 10 \n']
+
+
+def test_send_task_parallel_returns_the_first_port(robot):
+    fast, first = robot(reply=tagged_reply('first'), delay=0.2)
+    slow, second = robot(reply=tagged_reply('second'))
+    assert ardSerial.sendTaskParallel([first, second], ['ksit', 0]) == ['k\r\n', 'first\r\n']
+
+
+def test_send_all_splits_large_angles(robot):
+    robots = connect_robots(robot, 2)
+    results = ardSerial.sendAll(ardSerial.goodPorts, ['I', [8, 150, 9, 30], 0])
+    assert [result[0] for result in results.values()] == ['i\r\n', 'i\r\n']
+
+
+def test_remove_port_during_fan_out(robot):
+    robots = connect_robots(robot, 6, delay=0.05)
+    ports = [port for _, port in robots]
+    errors = []
+
+    def remove():
+        try:
+            for port in ports[3:]:
+                ardSerial.removePort(ardSerial.goodPorts, port)
+                time.sleep(0.01)
+        except Exception as e:
+            errors.append(e)
+
+    remover = threading.Thread(target=remove)
+    remover.start()
+    results = ardSerial.sendAll(ardSerial.goodPorts, ['ksit', 0])
+    remover.join()
+    assert errors == []
+    assert set(ardSerial.goodPorts) == set(ports[:3])
+    assert all(results[port] != -1 for port in ports[:3])
@@ -0,0 +1,1155 @@
+"""Tests for learn. Network tests run against a local HTTP stub."""
+import base64
+import contextlib
+import email.parser
+import email.policy
+import hashlib
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+import learn
+
+IMAGE = b"\xff\xd8fake jpeg\xff\xd9"
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    """Keep ~/models and the model cache inside the test folder."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    return tmp_path
+
+
+class Stub:
+    """
+    Local HTTP server; `responses` is a list of status codes served in order (then 200).
+
+    JSON bodies are decoded into `requests`; `raw` keeps (headers, body bytes) of every POST.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        self.raw = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def read_body(self):
+                if self.headers.get("Transfer-Encoding") != "chunked":
+                    return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                body = b""
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    chunk = self.rfile.read(size + 2)[:size]
+                    if not size:
+                        return body
+                    body += chunk
+
+            def do_POST(self):
+                body = self.read_body()
+                with stub.lock:
+                    stub.raw.append((dict(self.headers), body))
+                    if self.headers.get("Content-Type", "").startswith("application/json"):
+                        stub.requests.append(json.loads(body))
+                    status = stub.responses.pop(0) if stub.responses else 200
+                data = json.dumps({"status": status}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d/predictions" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = Stub()
+    yield server
+    server.close()
+
+
+def unreachable_url():
+    """URL of a local port nobody listens on."""
+    with contextlib.closing(socket.socket()) as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return "http://127.0.0.1:%d/predictions" % port
+
+
+def test_uploader_retries_server_errors(stub):
+    """A 500 is retried with backoff and the payload is then delivered."""
+    stub.responses = [500, 503]
+    with learn.PredictionUploader(stub.url, retries=3, backoff=0.01) as uploader:
+        assert uploader.submit(IMAGE, "gatto", 0.9)
+        assert uploader.flush(5)
+    assert uploader.sent == 1
+    assert uploader.failed == 0
+    assert len(stub.requests) == 3
+    assert stub.requests[-1]["label"] == "gatto"
+
+
+def test_uploader_does_not_retry_client_errors(stub):
+    stub.responses = [400]
+    with learn.PredictionUploader(stub.url, retries=3, backoff=0.01) as uploader:
+        uploader.submit(IMAGE, "gatto", 0.9)
+        uploader.flush(5)
+    assert uploader.failed == 1
+    assert len(stub.requests) == 1
+
+
+def test_uploader_spool_is_replayed(stub, tmp_path):
+    """Undelivered payloads stay in the spool and are sent by the next uploader."""
+    spool = tmp_path / "spool"
+    uploader = learn.PredictionUploader(unreachable_url(), retries=0, timeout=1, spool_dir=str(spool))
+    uploader.submit(IMAGE, "cane", 0.8)
+    uploader.submit(IMAGE, "gatto", 0.7)
+    uploader.close(5)
+    assert uploader.failed == 2
+    assert len(list(spool.glob("*.json"))) == 2
+
+    with learn.PredictionUploader(stub.url, spool_dir=str(spool)) as replay:
+        assert replay.flush(5)
+    assert sorted(r["label"] for r in stub.requests) == ["cane", "gatto"]
+    assert list(spool.glob("*.json")) == []
+
+
+def test_uploader_spool_larger_than_queue(stub, tmp_path):
+    """Replaying a spool larger than max_queue does not block; the rest stays on disk."""
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    for i in range(5):
+        (spool / ("%03d.json" % i)).write_text(json.dumps({"label": str(i)}))
+    start = time.monotonic()
+    uploader = learn.PredictionUploader(unreachable_url(), max_queue=2, retries=0, timeout=1,
+                                        spool_dir=str(spool))
+    assert time.monotonic() - start < 1
+    uploader.close(5)
+    assert len(list(spool.glob("*.json"))) == 5
+
+
+def test_uploader_close_with_unreachable_endpoint_is_bounded(tmp_path):
+    """close(timeout) returns in time even with a full queue and a dead endpoint."""
+    uploader = learn.PredictionUploader(unreachable_url(), max_queue=3, retries=5, backoff=1,
+                                        spool_dir=str(tmp_path / "spool"))
+    for i in range(10):
+        uploader.submit(IMAGE, str(i), 0.5)
+    start = time.monotonic()
+    assert uploader.close(0.5) is False
+    assert time.monotonic() - start < 3
+    assert uploader.dropped > 0
+    # everything that was not delivered is still spooled
+    assert len(list((tmp_path / "spool").glob("*.json"))) == 10
+
+
+def test_uploader_stop_marker_inside_a_batch(stub):
+    """The sender stops after the partial batch without re-queueing the marker on a full queue."""
+    uploader = learn.PredictionUploader(stub.url, max_queue=1, batch_size=3, batch_wait=1)
+    uploader.submit(IMAGE, "gatto", 0.9)
+    time.sleep(0.1)                      # the sender is waiting for the batch to fill
+    uploader._queue.put(None)
+    uploader.submit(IMAGE, "cane", 0.8, block=True)
+    uploader._thread.join(3)
+    assert not uploader._thread.is_alive()
+    assert [r["label"] for r in stub.requests[0]] == ["gatto"]
+    assert uploader.dropped == 1
+    uploader.close(1)
+
+
+def image_file(tmp_path):
+    path = tmp_path / "shot.jpg"
+    path.write_bytes(IMAGE)
+    return str(path)
+
+
+def test_send_json(stub, tmp_path):
+    response = learn.send_prediction_data(image_file(tmp_path), "gatto", 0.9, stub.url, {"robot": "nybble"})
+    assert response == {"status": 200}
+    payload = stub.requests[0]
+    assert base64.b64decode(payload["image"]) == IMAGE
+    assert (payload["label"], payload["confidence"], payload["robot"]) == ("gatto", 0.9, "nybble")
+
+
+def test_send_multipart(stub, tmp_path):
+    learn.send_prediction_data(image_file(tmp_path), "gatto", 0.9, stub.url, {"robot": "nybble"},
+                               upload_mode="multipart")
+    headers, body = stub.raw[0]
+    content_type = headers["Content-Type"]
+    assert content_type.startswith("multipart/form-data; boundary=")
+    assert content_type.split("boundary=")[1].encode() in body
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    parts = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+    assert parts["image"].get_filename() == "image.jpg"
+    assert parts["image"].get_content_type() == "image/jpeg"
+    assert parts["image"].get_payload(decode=True) == IMAGE
+    assert parts["label"].get_content() == "gatto"
+    assert parts["confidence"].get_content() == "0.9"
+    assert parts["robot"].get_content() == "nybble"
+    assert "timestamp" in parts
+
+
+def test_send_raw(stub, tmp_path):
+    learn.send_prediction_data(image_file(tmp_path), "gatto", 0.9, stub.url, {"robot": "nybble"},
+                               upload_mode="raw")
+    headers, body = stub.raw[0]
+    assert headers["Content-Type"] == "image/jpeg"
+    assert body == IMAGE
+    metadata = json.loads(headers["X-Prediction-Metadata"])
+    assert (metadata["label"], metadata["confidence"], metadata["robot"]) == ("gatto", 0.9, "nybble")
+    assert "timestamp" in metadata
+
+
+def test_send_raw_frame_is_encoded_as_jpeg(stub):
+    pytest.importorskip("cv2")
+    learn.send_prediction_data(frames(1)[0], "gatto", 0.9, stub.url, upload_mode="raw", max_side=32)
+    headers, body = stub.raw[0]
+    assert body.startswith(b"\xff\xd8") and body.endswith(b"\xff\xd9")
+
+
+def test_send_unknown_mode(stub, tmp_path):
+    with pytest.raises(ValueError):
+        learn.send_prediction_data(image_file(tmp_path), "gatto", 0.9, stub.url, upload_mode="xml")
+    assert stub.raw == []
+
+
+class ModelServer:
+    """
+    Serves model files with ETag, conditional requests and Range support.
+
+    drop_after: close the connection after sending that many bytes of the
+    first full (200) response. delay: seconds to wait before answering.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.drop_after = None
+        self.delay = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                if server.delay:
+                    time.sleep(server.delay)
+                data = server.files.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                etag = '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status, body, start = 200, data, 0
+                range_header = self.headers.get("Range")
+                if range_header and self.headers.get("If-Range") in (None, etag):
+                    start = int(range_header.split("=")[1].split("-")[0])
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header("Content-Range", "bytes */%d" % len(data))
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status, body = 206, data[start:]
+                self.send_response(status)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                if status == 206:
+                    self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(data) - 1, len(data)))
+                self.end_headers()
+                if status == 200 and server.drop_after is not None:
+                    self.wfile.write(body[:server.drop_after])
+                    self.wfile.flush()
+                    server.drop_after = None
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = "http://127.0.0.1:%d" % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def add(self, path, size=4096, seed=0):
+        rng = random.Random(seed)     # Random.randbytes needs Python 3.9
+        data = b"\x89HDF" + bytes(rng.getrandbits(8) for _ in range(size - 4))
+        self.files[path] = data
+        return self.base + path, data
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def model_server():
+    server = ModelServer()
+    yield server
+    server.close()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_is_cached_by_content(model_server):
+    url, data = model_server.add("/model.h5")
+    path = learn._download_model_from_url(url)
+    assert read(path) == data
+    assert os.path.basename(path) == hashlib.sha256(data).hexdigest() + ".h5"
+    assert learn._download_model_from_url(url) == path
+    assert len(model_server.requests) == 1
+
+
+def test_cache_hit_does_not_rewrite_the_index(model_server, monkeypatch):
+    url, data = model_server.add("/model.h5")
+    learn._download_model_from_url(url)
+    saves = []
+    monkeypatch.setattr(learn, "_save_cache_index", lambda *args: saves.append(args))
+    for _ in range(5):
+        learn._download_model_from_url(url)
+    assert saves == []
+
+
+def test_revalidation_with_304(model_server):
+    url, data = model_server.add("/model.h5")
+    path = learn._download_model_from_url(url)
+    checked = learn._load_cache_index(learn._get_model_cache_dir())[url]["checked_at"]
+    time.sleep(0.01)
+    assert learn._download_model_from_url(url, revalidate_after=0) == path
+    assert len(model_server.requests) == 2
+    assert model_server.requests[1][1].get("If-None-Match")
+    assert learn._load_cache_index(learn._get_model_cache_dir())[url]["checked_at"] > checked
+
+
+def test_revalidation_downloads_a_changed_file(model_server):
+    url, data = model_server.add("/model.h5")
+    old_path = learn._download_model_from_url(url)
+    url, new_data = model_server.add("/model.h5", seed=1)
+    new_path = learn._download_model_from_url(url, revalidate_after=0)
+    assert new_path != old_path
+    assert read(new_path) == new_data
+    assert not os.path.exists(old_path)
+
+
+def test_eviction_removes_unreferenced_files(model_server):
+    cache_dir = learn._get_model_cache_dir()
+    stray = os.path.join(cache_dir, "0" * 64 + ".keras")
+    with open(stray, "wb") as f:
+        f.write(b"PK" + bytes(5000))
+    url, data = model_server.add("/model.h5", size=1000)
+    path = learn._download_model_from_url(url, max_cache_bytes=2500)
+    assert not os.path.exists(stray)
+    assert os.path.exists(path)
+
+
+def test_checksum_pinning(model_server):
+    url, data = model_server.add("/model.h5")
+    digest = hashlib.sha256(data).hexdigest()
+    path = learn._download_model_from_url(url, sha256=digest.upper())
+    assert read(path) == data
+    # a pinned copy is never revalidated
+    assert learn._download_model_from_url(url, sha256=digest, revalidate_after=0) == path
+    assert len(model_server.requests) == 1
+
+
+def test_checksum_mismatch(model_server):
+    url, data = model_server.add("/model.h5")
+    with pytest.raises(RuntimeError, match="Checksum"):
+        learn._download_model_from_url(url, sha256="0" * 64)
+    cache_dir = learn._get_model_cache_dir()
+    assert learn._load_cache_index(cache_dir) == {}
+    assert [name for name in os.listdir(cache_dir) if name.endswith((".h5", ".part"))] == []
+
+
+def test_lru_eviction(model_server):
+    urls = [model_server.add("/m%d.h5" % i, size=1000, seed=i)[0] for i in range(3)]
+    paths = []
+    for url in urls:
+        paths.append(learn._download_model_from_url(url, max_cache_bytes=2500))
+        time.sleep(0.01)
+    index = learn._load_cache_index(learn._get_model_cache_dir())
+    assert sorted(index) == sorted(urls[1:])
+    assert not os.path.exists(paths[0])
+    assert os.path.exists(paths[1]) and os.path.exists(paths[2])
+
+
+def test_slow_download_does_not_block_cache_lookups(model_server):
+    cached_url, _ = model_server.add("/cached.h5")
+    cached_path = learn._download_model_from_url(cached_url)
+    slow_url, _ = model_server.add("/slow.h5", seed=1)
+    model_server.delay = 1
+    downloader = threading.Thread(target=learn._download_model_from_url, args=(slow_url,))
+    downloader.start()
+    time.sleep(0.2)
+    start = time.monotonic()
+    assert learn._download_model_from_url(cached_url) == cached_path
+    assert time.monotonic() - start < 0.5
+    downloader.join()
+
+
+def part_path(url):
+    return os.path.join(learn._get_model_cache_dir(),
+                        hashlib.sha256(url.encode("utf-8")).hexdigest()[:32] + ".part")
+
+
+def test_download_resumes_after_dropped_connection(model_server):
+    url, data = model_server.add("/model.h5", size=64 * 1024)
+    model_server.drop_after = 20000
+    progress = []
+    path, digest, size, _ = learn._fetch_model(
+        url, learn._get_model_cache_dir(), {}, progress=lambda *args: progress.append(args),
+        backoff=0.01)
+    assert read(path) == data
+    assert (digest, size) == (hashlib.sha256(data).hexdigest(), len(data))
+    assert len(model_server.requests) == 2
+    headers = model_server.requests[1][1]
+    assert headers["Range"] == "bytes=20000-"
+    assert headers["If-Range"]
+    assert progress[-1][:2] == (len(data), len(data))
+
+
+def test_download_restarts_after_416(model_server):
+    url, data = model_server.add("/model.h5")
+    with open(part_path(url), "wb") as f:
+        f.write(b"x" * (len(data) + 100))    # longer than the file on the server
+    path, digest, size, _ = learn._fetch_model(url, learn._get_model_cache_dir(), {}, backoff=0.01)
+    assert read(path) == data
+    assert [h.get("Range") for _, h in model_server.requests] == ["bytes=%d-" % (len(data) + 100), None]
+
+
+def test_download_restarts_when_the_file_changed(model_server):
+    url, data = model_server.add("/model.h5")
+    with open(part_path(url), "wb") as f:
+        f.write(b"old!")
+    with open(part_path(url) + ".json", "w") as f:
+        json.dump({"etag": '"stale"', "last_modified": None}, f)
+    path, digest, size, _ = learn._fetch_model(url, learn._get_model_cache_dir(), {}, backoff=0.01)
+    assert read(path) == data
+    assert len(model_server.requests) == 1
+
+
+def test_download_does_not_retry_client_errors(model_server):
+    url = model_server.base + "/missing.h5"
+    with pytest.raises(RuntimeError):
+        learn._download_model_from_url(url)
+    assert len(model_server.requests) == 1    # 404 is not retried
+
+
+def test_local_model_name_resolves_to_the_models_folder(home, tmp_path, monkeypatch):
+    cwd = tmp_path / "work"
+    cwd.mkdir()
+    (cwd / "net.keras").write_bytes(b"stray")
+    monkeypatch.chdir(cwd)
+    path = learn._get_local_model_path("net.keras")
+    assert path == os.path.join(str(home), "models", "net.keras")
+
+
+def test_absolute_model_path_is_used_as_is(tmp_path):
+    model = str(tmp_path / "elsewhere" / "net.keras")
+    assert learn._get_local_model_path(model) == model
+    assert learn._get_local_model_path("~/net.keras") == os.path.join(str(tmp_path), "net.keras")
+
+
+class CountingLoader:
+    """Loader stub for _ModelRegistry: returns a new object per load and counts the loads."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return object()
+
+
+def model_files(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / ("m%d.h5" % i)
+        path.write_bytes(b"x" * 10)
+        paths.append(str(path))
+    return paths
+
+
+def test_registry_concurrent_callers_share_one_load(tmp_path):
+    registry = learn._ModelRegistry()
+    path, = model_files(tmp_path, 1)
+    loader = CountingLoader(delay=0.2)
+    models = []
+    threads = [threading.Thread(target=lambda: models.append(registry.get_or_load(path, (), loader)))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == 1
+    assert models[0] is models[1]
+
+
+def test_registry_evicts_the_least_recently_used(tmp_path):
+    registry = learn._ModelRegistry(max_entries=2)
+    paths = model_files(tmp_path, 3)
+    loaders = [CountingLoader() for _ in paths]
+    first = registry.get_or_load(paths[0], (), loaders[0])
+    registry.get_or_load(paths[1], (), loaders[1])
+    assert registry.get_or_load(paths[0], (), loaders[0]) is first     # now most recent
+    registry.get_or_load(paths[2], (), loaders[2])                     # evicts paths[1]
+    registry.get_or_load(paths[0], (), loaders[0])
+    registry.get_or_load(paths[1], (), loaders[1])
+    assert [loader.calls for loader in loaders] == [1, 2, 1]
+
+
+def test_registry_reloads_after_invalidate(tmp_path):
+    registry = learn._ModelRegistry()
+    path, = model_files(tmp_path, 1)
+    loader = CountingLoader()
+    first = registry.get_or_load(path, (), loader)
+    assert registry.invalidate(path) == 1
+    assert registry.get_or_load(path, (), loader) is not first
+    assert loader.calls == 2
+
+
+class CountingConverter:
+    """Replaces load_model: each call is one conversion, and save() writes the .h5."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path, **kwargs):
+        self.calls += 1
+        converter = self
+
+        class Model:
+            def save(self, h5_path, save_format=None):
+                with open(h5_path, "wb") as f:
+                    f.write(b"\x89HDF converted %d" % converter.calls)
+        return Model()
+
+
+@pytest.fixture
+def converter(monkeypatch, tmp_path):
+    counting = CountingConverter()
+    monkeypatch.setattr(learn, "load_model", counting)
+    monkeypatch.setattr(learn, "_get_tf_version", lambda: "2.15.0")
+    keras_path = tmp_path / "net.keras"
+    keras_path.write_bytes(b"PK original")
+    return counting, str(keras_path)
+
+
+def test_conversion_is_skipped_when_the_manifest_matches(converter):
+    counting, keras_path = converter
+    h5_path = learn._auto_convert_keras_to_h5(keras_path)
+    assert learn._auto_convert_keras_to_h5(keras_path) == h5_path
+    assert counting.calls == 1
+    # touching the source without changing it only refreshes the manifest
+    os.utime(keras_path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    learn._auto_convert_keras_to_h5(keras_path)
+    assert counting.calls == 1
+
+
+def test_conversion_reruns_when_the_source_size_changes(converter):
+    counting, keras_path = converter
+    learn._auto_convert_keras_to_h5(keras_path)
+    with open(keras_path, "wb") as f:
+        f.write(b"PK retrained model")
+    learn._auto_convert_keras_to_h5(keras_path)
+    assert counting.calls == 2
+
+
+def test_conversion_reruns_when_the_source_mtime_and_content_change(converter):
+    counting, keras_path = converter
+    learn._auto_convert_keras_to_h5(keras_path)
+    with open(keras_path, "wb") as f:
+        f.write(b"PK modified")                 # same size as the original
+    os.utime(keras_path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    learn._auto_convert_keras_to_h5(keras_path)
+    assert counting.calls == 2
+
+
+def test_conversion_reruns_when_tensorflow_changes(converter, monkeypatch):
+    counting, keras_path = converter
+    learn._auto_convert_keras_to_h5(keras_path)
+    monkeypatch.setattr(learn, "_get_tf_version", lambda: "2.16.1")
+    learn._auto_convert_keras_to_h5(keras_path)
+    assert counting.calls == 2
+    manifest = learn._read_json(learn._auto_convert_keras_to_h5(keras_path) + ".manifest.json")
+    assert manifest["tensorflow_version"] == "2.16.1"
+    assert counting.calls == 2
+
+
+class FakeModel:
+    """Stands in for a Keras classifier: fixed probabilities for three classes."""
+
+    input_shape = (None, 32, 32, 3)
+
+    def __init__(self, probabilities=(0.1, 0.7, 0.2), delay=0.0):
+        self.probabilities = np.array([probabilities], dtype=np.float32)
+        self.delay = delay
+        self.calls = 0
+
+    def predict(self, x, **kwargs):
+        assert x.shape == (1, 32, 32, 3)
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.probabilities
+
+
+CLASSES = ["a", "b", "c"]
+
+
+def tiny_keras_model():
+    """A 32x32 classifier whose class is the dominant RGB channel."""
+    tf = pytest.importorskip("tensorflow")
+    inputs = tf.keras.Input((32, 32, 3))
+    x = tf.keras.layers.Rescaling(1 / 255.0)(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(3, activation="softmax")(x)
+    model = tf.keras.Model(inputs, outputs)
+    model.layers[-1].set_weights([np.eye(3, dtype=np.float32) * 12 - 4, np.zeros(3, np.float32)])
+    return model
+
+
+def colour_frames():
+    """BGR frames that are mostly red, green and blue, with some noise."""
+    rng = np.random.default_rng(1)
+    result = []
+    for channel in (2, 1, 0):
+        frame = rng.integers(0, 60, (32, 32, 3), dtype=np.uint8)
+        frame[..., channel] = rng.integers(150, 256, (32, 32), dtype=np.uint8)
+        result.append(frame)
+    return result
+
+
+def model_input(model, images):
+    preprocessor = learn.ImagePreprocessor(model)
+    return np.stack([preprocessor(image)[0].copy() for image in images])
+
+
+def test_inference_model_matches_keras_predict():
+    model = tiny_keras_model()
+    fast = learn.InferenceModel(model, batch_sizes=(1, 4))
+    images = colour_frames() * 2
+    x = model_input(model, images)
+    for batch in (x[:1], x[:4], x):         # batch of 6 runs as 4 + 1 + 1
+        expected = model.predict(batch, verbose=0)
+        assert np.allclose(fast.predict(batch), expected, atol=1e-6)
+    assert fast.input_shape == model.input_shape
+
+
+def test_tflite_round_trip(tmp_path):
+    pytest.importorskip("tensorflow")
+    model = tiny_keras_model()
+    keras_path = str(tmp_path / "tiny.h5")
+    model.save(keras_path)
+    x = model_input(model, colour_frames())
+    expected = model.predict(x, verbose=0)
+
+    path = learn.convert_model_format(keras_path, str(tmp_path / "tiny.tflite"), "tflite")
+    lite = learn.TFLiteModel(path)
+    assert lite.input_shape == (None, 32, 32, 3)
+    assert np.allclose(lite.predict(x[:1]), expected[:1], atol=1e-5)
+    assert np.allclose(lite.predict(x), expected, atol=1e-5)      # resized to a batch of 3
+
+
+def test_tflite_int8_round_trip(tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    pytest.importorskip("tensorflow")
+    model = tiny_keras_model()
+    keras_path = str(tmp_path / "tiny.h5")
+    model.save(keras_path)
+    captures = tmp_path / "captures"
+    captures.mkdir()
+    for i, image in enumerate(colour_frames() * 4):
+        cv2.imwrite(str(captures / ("%02d.png" % i)), image)
+    x = model_input(model, colour_frames())
+    expected = model.predict(x, verbose=0)
+
+    path = learn.convert_model_format(keras_path, str(tmp_path / "tiny_int8.tflite"), "tflite",
+                                      quantization="int8", representative_dir=str(captures))
+    lite = learn.TFLiteModel(path)
+    assert lite._input["dtype"] == np.int8 and lite._output["dtype"] == np.int8
+    result = lite.predict(x)
+    assert result.dtype == np.float32
+    assert list(result.argmax(axis=1)) == list(expected.argmax(axis=1)) == [0, 1, 2]
+    assert np.allclose(result, expected, atol=0.05)
+
+
+def test_tflite_quantize_and_dequantize():
+    details = {"dtype": np.int8, "quantization": (0.5, -10)}
+    x = np.array([-100.0, 0.0, 1.0, 100.0], np.float32)
+    q = learn.TFLiteModel._quantize(x, details)
+    assert q.dtype == np.int8
+    assert list(q) == [-128, -10, -8, 127]                     # clipped to the int8 range
+    assert list(learn.TFLiteModel._dequantize(q, details)) == [-59.0, 0.0, 1.0, 68.5]
+    floats = {"dtype": np.float32, "quantization": (0.0, 0)}
+    assert learn.TFLiteModel._quantize(x, floats) is x
+
+
+def frames(count):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (48, 64, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def baseline_preprocess(frame, size=224):
+    """The preprocessing ImagePreprocessor replaced."""
+    cv2 = pytest.importorskip("cv2")
+    image = cv2.resize(frame, (size, size))
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    img_array = learn.img_to_array(image)
+    img_array = np.expand_dims(img_array, axis=0)
+    return learn.preprocess_input(img_array)
+
+
+@pytest.mark.parametrize("shape", [(48, 64, 3), (224, 224, 3), (480, 640, 3)])
+def test_preprocessor_matches_the_baseline(shape):
+    pytest.importorskip("cv2")
+    frame = np.random.default_rng(2).integers(0, 256, shape, dtype=np.uint8)
+    preprocessor = learn.ImagePreprocessor(size=(224, 224))
+    expected = baseline_preprocess(frame)
+    result = preprocessor(frame)
+    assert result.shape == expected.shape == (1, 224, 224, 3)
+    assert result.dtype == np.float32
+    assert np.abs(result - expected).max() == 0
+
+
+def test_preprocessor_normalizations():
+    pytest.importorskip("cv2")
+    frame = frames(1)[0]
+    expected = baseline_preprocess(frame, 32)
+    tf_style = learn.ImagePreprocessor(size=(32, 32), normalization="tf")(frame)
+    assert np.allclose(tf_style, expected / 127.5 - 1, atol=1e-6)
+    unit = learn.ImagePreprocessor(size=(32, 32), normalization="unit")(frame)
+    assert np.allclose(unit, expected / 255.0, atol=1e-6)
+    with pytest.raises(ValueError):
+        learn.ImagePreprocessor(size=(32, 32), normalization="caffe")
+
+
+def test_preprocessor_buffers_are_per_thread():
+    pytest.importorskip("cv2")
+    preprocessor = learn.ImagePreprocessor(size=(32, 32))
+    images = frames(4)
+    barrier = threading.Barrier(len(images))
+    outcomes = [None] * len(images)
+
+    def work(i):
+        batch = preprocessor(images[i])
+        barrier.wait()                 # every thread has written its buffer
+        outcomes[i] = (id(batch), np.array_equal(batch, baseline_preprocess(images[i], 32)))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({buffer for buffer, _ in outcomes}) == len(images)
+    assert all(same for _, same in outcomes)
+
+
+@pytest.fixture
+def memo():
+    learn.clear_prediction_memo()
+    yield
+    learn.clear_prediction_memo()
+
+
+def test_label_and_confidence_of_a_file_share_one_inference(memo, tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    path = str(tmp_path / "shot.png")
+    cv2.imwrite(path, frames(1)[0])
+    model = FakeModel()
+    assert learn.predict_image_label(model, path, CLASSES) == "b"
+    assert learn.predict_image_confidence(model, path, CLASSES) == pytest.approx(0.7)
+    assert model.calls == 1
+
+
+def test_a_rewritten_file_misses_the_memo(memo, tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    path = str(tmp_path / "shot.png")
+    first, second = frames(2)
+    cv2.imwrite(path, first)
+    model = FakeModel()
+    learn.predict_image_label(model, path, CLASSES)
+    cv2.imwrite(path, np.vstack([second, second]))
+    learn.predict_image_confidence(model, path, CLASSES)
+    assert model.calls == 2
+
+
+def test_label_and_confidence_of_a_frame_share_one_inference(memo):
+    pytest.importorskip("cv2")
+    frame, other = frames(2)
+    model = FakeModel()
+    assert learn.predict_label_from_frame(model, frame, CLASSES) == "b"
+    assert learn.predict_confidence_from_frame(model, frame, CLASSES) == pytest.approx(0.7)
+    assert model.calls == 1
+    learn.predict_confidence_from_frame(model, other, CLASSES)
+    assert model.calls == 2
+    learn.predict_confidence_from_frame(model, frame.copy(), CLASSES)   # same pixels, new frame
+    assert model.calls == 3
+
+
+def test_gate_skips_inference_for_unchanged_frames():
+    pytest.importorskip("cv2")
+    gate = learn.FrameChangeGate(threshold=4.0)
+    model = FakeModel()
+    frame, other = frames(2)
+    first = gate.predict(model, frame)
+    assert gate.predict(model, frame.copy()) is first            # identical frame: hit
+    noisy = np.clip(frame.astype(np.int16) + 1, 0, 255).astype(np.uint8)
+    gate.predict(model, noisy)                                    # nearly identical: hit
+    assert model.calls == 1
+    gate.predict(model, other)                                    # clearly changed: miss
+    assert model.calls == 2
+    assert gate.stats == {"hits": 2, "misses": 2, "hit_rate": 0.5}
+
+
+def test_gate_threshold():
+    pytest.importorskip("cv2")
+    frame = np.full((48, 64, 3), 100, np.uint8)
+    brighter = frame + 10
+    model = FakeModel()
+    gate = learn.FrameChangeGate(threshold=12)
+    gate.predict(model, frame)
+    assert gate.difference(brighter) == pytest.approx(10, abs=0.5)
+    gate.predict(model, brighter)
+    assert model.calls == 1
+    gate = learn.FrameChangeGate(threshold=8)
+    gate.predict(model, frame)
+    gate.predict(model, brighter)
+    assert model.calls == 3
+
+
+def test_gate_max_age_forces_a_refresh():
+    pytest.importorskip("cv2")
+    gate = learn.FrameChangeGate(max_age=0.1)
+    model = FakeModel()
+    frame = frames(1)[0]
+    gate.predict(model, frame)
+    gate.predict(model, frame)
+    assert model.calls == 1
+    time.sleep(0.15)
+    gate.predict(model, frame)
+    assert model.calls == 2
+
+
+def test_gate_runs_the_model_again_for_another_model():
+    pytest.importorskip("cv2")
+    gate = learn.FrameChangeGate()
+    frame = frames(1)[0]
+    first, second = FakeModel(), FakeModel((0.8, 0.1, 0.1))
+    gate.predict(first, frame)
+    assert learn.PredictionResult(gate.predict(second, frame), CLASSES).label == "a"
+    assert (first.calls, second.calls) == (1, 1)
+
+
+class ColourModel:
+    """Batch-capable FakeModel: the class is the dominant RGB channel of each image."""
+
+    input_shape = (None, 32, 32, 3)
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, x, **kwargs):
+        self.batches.append(len(x))
+        means = x.mean(axis=(1, 2))
+        return means / means.sum(axis=1, keepdims=True)
+
+
+def test_batch_prediction_keeps_order_across_batches(tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    paths = []
+    for i, image in enumerate(colour_frames() * 2 + colour_frames()[:1]):
+        path = str(tmp_path / ("%02d.png" % i))
+        cv2.imwrite(path, image)
+        paths.append(path)
+    with open(paths[3], "wb") as f:
+        f.write(b"not an image")
+    model = ColourModel()
+    results = learn.predict_images_batch(model, paths, ["red", "green", "blue"], batch_size=3, workers=2)
+    assert [path for path, _ in results] == paths
+    assert results[3][1] is None
+    labels = [result.label for _, result in results if result is not None]
+    assert labels == ["red", "green", "blue", "green", "blue", "red"]
+    assert model.batches == [3, 2, 1]      # the unreadable image is left out of its batch
+
+
+@pytest.fixture
+def errors():
+    """Error messages logged by learn."""
+    import logging
+
+    class Collect(logging.Handler):
+        def __init__(self):
+            super().__init__(logging.ERROR)
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    handler = Collect()
+    learn.logger.addHandler(handler)
+    yield handler.messages
+    learn.logger.removeHandler(handler)
+
+
+def test_stream_from_synthetic_frames():
+    pytest.importorskip("cv2")
+    model = FakeModel()
+    results = list(learn.stream_predictions(model, frames(12), CLASSES, drop_stale=False))
+    assert [r["frame_index"] for r in results] == list(range(12))
+    assert {r["label"] for r in results} == {"b"}
+    assert model.calls == 12
+
+
+def test_stream_drops_stale_frames():
+    pytest.importorskip("cv2")
+    stream = learn.PredictionStream(FakeModel(delay=0.02), frames(40), CLASSES)
+    with stream:
+        results = list(stream)
+    stats = stream.stats
+    assert stats["frames_grabbed"] == 40
+    assert stats["predicted"] + stats["frames_dropped"] == 40
+    assert stats["frames_dropped"] > 0
+    assert [r["frame_index"] for r in results] == sorted(r["frame_index"] for r in results)
+
+
+def test_stream_early_break_stops_the_threads():
+    pytest.importorskip("cv2")
+    before = threading.active_count()
+    for result in learn.stream_predictions(FakeModel(), iter(frames(1000)), CLASSES, drop_stale=False):
+        break
+    time.sleep(0.2)
+    assert threading.active_count() <= before
+
+
+def test_stream_from_video_file(tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+    if not writer.isOpened():
+        pytest.skip("no video encoder available")
+    for frame in frames(8):
+        writer.write(frame)
+    writer.release()
+    results = list(learn.stream_predictions(FakeModel(), path, CLASSES, drop_stale=False))
+    assert len(results) == 8
+
+
+def test_stream_missing_video_raises():
+    pytest.importorskip("cv2")
+    with pytest.raises(FileNotFoundError):
+        list(learn.stream_predictions(FakeModel(), "/nonexistent/clip.avi", CLASSES))
+
+
+def test_stream_uploads_every_result(stub, errors):
+    pytest.importorskip("cv2")
+    stream = learn.PredictionStream(FakeModel(), frames(5), CLASSES, api_url=stub.url, drop_stale=False)
+    with stream:
+        results = list(stream)
+    assert len(results) == 5
+    assert stream.stats["uploads_sent"] == 5
+    assert sorted(r["label"] for r in stub.requests) == ["b"] * 5
+    assert errors == []
+
+
+def test_stream_stop_with_slow_endpoint_is_quiet(errors):
+    pytest.importorskip("cv2")
+    stream = learn.PredictionStream(FakeModel(), frames(30), CLASSES, api_url=unreachable_url(),
+                                    drop_stale=False, queue_size=2,
+                                    uploader_options={"retries": 5, "backoff": 1})
+    stream.start()
+    stream.wait(5)
+    start = time.monotonic()
+    stream.stop(timeout=0.5)
+    assert time.monotonic() - start < 3
+    assert not any("già chiuso" in message for message in errors)
+
+
+class FakeCapture:
+    """Stands in for cv2.VideoCapture and counts the devices opened."""
+
+    opened = []
+
+    def __init__(self, index):
+        self.index = index
+        self.released = False
+        self.reads = 0
+        FakeCapture.opened.append(self)
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        return True
+
+    def read(self):
+        self.reads += 1
+        return True, frames(1)[0]
+
+    def release(self):
+        self.released = True
+
+
+@pytest.fixture
+def camera(monkeypatch):
+    pytest.importorskip("cv2")
+    FakeCapture.opened = []
+    monkeypatch.setattr(learn.cv2, "VideoCapture", FakeCapture)
+    yield FakeCapture.opened
+    learn.close_camera()
+
+
+def test_stable_prediction_keeps_the_camera_open(camera):
+    model = FakeModel()
+    for _ in range(3):
+        result = learn.webcam_predict_stable(model, 0, CLASSES, max_frames=3, threshold=10)
+        assert result.label == "b"
+    assert len(camera) == 1
+    assert camera[0].reads == 9 and not camera[0].released
+    assert learn.get_camera_session(0) is not None
+
+
+def test_stable_prediction_reuses_the_open_session(camera):
+    session = learn.open_camera(0)
+    learn.webcam_predict_stable(FakeModel(), 0, CLASSES, max_frames=2)
+    assert learn.get_camera_session(0) is session
+    assert len(camera) == 1
+
+
+def test_camera_reopen_after_close_restarts_the_idle_watcher(camera):
+    session = learn.CameraSession(0, idle_timeout=0.1, warmup_frames=0).open()
+    old_watcher = session._watcher
+    session.close()
+    session.open()                       # the old watcher has not noticed close() yet
+    assert session._watcher is not old_watcher and session._watcher.is_alive()
+    time.sleep(0.5)
+    assert not session.is_open           # released by the new watcher
+    assert not old_watcher.is_alive()
+    session.close()
+
+
+def test_opening_a_second_session_closes_the_registered_one(camera):
+    first = learn.open_camera(0)
+    second = learn.CameraSession(0).open()
+    assert camera[0].released and not first.is_open
+    assert learn.get_camera_session(0) is second
+    assert learn.open_camera(0) is second
+
+
+def test_stream_uploader_starts_with_the_stream(stub):
+    pytest.importorskip("cv2")
+    before = threading.active_count()
+    stream = learn.PredictionStream(FakeModel(), frames(3), CLASSES, api_url=stub.url, drop_stale=False)
+    assert stream.uploader is None
+    assert threading.active_count() == before
+    with stream:
+        list(stream)
+    assert stream.stats["uploads_sent"] == 3
+
+
+def test_stream_inference_does_not_wait_for_a_dead_upload_thread(stub, monkeypatch):
+    pytest.importorskip("cv2")
+    stream = learn.PredictionStream(FakeModel(), frames(20), CLASSES, api_url=stub.url,
+                                    drop_stale=False, queue_size=1)
+    monkeypatch.setattr(stream, "_upload", lambda: None)    # the upload stage died at once
+    stream.start()
+    assert stream.wait(3)
+    infer = [t for t in stream._threads if t.name == "learn-stream-infer"][0]
+    infer.join(1)
+    assert not infer.is_alive()
+    stream.stop(1)
+
+
+@pytest.fixture
+def learn_log(caplog):
+    """caplog for the learn logger, which does not propagate to the root logger."""
+    level = learn.logger.level
+    learn.logger.addHandler(caplog.handler)
+    yield caplog
+    learn.logger.removeHandler(caplog.handler)
+    learn.logger.setLevel(level)
+
+
+def test_quiet_mode_keeps_only_warnings_and_errors(learn_log, capsys, tmp_path):
+    pytest.importorskip("cv2")
+    learn.set_verbosity("quiet")
+    learn.predict_frame_result(FakeModel(), frames(1)[0], CLASSES, use_memo=False)
+    learn.send_prediction_data(IMAGE, "gatto", 0.9, unreachable_url())
+    levels = {record.levelno for record in learn_log.records}
+    assert levels == {logging.ERROR}
+    assert "Connection error" in learn_log.text
+    out = capsys.readouterr().out
+    assert "Classe predetta" not in out and "Connection error" in out
+    assert learn._predict_options() == {"verbose": 0}
+
+
+def test_info_mode_prints_predictions(learn_log, capsys):
+    pytest.importorskip("cv2")
+    learn.set_verbosity("info")
+    learn.predict_frame_result(FakeModel(), frames(1)[0], CLASSES, use_memo=False)
+    assert "Classe predetta: b" in learn_log.text
+    assert "Classe predetta: b" in capsys.readouterr().out
+    assert learn._predict_options() == {}
+
+
+def test_silent_mode_and_invalid_levels(learn_log):
+    learn.set_verbosity("silent")
+    learn.send_prediction_data(IMAGE, "gatto", 0.9, unreachable_url())
+    assert learn_log.records == []
+    with pytest.raises(ValueError):
+        learn.set_verbosity("loud")
+
+
+def test_open_camera_applies_idle_timeout_to_the_open_session(camera):
+    session = learn.open_camera(0)
+    assert session.idle_timeout == 30.0
+    assert learn.open_camera(0, idle_timeout=0.1) is session
+    learn.webcam_predict_stable(FakeModel(), 0, CLASSES, max_frames=1)   # keeps the new value
+    assert session.idle_timeout == 0.1
+    time.sleep(1.5)                      # the watcher ticks at most every second
+    assert not session.is_open
+
+
+def test_open_camera_can_disable_the_idle_timeout(camera):
+    session = learn.open_camera(0, idle_timeout=0.1)
+    watcher = session._watcher
+    learn.open_camera(0, idle_timeout=0)
+    time.sleep(0.5)
+    assert session.is_open
+    assert not watcher.is_alive()
@@ -0,0 +1,103 @@
+"""Tests for metrics: histogram buckets and percentiles, disabled mode and JSON Lines export."""
+import json
+
+import pytest
+
+import metrics
+
+SAMPLES_MS = [0.05, 0.3, 0.3, 3, 3, 3, 20, 20, 200, 20000]
+
+
+@pytest.fixture
+def enabled():
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def histogram(samples):
+    h = metrics.Histogram()
+    for ms in samples:
+        h.observe(ms)
+    return h
+
+
+def test_buckets():
+    h = histogram(SAMPLES_MS)
+    assert h.count == 10
+    assert h.min_ms == 0.05 and h.max_ms == 20000
+    summary = h.to_dict()
+    assert summary["buckets"] == {"<=0.1": 1, "<=0.5": 2, "<=5": 3, "<=25": 2, "<=250": 1, ">10000": 1}
+    assert summary["mean_ms"] == pytest.approx(2024.965)
+
+
+def test_bucket_bounds_are_inclusive():
+    h = histogram([0.1, 5, 10000])
+    assert h.to_dict()["buckets"] == {"<=0.1": 1, "<=5": 1, "<=10000": 1}
+
+
+def test_percentiles():
+    h = histogram(SAMPLES_MS)
+    assert h.percentile(50) == 5
+    assert h.percentile(90) == 250
+    assert h.percentile(99) == 20000        # overflow bucket: the slowest observation
+    summary = h.to_dict()
+    assert (summary["p50_ms"], summary["p90_ms"], summary["p99_ms"]) == (5, 250, 20000)
+
+
+def test_percentile_is_capped_to_the_slowest_observation():
+    assert histogram([3]).percentile(50) == 3
+    assert metrics.Histogram().percentile(50) == 0.0
+    assert metrics.Histogram().to_dict()["min_ms"] == 0.0
+
+
+def test_disabled_metrics_are_no_ops():
+    metrics.disable()
+    metrics.reset()
+    assert metrics.timer("grab") is metrics.timer("predict")
+    with metrics.timer("grab"):
+        pass
+    metrics.count("predictions")
+    metrics.observe("grab", 0.01)
+    data = metrics.snapshot()
+    assert data["enabled"] is False
+    assert data["counters"] == {} and data["stages"] == {}
+
+
+def test_timer_and_counters(enabled):
+    metrics.observe("predict", 0.003)
+    metrics.observe("predict", 0.020)
+    metrics.count("predictions")
+    metrics.count("predictions", 4)
+    with pytest.raises(RuntimeError):
+        with metrics.timer("grab"):
+            raise RuntimeError("camera")
+    data = metrics.snapshot()
+    assert data["enabled"] is True
+    assert data["counters"] == {"predictions": 5, "grab.errors": 1}
+    assert data["stages"]["predict"]["count"] == 2
+    assert data["stages"]["predict"]["buckets"] == {"<=5": 1, "<=25": 1}
+    assert data["stages"]["grab"]["count"] == 1
+
+
+def test_snapshot_reset_after(enabled):
+    metrics.count("predictions")
+    assert metrics.snapshot(reset_after=True)["counters"] == {"predictions": 1}
+    assert metrics.snapshot()["counters"] == {}
+
+
+def test_export_jsonl(enabled, tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    metrics.observe("predict", 0.003)
+    first = metrics.export_jsonl(path, reset_after=True)
+    metrics.count("predictions")
+    metrics.export_jsonl(path)
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 2
+    assert lines[0] == first
+    assert lines[0]["stages"]["predict"]["count"] == 1
+    assert lines[1]["stages"] == {}
+    assert lines[1]["counters"] == {"predictions": 1}